@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+
+"""
+This application runs the operations of the console tools for many devices
+without a console.  The jobs come from a CSV or JSON file with one row per
+device and operation, they are sent with a limit on the number of requests
+in flight overall and to each device, and the results are written as JSON
+lines as they come in.  With --window-stats the depth of the queue and the
+time the requests waited for each device are written to stderr at the end.
+
+With --workers the jobs are split between worker processes, each one with
+its own stack on the port of the INI address plus the worker number and the
+device identifier plus the worker number, the results all come out of the
+parent.
+
+Exemple: DeltaBatch.py jobs.csv --max-outstanding 32 --output results.jsonl
+"""
+
+import sys
+import json
+
+from time import time as _time
+
+from bacpypes.debugging import bacpypes_debugging, ModuleLogger
+from bacpypes.consolelogging import ConfigArgumentParser
+
+from bacpypes.core import stop, deferred
+from bacpypes.iocb import IOCB
+
+from bacpypes.app import BIPSimpleApplication
+from bacpypes.service.device import LocalDeviceObject
+
+import engine
+from engine.loop import run
+from engine.app import WindowedIOController
+from engine.appservice import index_transactions
+from fleet.jobs import load_jobs
+from fleet.scheduler import IOCBScheduler
+from fleet.shard import Supervisor, shard_jobs, shard_address
+
+# some debugging
+_debug = 0
+_log = ModuleLogger(globals())
+
+# globals
+this_application = None
+
+#
+#   BatchApplication
+#
+
+@bacpypes_debugging
+class BatchApplication(WindowedIOController, BIPSimpleApplication):
+
+    def __init__(self, jobs, output, localDevice, localAddress,
+            max_outstanding=16, max_per_device=1):
+        if _debug: BatchApplication._debug("__init__ (%d jobs) %r %r %r", len(jobs), output, localDevice, localAddress)
+        super(BatchApplication, self).__init__(localDevice, localAddress,
+            window=max_per_device)
+
+        # find the transactions by address and invoke ID
+        index_transactions(self)
+
+        self.jobs = jobs
+        self.output = output
+
+        # jobs not finished yet
+        self.unfinished = len(jobs)
+
+        # limit the number of requests in flight, the window of each device
+        # is the limit for the device
+        self.scheduler = IOCBScheduler(self, max_outstanding, None)
+
+    def start(self):
+        if _debug: BatchApplication._debug("start")
+
+        if not self.jobs:
+            stop()
+            return
+
+        for job in self.jobs:
+            try:
+                request = job.operation.request(job.address, **job.params)
+                if _debug: BatchApplication._debug("    - request: %r", request)
+            except Exception as error:
+                BatchApplication._exception("exception: %r", error)
+                self.finish(job, _time(), error=str(error))
+                continue
+
+            # make an IOCB
+            iocb = IOCB(request)
+
+            # set a callback for the response
+            iocb.add_callback(self.job_complete, job, _time())
+
+            # the scheduler sends it when there is room
+            self.scheduler.request_io(iocb)
+
+    def job_complete(self, iocb, job, started):
+        if _debug: BatchApplication._debug("job_complete %r %r", iocb, job)
+
+        # do something for error/reject/abort
+        if iocb.ioError:
+            self.finish(job, started, error=str(iocb.ioError))
+            return
+
+        try:
+            result = job.operation.response(iocb.ioResponse)
+        except Exception as error:
+            self.finish(job, started, error=str(error))
+        else:
+            self.finish(job, started, result=result)
+
+    def finish(self, job, started, result=None, error=None):
+        if _debug: BatchApplication._debug("finish %r %r %r", job, result, error)
+
+        line = {
+            'job': job.index,
+            'operation': job.operation.name,
+            'address': job.address,
+            'device': job.device,
+            'ok': error is None,
+            'elapsed': round(_time() - started, 3),
+            }
+        if error is None:
+            line['result'] = result
+        else:
+            line['error'] = error
+
+        self.output.write(json.dumps(line, sort_keys=True, default=str) + '\n')
+        self.output.flush()
+
+        # stop when every job is done
+        self.unfinished -= 1
+        if not self.unfinished:
+            stop()
+
+#
+#   run_jobs
+#
+
+def run_jobs(args, jobs, output, index=0):
+    """Make the application and run the jobs, worker number index has the
+    port and device identifier of the INI plus the index."""
+    global this_application
+    if _debug: _log.debug("run_jobs (%d jobs) %r %r", len(jobs), output, index)
+
+    # make a device object
+    this_device = LocalDeviceObject(
+        objectName=args.ini.objectname,
+        objectIdentifier=int(args.ini.objectidentifier) + index,
+        maxApduLengthAccepted=int(args.ini.maxapdulengthaccepted),
+        segmentationSupported=args.ini.segmentationsupported,
+        vendorIdentifier=int(args.ini.vendoridentifier),
+        )
+
+    # make a simple application
+    this_application = BatchApplication(
+        jobs, output,
+        this_device, shard_address(args.ini.address, index) if index else args.ini.address,
+        max_outstanding=args.max_outstanding,
+        max_per_device=args.max_per_device,
+        )
+    if _debug: _log.debug("    - this_application: %r", this_application)
+
+    # get the services supported
+    services_supported = this_application.get_services_supported()
+    if _debug: _log.debug("    - services_supported: %r", services_supported)
+
+    # let the device object know
+    this_device.protocolServicesSupported = services_supported.value
+
+    # send the jobs when the core is running
+    deferred(this_application.start)
+
+    _log.debug("running")
+
+    run()
+
+    this_application.close_socket()
+
+    if args.window_stats:
+        sys.stderr.write(json.dumps(this_application.window_metrics(), sort_keys=True) + '\n')
+        sys.stderr.flush()
+
+#
+#   __main__
+#
+
+def main():
+
+    # parse the command line arguments
+    parser = ConfigArgumentParser(description=__doc__)
+
+    parser.add_argument('jobs', type=str,
+        help='CSV or JSON job file',
+        )
+    parser.add_argument('--output', type=str,
+        help='file for the JSON lines, defaults to stdout',
+        )
+
+    # limits for requests in flight
+    parser.add_argument('--max-outstanding', type=int,
+        default=16,
+        help='maximum number of requests in flight',
+        )
+    parser.add_argument('--max-per-device', type=int,
+        default=1,
+        help='maximum number of requests in flight to one device',
+        )
+    parser.add_argument('--window-stats', action='store_true',
+        default=False,
+        help='write the queue depth and wait time of each device to stderr',
+        )
+
+    # worker processes
+    parser.add_argument('--workers', type=int,
+        default=1,
+        help='number of worker processes, each with its own stack',
+        )
+
+    args = parser.parse_args()
+
+    if _debug: _log.debug("initialization")
+    if _debug: _log.debug("    - args: %r", args)
+
+    # the engine changes to the library and the compiled codecs of the
+    # property services, before any PDU is made
+    engine.install(codecs=True)
+
+    # check the whole file before anything is sent
+    jobs = load_jobs(args.jobs)
+    if _debug: _log.debug("    - %d jobs", len(jobs))
+
+    output = open(args.output, 'a') if args.output else sys.stdout
+
+    if args.workers > 1:
+        # each worker runs its shard, the parent writes the results
+        supervisor = Supervisor(
+            lambda index, shard, worker_output: run_jobs(args, shard, worker_output, index + 1),
+            shard_jobs(jobs, args.workers),
+            output,
+            )
+        failed = supervisor.run()
+        if failed:
+            sys.stderr.write("%d workers failed\n" % (failed,))
+    else:
+        run_jobs(args, jobs, output)
+
+    if output is not sys.stdout:
+        output.close()
+
+    _log.debug("fini")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1518 @@
+#!/usr/bin/env python
+
+"""
+This application measures how fast the tools get through a farm of simulated
+Delta controllers.  The farm is on a virtual network in this process, so no
+controller or network is touched and there is no INI file.  Each flow runs
+on a new farm and the results are written as JSON lines.
+
+    read    DeltaBatch read-net job for every device
+    write   DeltaBatch write-net of the proxy IP for every device
+    flash   DeltaBatch SaveToFlash for every device
+    proxy   DeltaIPProxyChecker with a fixed public IP
+    publicip the public IP resolver with providers served by a local HTTP
+            server, two that agree and one that does not, checking the
+            quorum, the time to live and the failures
+    timers  tasks that are all due at once, like the segmentation timers
+    wakeup  work given to the loop by another thread, like a console command
+    flood   a burst of deferred functions, like the I-Am's of a global Who-Is,
+            with a timer that comes due in the middle of it
+    decode  ReadProperty ACK's of object lists and ReadPropertyMultiple
+            ACK's from 50 to 1500 octets decoded with the bacpypes core,
+            the cursor of the PDU data, the cursor of the tag lists and
+            the compiled codecs
+    codec   the sequences and choices the tools use the most and the
+            services that carry them, encoded and decoded by bacpypes and
+            by the compiled codecs
+    smap    confirmations matched to the requests in flight, with the
+            bacpypes StateMachineAccessPoint and the indexed one
+    segment object lists read in segments between two state machine
+            access points, the bacpypes ones and the indexed ones
+    memory  the bytes of a cache of present values, like the one of a
+            gateway, with the classes of bacpypes and the compact ones
+    churn   timers suspended and installed again, like restart_timer()
+
+The flows run with the bacpypes core loop, the core loop with sleeping
+enabled the way the scripts used to run it, or the engine loop with one of
+its backends, run it with --loop core and then --loop epoll to compare.
+Likewise --task-manager heap, indexed or wheel for the task manager.  With
+--metrics the engine loop is measured and its metrics go to stderr.  With
+--workers the read, write and flash flows are split between processes.
+The flows run with engine.install(), and with the compiled codecs too with
+--codecs, the decode, codec and memory flows put them back the way they were
+when they are done.  The smap flow does not run a loop, use --task-manager indexed so the timers of
+the transactions cost the same with any number of them.
+
+Exemple: DeltaBenchmark.py --devices 500 --latency 0.02 --flows read,proxy
+"""
+
+import gc
+import sys
+import json
+import random
+import socket
+import resource
+import threading
+import types
+
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from time import time as _time, sleep as _sleep
+from collections import deque
+from StringIO import StringIO
+
+from bacpypes.debugging import bacpypes_debugging, ModuleLogger
+from bacpypes.consolelogging import ArgumentParser
+
+from bacpypes.core import run, stop, deferred, enable_sleeping
+from bacpypes.iocb import IOCB, IOController
+from bacpypes.task import TaskManager, OneShotTask, FunctionTask
+from bacpypes.comm import Server, ApplicationServiceElement, bind
+from bacpypes.pdu import PDU, Address
+from bacpypes.primitivedata import ObjectIdentifier, Real, CharacterString, \
+    TagList
+from bacpypes.constructeddata import ArrayOf, Any
+from bacpypes.basetypes import StatusFlags, PropertyValue, PropertyReference, \
+    ErrorType
+from bacpypes.apdu import APDU, APCISequence, ConfirmedRequestPDU, \
+    ComplexAckPDU, SimpleAckPDU, \
+    apdu_types, ReadPropertyRequest, ReadPropertyACK, \
+    ReadPropertyMultipleRequest, ReadPropertyMultipleACK, \
+    ReadAccessSpecification, ReadAccessResult, ReadAccessResultElement, \
+    ReadAccessResultElementChoice, WritePropertyRequest
+from bacpypes.udp import UDPDirector
+
+from bacpypes.app import DeviceInfoCache
+from bacpypes.appservice import StateMachineAccessPoint, ApplicationServiceAccessPoint
+
+from bacpypes.service.device import LocalDeviceObject
+
+import DeltaIPProxyChecker
+
+from DeltaBatch import BatchApplication
+from DeltaIPProxyChecker import WhoIsIAmApplication
+
+from fleet.jobs import make_job
+from fleet.farm import DeltaFarm
+from fleet.publicip import PublicIPResolver
+from fleet.shard import Supervisor, shard_jobs
+
+import engine
+from engine import loop, pdudata, taglist, codec, compact
+from engine.compact import compact_address
+from engine.appservice import IndexedStateMachineAccessPoint
+from engine.dispatch import SLICE
+from engine.metrics import dump
+from engine.tasks import IndexedTaskManager
+from engine.wheel import WheelTaskManager, coarse_classes, RESOLUTION
+
+# some debugging
+_debug = 0
+_log = ModuleLogger(globals())
+
+# flows in the order they are run
+FLOWS = ('read', 'write', 'flash', 'proxy', 'publicip', 'timers', 'wakeup', 'flood', 'decode', 'codec', 'smap', 'segment', 'memory', 'churn')
+
+# the DeltaBatch operation of the flows that run one
+BATCH_FLOWS = {'read': 'read-net', 'write': 'write-net', 'flash': 'save'}
+
+# loops, the bacpypes core, with sleeping enabled, or the engine loop with
+# a backend
+LOOPS = ('core', 'sleeping') + tuple(name for name, klass, available in loop.BACKENDS if available)
+
+# task managers
+TASK_MANAGERS = ('heap', 'indexed', 'wheel')
+
+# decoders of the decode flow, the cursors they install
+DECODERS = (
+    ('bacpypes', ()),
+    ('pdudata', (pdudata,)),
+    ('taglist', (pdudata, taglist)),
+    ('codec', (pdudata, taglist, codec)),
+    )
+
+# the engine modules of the decode flow in the order they are installed
+ENGINE_CODING = (pdudata, taglist, codec)
+
+# ACK's of the decode flow
+ACKS = ('readProperty', 'readPropertyMultiple')
+
+# an object list, like the one of a Delta controller
+ObjectList = ArrayOf(ObjectIdentifier)
+
+# classes of the memory flow, compact or not
+CLASSES = ('bacpypes', 'compact')
+
+# state machine access points of the smap flow
+SMAPS = (
+    ('bacpypes', StateMachineAccessPoint),
+    ('indexed', IndexedStateMachineAccessPoint),
+    )
+
+# the public IP of the proxy flow, different from the one in the devices
+PUBLIC_IP = '72.12.96.12'
+
+# the answers of the providers of the publicip flow by path, two agree in
+# different forms, one does not and one is not an address
+PROVIDER_ANSWERS = {
+    '/json': '{"ip": "%s"}' % (PUBLIC_IP,),
+    '/plain': PUBLIC_IP + '\n',
+    '/other': '198.51.100.7\n',
+    '/garbage': 'not an address\n',
+    }
+
+# seconds the answer of the publicip flow is good for
+PUBLICIP_TTL = 0.2
+
+#
+#   StaticResolver
+#
+
+@bacpypes_debugging
+class StaticResolver(IOController):
+
+    """Answers every public IP request with the same address."""
+
+    def __init__(self, ip):
+        if _debug: StaticResolver._debug("__init__ %r", ip)
+        IOController.__init__(self)
+
+        self.ip = ip
+
+    def process_io(self, iocb):
+        if _debug: StaticResolver._debug("process_io %r", iocb)
+
+        self.complete_io(iocb, self.ip)
+
+#
+#   ChurnTimer
+#
+
+class ChurnTimer(OneShotTask):
+
+    """Stands in for the APDU timer of a segmentation state machine."""
+
+    def process_task(self):
+        pass
+
+#
+#   RequestSink
+#
+
+class RequestSink(Server):
+
+    """Stands in for the network below a state machine access point, keeps
+    the address and invoke ID of the requests sent."""
+
+    def __init__(self):
+        Server.__init__(self)
+        self.sent = deque()
+
+    def indication(self, apdu):
+        self.sent.append((apdu.pduDestination, apdu.apduInvokeID))
+
+#
+#   RequestLoop
+#
+
+class RequestLoop(ApplicationServiceElement):
+
+    """Sends a request to a device each time one of its requests is
+    confirmed, so the number in flight stays the same."""
+
+    def __init__(self):
+        ApplicationServiceElement.__init__(self)
+        self.confirmations = 0
+
+    def send(self, address):
+        self.request(ReadPropertyRequest(
+            objectIdentifier=('device', 4194303),
+            propertyIdentifier='objectName',
+            destination=address,
+            ))
+
+    def confirmation(self, apdu):
+        self.confirmations += 1
+        self.send(apdu.pduSource)
+
+#
+#   SegmentWire
+#
+
+class SegmentWire(Server):
+
+    """Stands in for the network below a state machine access point, the
+    APDU's are encoded and decoded on the way to the one at the other
+    end."""
+
+    def __init__(self, address):
+        Server.__init__(self)
+        self.address = address
+        self.peer = None
+
+    def indication(self, apdu):
+        pdu = PDU()
+        xpdu = APDU()
+        apdu.encode(xpdu)
+        xpdu.encode(pdu)
+
+        # like the network service access point passes it up
+        rpdu = APDU()
+        rpdu.decode(PDU(str(pdu.pduData)))
+        rpdu.pduSource = self.address
+
+        deferred(self.peer.response, rpdu)
+
+#
+#   ObjectListServer
+#
+
+class ObjectListServer(ApplicationServiceElement):
+
+    """Answers every request with the same object list."""
+
+    def __init__(self, objects):
+        ApplicationServiceElement.__init__(self)
+        self.value = Any(ObjectList(objects))
+
+    def indication(self, apdu):
+        self.response(ReadPropertyACK(
+            objectIdentifier=('device', 4194303),
+            propertyIdentifier='objectList',
+            propertyValue=self.value,
+            context=apdu,
+            ))
+
+#
+#   ObjectListReader
+#
+
+class ObjectListReader(ApplicationServiceElement):
+
+    """Reads the object list over and over and stops the loop after the
+    number of reads."""
+
+    def __init__(self, address, reads):
+        ApplicationServiceElement.__init__(self)
+        self.address = address
+        self.reads = reads
+        self.confirmations = 0
+
+    def send(self):
+        self.request(ReadPropertyRequest(
+            objectIdentifier=('device', 4194303),
+            propertyIdentifier='objectList',
+            destination=self.address,
+            ))
+
+    def confirmation(self, apdu):
+        if isinstance(apdu, ReadPropertyACK):
+            self.confirmations += 1
+
+        if self.confirmations < self.reads:
+            self.send()
+        else:
+            stop()
+
+#
+#   make_task_manager
+#
+
+def make_task_manager(args):
+    """Make the task manager singleton that everything uses."""
+    if args.task_manager == 'heap':
+        return TaskManager()
+    elif args.task_manager == 'indexed':
+        return IndexedTaskManager()
+    else:
+        return WheelTaskManager(args.resolution, coarse_classes() + (ChurnTimer,))
+
+#
+#   make_device
+#
+
+def make_device():
+    """The device object of the application, like the one from the INI."""
+    return LocalDeviceObject(
+        objectName='Benchmark',
+        objectIdentifier=599,
+        maxApduLengthAccepted=1024,
+        segmentationSupported='segmentedBoth',
+        vendorIdentifier=15,
+        )
+
+#
+#   run_loop
+#
+
+def run_loop(args):
+    """Run the loop picked on the command line until stop() is called,
+    return the engine loop when it is one."""
+    if args.loop == 'core':
+        run()
+    elif args.loop == 'sleeping':
+        enable_sleeping()
+        run()
+    else:
+        engine_loop = loop.run(backend=args.loop, budget=args.budget, slice=args.slice, metrics=args.metrics)
+        if args.metrics:
+            dump()
+        return engine_loop
+
+#
+#   batch_flow
+#
+
+def batch_jobs(operation, targets):
+    """Make a DeltaBatch job for each device instance and address."""
+    rows = []
+    for device_instance, address in targets:
+        row = {'operation': operation, 'address': str(address), 'device': device_instance}
+        if operation == 'write-net':
+            row['proxy_ip'] = PUBLIC_IP
+        rows.append(row)
+
+    return [make_job(index, row) for index, row in enumerate(rows)]
+
+def run_batch(farm, jobs, output, args):
+    """Run the jobs with a DeltaBatch application on the farm."""
+    app = farm.application(BatchApplication, jobs, output,
+        localDevice=make_device(),
+        max_outstanding=args.max_outstanding,
+        )
+
+    deferred(app.start)
+    run_loop(args)
+    app.close_socket()
+
+def batch_flow(farm, operation, args):
+    """Run one DeltaBatch job for each device, return the number that
+    succeeded."""
+    if _debug: _log.debug("batch_flow %r %r", farm, operation)
+
+    output = StringIO()
+    run_batch(farm, batch_jobs(operation, farm.targets()), output, args)
+
+    return sum(1 for line in output.getvalue().splitlines() if json.loads(line)['ok'])
+
+#
+#   sharded_flow
+#
+
+def sharded_flow(operation, args):
+    """Run one DeltaBatch job for each device in worker processes, each one
+    with a farm of its share of the devices, return the number that
+    succeeded.  Building the farms is part of the time."""
+    if _debug: _log.debug("sharded_flow %r", operation)
+
+    # the workers make the jobs again for the devices of their farm
+    jobs = batch_jobs(operation, [(None, 'device-%d' % (i,)) for i in range(args.devices)])
+
+    def worker(index, shard, output):
+        farm = DeltaFarm(len(shard),
+            latency=args.latency,
+            error_rate=args.error_rate,
+            drop_percent=args.drop,
+            seed=args.seed,
+            )
+        shard = [job._replace(index=placeholder.index)
+            for placeholder, job in zip(shard, batch_jobs(operation, farm.targets()))]
+
+        run_batch(farm, shard, output, args)
+
+    output = StringIO()
+    Supervisor(worker, shard_jobs(jobs, args.workers), output).run()
+
+    return sum(1 for line in output.getvalue().splitlines() if json.loads(line)['ok'])
+
+#
+#   proxy_flow
+#
+
+def proxy_flow(farm, args):
+    """Run the proxy IP check of every device, return the number written."""
+    if _debug: _log.debug("proxy_flow %r", farm)
+
+    app = farm.application(WhoIsIAmApplication,
+        [device_instance for device_instance, address in farm.targets()],
+        localDevice=make_device(),
+        max_outstanding=args.max_outstanding,
+        timeout=args.timeout,
+        resolver=StaticResolver(PUBLIC_IP),
+        )
+
+    # the Who-Is command finds the application this way
+    DeltaIPProxyChecker.this_application = app
+
+    # the checker writes a line for each device
+    stdout, sys.stdout = sys.stdout, StringIO()
+    try:
+        deferred(app.start)
+        run_loop(args)
+    finally:
+        output, sys.stdout = sys.stdout, stdout
+    app.close_socket()
+
+    return sum(1 for line in output.getvalue().splitlines() if ' ack ' in line)
+
+#
+#   publicip_flow
+#
+
+def publicip_flow(args):
+    """Ask PublicIPResolver's for the public IP, the providers are served
+    by an HTTP server on localhost.  Return the checks that passed and
+    those that did not, by name."""
+    if _debug: _log.debug("publicip_flow")
+
+    # requests for each path, counted by the server thread
+    hits = {}
+
+    class ProviderHandler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            hits[self.path] = hits.get(self.path, 0) + 1
+
+            body = PROVIDER_ANSWERS.get(self.path)
+            if body is None:
+                self.send_error(404)
+                return
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), ProviderHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    def urls(*paths):
+        return ['http://127.0.0.1:%d%s' % (server.server_port, path) for path in paths]
+
+    # the conflicting provider is in between the two that agree
+    agreed = PublicIPResolver(urls('/json', '/other', '/plain'), quorum=2, ttl=PUBLICIP_TTL)
+    split = PublicIPResolver(urls('/json', '/other'), quorum=2)
+    broken = PublicIPResolver(urls('/missing', '/garbage'), quorum=1)
+
+    # name, resolver, seconds to wait before the request and what makes
+    # it pass given the IOCB and the number of requests to the providers
+    checks = [
+        ('quorum', agreed, 0.0,
+            lambda iocb, asked: (iocb.ioResponse == PUBLIC_IP) and (asked == 3)),
+        ('cached', agreed, 0.0,
+            lambda iocb, asked: (iocb.ioResponse == PUBLIC_IP) and (asked == 0)),
+        ('expired', agreed, PUBLICIP_TTL,
+            lambda iocb, asked: (iocb.ioResponse == PUBLIC_IP) and (asked == 3)),
+        ('noQuorum', split, 0.0,
+            lambda iocb, asked: isinstance(iocb.ioError, RuntimeError) and (asked == 2)),
+        ('failed', broken, 0.0,
+            lambda iocb, asked: (iocb.ioError is not None) and (iocb.ioResponse is None) and (asked == 2)),
+        ]
+    results = {}
+
+    def request(index):
+        name, resolver, delay, passed = checks[index]
+        before = sum(hits.values())
+
+        def complete(iocb):
+            results[name] = passed(iocb, sum(hits.values()) - before)
+            if _debug: _log.debug("    - %s: %r %r %r", name, results[name], iocb.ioResponse, iocb.ioError)
+
+            if index + 1 == len(checks):
+                stop()
+            else:
+                FunctionTask(request, index + 1).install_task(delta=checks[index + 1][2])
+
+        iocb = IOCB()
+        iocb.add_callback(complete)
+        resolver.request_io(iocb)
+
+    TaskManager()
+    deferred(request, 0)
+    run_loop(args)
+
+    server.shutdown()
+    server.server_close()
+
+    return sorted(name for name in results if results[name]), \
+        sorted(name for name, resolver, delay, passed in checks if not results.get(name))
+
+#
+#   timers_flow
+#
+
+def timers_flow(args):
+    """Process a pile of tasks that are all due, return the number done
+    and how long it took, without the time to install them."""
+    if _debug: _log.debug("timers_flow")
+
+    done = [0]
+
+    def timer():
+        done[0] += 1
+        if done[0] == args.timers:
+            stop()
+
+    TaskManager()
+    for i in range(args.timers):
+        FunctionTask(timer).install_task(delta=0.0)
+
+    started = _time()
+    run_loop(args)
+
+    return done[0], _time() - started
+
+#
+#   decode_flow
+#
+
+def encode_apdu(service):
+    """Return the octets of the APDU of a service."""
+    service.pduDestination = Address('10.0.1.1')
+    service.apduInvokeID = 1
+    if isinstance(service, ConfirmedRequestPDU):
+        service.apduMaxResp = 1476
+
+    apdu = APDU()
+    service.encode(apdu)
+    pdu = PDU()
+    apdu.encode(pdu)
+
+    return str(pdu.pduData)
+
+def object_list_ack(size):
+    """Return the octets of a ReadProperty ACK of an object list of about
+    the size given and the number of objects, an object identifier is five
+    octets."""
+    count = max(1, (size - 12) // 5)
+    objects = [('analogValue', i) for i in range(count)]
+
+    return encode_apdu(ReadPropertyACK(
+        objectIdentifier=('device', 4194303),
+        propertyIdentifier='objectList',
+        propertyValue=Any(ObjectList(objects)),
+        )), count
+
+def read_access_result(i):
+    """The name, present value and status flags of an analog value, like
+    the tools read them."""
+    def element(identifier, value):
+        return ReadAccessResultElement(
+            propertyIdentifier=identifier,
+            readResult=ReadAccessResultElementChoice(propertyValue=Any(value)),
+            )
+
+    return ReadAccessResult(
+        objectIdentifier=('analogValue', i),
+        listOfResults=[
+            element('objectName', CharacterString('AV%d' % (i,))),
+            element('presentValue', Real(i)),
+            element('statusFlags', StatusFlags([0, 0, 0, 0])),
+            ],
+        )
+
+def read_property_multiple_ack(size):
+    """Return the octets of a ReadPropertyMultiple ACK of about the size
+    given and the number of objects, an object is about 34 octets."""
+    count = max(1, (size - 3) // 34)
+
+    return encode_apdu(ReadPropertyMultipleACK(
+        listOfReadAccessResults=[read_access_result(i) for i in range(count)],
+        )), count
+
+def decode_ack(octets):
+    """Decode the octets like the stack does on the way up, return the
+    number of objects."""
+    apdu = APDU()
+    apdu.decode(PDU(octets))
+
+    ack = ComplexAckPDU()
+    ack.decode(apdu)
+
+    if ack.apduService == ReadPropertyACK.serviceChoice:
+        rp = ReadPropertyACK()
+        rp.decode(ack)
+
+        return len(rp.propertyValue.cast_out(ObjectList))
+
+    rpm = ReadPropertyMultipleACK()
+    rpm.decode(ack)
+
+    return len(rpm.listOfReadAccessResults)
+
+def decode_flow(cursors, kind, size, args):
+    """Decode an ACK of about the size given over and over with the cursors
+    installed, return the number of octets, the number of decodes and the
+    best time of the repeats."""
+    if _debug: _log.debug("decode_flow %r %r %r", cursors, kind, size)
+
+    # uninstalled from the top, installed from the bottom
+    for module in reversed(ENGINE_CODING):
+        if module not in cursors:
+            module.uninstall()
+    for module in cursors:
+        module.install()
+
+    if kind == 'readProperty':
+        octets, count = object_list_ack(size)
+    else:
+        octets, count = read_property_multiple_ack(size)
+    if decode_ack(octets) != count:
+        raise RuntimeError("ACK not decoded")
+
+    best = None
+    for i in range(args.repeat):
+        started = _time()
+        for j in range(args.decodes):
+            decode_ack(octets)
+        elapsed = _time() - started
+
+        if (best is None) or (elapsed < best):
+            best = elapsed
+
+    return len(octets), args.decodes, best
+
+#
+#   codec_flow
+#
+
+def codec_values():
+    """Return the name and a value of the sequences and choices the tools
+    encode and decode the most, and of the services that carry them."""
+    references = [PropertyReference(propertyIdentifier=identifier)
+        for identifier in ('objectName', 'presentValue', 'statusFlags')]
+    specification = ReadAccessSpecification(
+        objectIdentifier=('analogValue', 1),
+        listOfPropertyReferences=references,
+        )
+
+    # a result with an error, the other choice of the results
+    failed = read_access_result(2)
+    failed.listOfResults.append(ReadAccessResultElement(
+        propertyIdentifier='description',
+        propertyArrayIndex=3,
+        readResult=ReadAccessResultElementChoice(
+            propertyAccessError=ErrorType(errorClass='property', errorCode='unknownProperty'),
+            ),
+        ))
+
+    return [
+        ('PropertyReference', references[0]),
+        ('PropertyValue', PropertyValue(
+            propertyIdentifier='presentValue',
+            value=Any(Real(21.5)),
+            priority=8,
+            )),
+        ('ReadAccessSpecification', specification),
+        ('ReadAccessResult', failed),
+        ('ReadPropertyRequest', ReadPropertyRequest(
+            objectIdentifier=('analogValue', 1),
+            propertyIdentifier='presentValue',
+            )),
+        ('ReadPropertyACK', ReadPropertyACK(
+            objectIdentifier=('analogValue', 1),
+            propertyIdentifier='presentValue',
+            propertyValue=Any(Real(21.5)),
+            )),
+        ('ReadPropertyMultipleRequest', ReadPropertyMultipleRequest(
+            listOfReadAccessSpecs=[ReadAccessSpecification(
+                objectIdentifier=('analogValue', i),
+                listOfPropertyReferences=references,
+                ) for i in range(10)],
+            )),
+        ('ReadPropertyMultipleACK', ReadPropertyMultipleACK(
+            listOfReadAccessResults=[read_access_result(i) for i in range(10)] + [failed],
+            )),
+        ('WritePropertyRequest', WritePropertyRequest(
+            objectIdentifier=('analogValue', 1),
+            propertyIdentifier='presentValue',
+            propertyValue=Any(Real(21.5)),
+            priority=16,
+            )),
+        ]
+
+def encode_value(value):
+    """Return the octets of a value, the APDU of a service or the tags of
+    a sequence or a choice."""
+    if isinstance(value, APCISequence):
+        return encode_apdu(value)
+
+    tags = TagList()
+    value.encode(tags)
+    pdu = PDU()
+    tags.encode(pdu)
+
+    return str(pdu.pduData)
+
+def decode_value(klass, octets):
+    """Return a value of the class decoded from its octets."""
+    if issubclass(klass, APCISequence):
+        apdu = APDU()
+        apdu.decode(PDU(octets))
+
+        source = apdu_types[apdu.apduType]()
+        source.decode(apdu)
+    else:
+        source = TagList()
+        source.decode(PDU(octets))
+
+    value = klass()
+    value.decode(source)
+
+    return value
+
+def timed(function, args, count):
+    """Return the time of a number of calls."""
+    started = _time()
+    for i in range(count):
+        function(*args)
+
+    return _time() - started
+
+def codec_flow(value, args):
+    """Encode and decode a value over and over with bacpypes and with the
+    compiled codecs, taking turns, return the rates of the best times, the
+    speedups and whether the octets and the values are the same."""
+    if _debug: _log.debug("codec_flow %r", value)
+
+    klass = value.__class__
+    for module in ENGINE_CODING:
+        module.install()
+
+    # the octets and the value decoded by each, the decoded values are
+    # compared and encoded again by bacpypes
+    octets = {}
+    decoded = {}
+    best = {}
+    for i in range(args.repeat):
+        for name in ('bacpypes', 'compiled'):
+            if name == 'compiled':
+                codec.install()
+            else:
+                codec.uninstall()
+
+            if not i:
+                octets[name] = encode_value(value)
+                decoded[name] = decode_value(klass, octets[name])
+
+            times = {
+                'encode': timed(encode_value, (value,), args.codings),
+                'decode': timed(decode_value, (klass, octets[name]), args.codings),
+                }
+            if name not in best:
+                best[name] = times
+            else:
+                for way, elapsed in times.items():
+                    best[name][way] = min(best[name][way], elapsed)
+
+    codec.uninstall()
+    identical = (octets['bacpypes'] == octets['compiled']) \
+        and (decoded['bacpypes'].dict_contents() == decoded['compiled'].dict_contents()) \
+        and all(encode_value(decoded[name]) == octets['bacpypes'] for name in decoded)
+
+    rates = dict((name, dict((way, round(args.codings / elapsed, 1) if elapsed else None)
+        for way, elapsed in times.items()))
+        for name, times in best.items())
+
+    return {
+        'octets': len(octets['bacpypes']),
+        'codings': args.codings,
+        'identical': identical,
+        'bacpypes': rates['bacpypes'],
+        'compiled': rates['compiled'],
+        'speedup': dict((way, round(rates['compiled'][way] / rates['bacpypes'][way], 2))
+            for way in ('encode', 'decode')
+            if rates['compiled'][way] and rates['bacpypes'][way]),
+        }
+
+#
+#   smap_flow
+#
+
+def smap_flow(klass, outstanding, args):
+    """Keep a request in flight to each of a number of devices and answer
+    the oldest one over and over, return the number of confirmations and
+    how long it took."""
+    if _debug: _log.debug("smap_flow %r %r", klass, outstanding)
+
+    smap = klass(make_device(), DeviceInfoCache())
+    sink = RequestSink()
+    requests = RequestLoop()
+    bind(requests, ApplicationServiceAccessPoint(), smap, sink)
+
+    for i in range(outstanding):
+        requests.send(Address('10.0.%d.%d' % (i // 250 + 1, i % 250 + 1)))
+
+    started = _time()
+    for i in range(args.confirmations):
+        address, invokeID = sink.sent.popleft()
+
+        ack = SimpleAckPDU(context=None)
+        ack.apduService = ReadPropertyRequest.serviceChoice
+        ack.apduInvokeID = invokeID
+        ack.pduSource = address
+
+        # like the network service access point passes it up
+        apdu = APDU()
+        ack.encode(apdu)
+        smap.confirmation(apdu)
+    elapsed = _time() - started
+
+    # the requests still in flight would time out
+    for tr in list(smap.clientTransactions):
+        tr.suspend_task()
+
+    return requests.confirmations, elapsed
+
+#
+#   segment_flow
+#
+
+def segment_flow(klass, segment_size, args):
+    """Read an object list of --segment-objects objects in segments of
+    about the size given, return the number of segments of a read, the
+    number of reads and how long they took."""
+    if _debug: _log.debug("segment_flow %r %r", klass, segment_size)
+
+    client_address = Address('10.0.1.1')
+    server_address = Address('10.0.1.2')
+
+    client_wire = SegmentWire(client_address)
+    server_wire = SegmentWire(server_address)
+    client_wire.peer, server_wire.peer = server_wire, client_wire
+
+    ends = []
+    for address, peer_address, wire in (
+            (client_address, server_address, server_wire),
+            (server_address, client_address, client_wire),
+            ):
+        device = LocalDeviceObject(
+            objectName='Benchmark',
+            objectIdentifier=599,
+            maxApduLengthAccepted=segment_size,
+            maxSegmentsAccepted=64,
+            segmentationSupported='segmentedBoth',
+            vendorIdentifier=15,
+            )
+
+        # the other end can send and receive segments of the size
+        cache = DeviceInfoCache()
+        info = cache.get_device_info(peer_address)
+        info.maxApduLengthAccepted = info.maxNpduLength = segment_size
+        info.segmentationSupported = 'segmentedBoth'
+        info.maxSegmentsAccepted = 64
+
+        smap = klass(device, cache)
+        ends.append((smap, wire))
+
+    reader = ObjectListReader(server_address, args.reads)
+    bind(reader, ApplicationServiceAccessPoint(), ends[0][0], ends[1][1])
+
+    server = ObjectListServer([('analogValue', i) for i in range(args.segment_objects)])
+    bind(server, ApplicationServiceAccessPoint(), ends[1][0], ends[0][1])
+
+    segments = -(-(12 + 5 * args.segment_objects) // segment_size)
+
+    started = _time()
+    deferred(reader.send)
+    run_loop(args)
+
+    return segments, reader.confirmations, _time() - started
+
+#
+#   memory_flow
+#
+
+def deep_size(root):
+    """Return the octets and the number of the objects that can be reached
+    from the root, the classes, modules and functions are shared by all of
+    them and do not count."""
+    shared = (type, types.ClassType, types.ModuleType, types.FunctionType,
+        types.BuiltinFunctionType)
+
+    seen = set()
+    octets = count = 0
+    stack = [root]
+    while stack:
+        obj = stack.pop()
+        if (id(obj) in seen) or isinstance(obj, shared):
+            continue
+        seen.add(id(obj))
+
+        octets += sys.getsizeof(obj)
+        count += 1
+        stack.extend(gc.get_referents(obj))
+
+    return octets, count
+
+def memory_flow(name, args):
+    """Read the present value of a number of points, one ReadProperty ACK
+    each, and keep them the way a gateway caches them: the address of the
+    device, the ACK with its tags and the value.  Return the octets and the
+    number of objects of the cache and the time it took to make it."""
+    if _debug: _log.debug("memory_flow %r", name)
+
+    if name == 'compact':
+        compact.install()
+    else:
+        compact.uninstall()
+
+    # the octets of the ACK's of the points of a device
+    points_per_device = 50
+    acks = [encode_apdu(ReadPropertyACK(
+        objectIdentifier=('analogValue', i),
+        propertyIdentifier='presentValue',
+        propertyValue=Any(Real(i)),
+        )) for i in range(points_per_device)]
+
+    cache = {}
+    started = _time()
+    for i in range(args.points):
+        device, point = divmod(i, points_per_device)
+
+        # an address for each packet, like the ones of the UDP director
+        source = Address('10.%d.%d.%d' % (device // 62500, device // 250 % 250, device % 250 + 1))
+        if name == 'compact':
+            source = compact_address(source)
+
+        apdu = APDU()
+        apdu.decode(PDU(acks[point], source=source))
+        ack = ComplexAckPDU()
+        ack.decode(apdu)
+        rp = ReadPropertyACK()
+        rp.decode(ack)
+
+        cache[(device, rp.objectIdentifier)] = (rp.pduSource, rp,
+            Real(rp.propertyValue.cast_out(Real)))
+    elapsed = _time() - started
+
+    octets, count = deep_size(cache)
+
+    return octets, count, elapsed
+
+#
+#   churn_flow
+#
+
+def churn_flow(args):
+    """Suspend and install again a random timer of many that are waiting,
+    return the number of times and how long it took.  The timers are left
+    an hour away so the churn flow should be the last one."""
+    if _debug: _log.debug("churn_flow")
+
+    rng = random.Random(args.seed)
+
+    TaskManager()
+    tasks = [ChurnTimer() for i in range(args.timers)]
+    for task in tasks:
+        task.install_task(delta=3600.0 + rng.random())
+
+    started = _time()
+    for i in range(args.churn):
+        task = rng.choice(tasks)
+        task.suspend_task()
+        task.install_task(delta=3600.0 + rng.random())
+
+    return args.churn, _time() - started
+
+#
+#   percentiles
+#
+
+def percentiles(samples):
+    """Return the mean, median and 99th percentile in microseconds."""
+    if not samples:
+        return None
+
+    samples = sorted(samples)
+    return {
+        'mean': round(sum(samples) / len(samples) * 1e6, 1),
+        'p50': round(samples[len(samples) // 2] * 1e6, 1),
+        'p99': round(samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1e6, 1),
+        }
+
+#
+#   wakeup_flow
+#
+
+def wakeup_flow(args):
+    """A thread leaves the loop idle for a while, then gives it a deferred
+    function and a PDU for a UDP director to send, over and over.  Return
+    the time it took for each to be done, the share of a CPU the idle loop
+    used and the CPU time for each wakeup."""
+    if _debug: _log.debug("wakeup_flow")
+
+    deferred_latency = []
+    socket_latency = []
+    cpu = []
+
+    def arrived(submitted):
+        deferred_latency.append(_time() - submitted)
+
+    # a director to send with and a plain socket to receive what it sends
+    director = UDPDirector(('127.0.0.1', 0))
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.bind(('127.0.0.1', 0))
+    receiver.settimeout(5.0)
+    destination = receiver.getsockname()
+
+    def cpu_time():
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        return usage.ru_utime + usage.ru_stime
+
+    def worker():
+        try:
+            before = cpu_time()
+            _sleep(args.idle)
+            cpu.append(cpu_time() - before)
+
+            before = cpu_time()
+            for i in range(args.wakeups):
+                _sleep(args.interval)
+                deferred(arrived, _time())
+
+                _sleep(args.interval)
+                submitted = _time()
+                director.indication(PDU(b'\x81', destination=destination))
+                receiver.recv(16)
+                socket_latency.append(_time() - submitted)
+            cpu.append(cpu_time() - before)
+        except socket.timeout:
+            pass
+        finally:
+            deferred(stop)
+
+    TaskManager()
+    thread = threading.Thread(target=worker)
+    thread.daemon = True
+
+    thread.start()
+    run_loop(args)
+    thread.join()
+    director.close_socket()
+    receiver.close()
+
+    return {
+        'deferred': percentiles(deferred_latency),
+        'socket': percentiles(socket_latency),
+        'idleCpu': round(cpu[0] / args.idle, 4) if cpu and args.idle else None,
+        'wakeupCpu': round(cpu[1] / args.wakeups * 1e6, 1) if len(cpu) > 1 else None,
+        }
+
+#
+#   flood_flow
+#
+
+def flood_flow(args):
+    """Defer a burst of functions that each take a little time, with a
+    timer due shortly after, return how late the timer was, how long the
+    burst took and the metrics of the deferred queue."""
+    if _debug: _log.debug("flood_flow")
+
+    state = {'calls': 0, 'late': None}
+
+    def check():
+        if (state['calls'] == args.flood) and (state['late'] is not None):
+            stop()
+
+    def handle_iam(n):
+        # about the work of decoding an I-Am
+        sum(range(n))
+        state['calls'] += 1
+        if state['calls'] == args.flood:
+            check()
+
+    def timeout(when):
+        state['late'] = _time() - when
+        check()
+
+    TaskManager()
+
+    started = _time()
+    when = started + args.flood_timer
+    FunctionTask(timeout, when).install_task(when)
+    for i in range(args.flood):
+        deferred(handle_iam, 2000)
+
+    engine_loop = run_loop(args)
+    elapsed = _time() - started
+
+    return {
+        'late': round(state['late'], 4),
+        'elapsed': round(elapsed, 3),
+        'deferred': engine_loop.deferredQueue.metrics() if engine_loop else None,
+        }
+
+#
+#   __main__
+#
+
+def main():
+    # parse the command line arguments
+    parser = ArgumentParser(description=__doc__)
+
+    parser.add_argument('--devices', type=int,
+        default=100,
+        help='number of simulated controllers',
+        )
+    parser.add_argument('--flows', type=str,
+        default=','.join(FLOWS),
+        help='flows to run, any of %s' % (', '.join(FLOWS),),
+        )
+    parser.add_argument('--latency', type=float,
+        default=0.0,
+        help='seconds a controller takes to answer',
+        )
+    parser.add_argument('--error-rate', type=float,
+        default=0.0,
+        help='share of the requests answered with an error, 0.0 to 1.0',
+        )
+    parser.add_argument('--drop', type=float,
+        default=0.0,
+        help='percent of the packets lost',
+        )
+    parser.add_argument('--max-outstanding', type=int,
+        default=16,
+        help='maximum number of requests in flight',
+        )
+    parser.add_argument('--workers', type=int,
+        default=1,
+        help='worker processes for the read, write and flash flows',
+        )
+    parser.add_argument('--timeout', type=float,
+        default=10.0,
+        help='seconds to wait for devices to answer the Who-Is',
+        )
+    parser.add_argument('--seed', type=int,
+        help='seed for the simulated errors',
+        )
+    parser.add_argument('--timers', type=int,
+        default=10000,
+        help='number of tasks of the timers and churn flows',
+        )
+    parser.add_argument('--wakeups', type=int,
+        default=100,
+        help='number of times work is given to the loop by another thread',
+        )
+    parser.add_argument('--idle', type=float,
+        default=2.0,
+        help='seconds the loop is left idle before the wakeups',
+        )
+    parser.add_argument('--interval', type=float,
+        default=0.01,
+        help='seconds between the work given to the loop by another thread',
+        )
+    parser.add_argument('--flood', type=int,
+        default=50000,
+        help='number of deferred functions in the flood',
+        )
+    parser.add_argument('--flood-timer', type=float,
+        default=0.05,
+        help='seconds after the flood the timer is due',
+        )
+    parser.add_argument('--apdu-sizes', type=str,
+        default='50,200,500,1000,1500',
+        help='octets of the APDU\'s of the decode flow, a comma separated list',
+        )
+    parser.add_argument('--acks', type=str,
+        default=','.join(ACKS),
+        help='ACK\'s of the decode flow, any of %s' % (', '.join(ACKS),),
+        )
+    parser.add_argument('--decodes', type=int,
+        default=2000,
+        help='number of decodes of each APDU of the decode flow',
+        )
+    parser.add_argument('--codings', type=int,
+        default=2000,
+        help='number of encodes and decodes of each value of the codec flow',
+        )
+    parser.add_argument('--codecs', action='store_true',
+        default=False,
+        help='run the flows with the compiled codecs installed',
+        )
+    parser.add_argument('--repeat', type=int,
+        default=5,
+        help='times the decodes and codings are repeated, the best one counts',
+        )
+    parser.add_argument('--outstanding', type=str,
+        default='10,100,1000',
+        help='requests in flight of the smap flow, a comma separated list',
+        )
+    parser.add_argument('--confirmations', type=int,
+        default=20000,
+        help='number of confirmations of the smap flow',
+        )
+    parser.add_argument('--segment-sizes', type=str,
+        default='480,1476',
+        help='maximum APDU lengths of the segment flow, a comma separated list',
+        )
+    parser.add_argument('--segment-objects', type=int,
+        default=1000,
+        help='objects in the object list of the segment flow',
+        )
+    parser.add_argument('--reads', type=int,
+        default=100,
+        help='number of reads of the segment flow',
+        )
+    parser.add_argument('--points', type=int,
+        default=50000,
+        help='number of points in the cache of the memory flow',
+        )
+    parser.add_argument('--churn', type=int,
+        default=2000,
+        help='number of timers suspended and installed again',
+        )
+
+    # the loop
+    parser.add_argument('--loop', type=str,
+        default='core', choices=LOOPS,
+        help='bacpypes core loop or an engine loop backend',
+        )
+    parser.add_argument('--budget', type=int,
+        default=loop.BUDGET,
+        help='tasks and deferred functions in one pass of the engine loop',
+        )
+    parser.add_argument('--slice', type=float,
+        default=SLICE,
+        help='seconds of deferred functions in one pass of the engine loop',
+        )
+    parser.add_argument('--metrics', action='store_true',
+        default=False,
+        help='measure the engine loop and write the metrics to stderr',
+        )
+    parser.add_argument('--task-manager', type=str,
+        default='heap', choices=TASK_MANAGERS,
+        help='bacpypes task manager, the indexed one or the timing wheel',
+        )
+    parser.add_argument('--resolution', type=float,
+        default=RESOLUTION,
+        help='seconds in a tick of the timing wheel',
+        )
+
+    args = parser.parse_args()
+
+    if _debug: _log.debug("initialization")
+    if _debug: _log.debug("    - args: %r", args)
+
+    # the flows run with the engine changes to the library, like the tools
+    engine.install(codecs=args.codecs)
+
+    flows = [flow.strip() for flow in args.flows.split(',') if flow.strip()]
+    for flow in flows:
+        if flow not in FLOWS:
+            parser.error("unknown flow: %r" % (flow,))
+
+    outstanding = [int(count) for count in args.outstanding.split(',') if count.strip()]
+    apdu_sizes = [int(size) for size in args.apdu_sizes.split(',') if size.strip()]
+    segment_sizes = [int(size) for size in args.segment_sizes.split(',') if size.strip()]
+
+    acks = [ack.strip() for ack in args.acks.split(',') if ack.strip()]
+    for ack in acks:
+        if ack not in ACKS:
+            parser.error("unknown ACK: %r" % (ack,))
+
+    # the task manager is a singleton, this one is used by everything
+    make_task_manager(args)
+
+    for flow in flows:
+        if flow == 'decode':
+            for ack in acks:
+                for name, cursors in DECODERS:
+                    for size in apdu_sizes:
+                        octets, ok, elapsed = decode_flow(cursors, ack, size, args)
+
+                        line = {
+                            'flow': flow,
+                            'ack': ack,
+                            'decoder': name,
+                            'octets': octets,
+                            'ok': ok,
+                            'elapsed': round(elapsed, 3),
+                            'rate': round(ok / elapsed, 1) if elapsed else None,
+                            }
+                        sys.stdout.write(json.dumps(line, sort_keys=True) + '\n')
+                        sys.stdout.flush()
+
+            # the engine loop runs with the cursors, and the codecs if asked
+            for module in ENGINE_CODING:
+                if (module is codec) and not args.codecs:
+                    module.uninstall()
+                else:
+                    module.install()
+            continue
+
+        if flow == 'codec':
+            for name, value in codec_values():
+                line = {
+                    'flow': flow,
+                    'type': name,
+                    }
+                line.update(codec_flow(value, args))
+                sys.stdout.write(json.dumps(line, sort_keys=True) + '\n')
+                sys.stdout.flush()
+
+            if args.codecs:
+                codec.install()
+            continue
+
+        if flow == 'memory':
+            for name in CLASSES:
+                octets, count, elapsed = memory_flow(name, args)
+
+                line = {
+                    'flow': flow,
+                    'classes': name,
+                    'points': args.points,
+                    'octets': octets,
+                    'octetsPerPoint': round(float(octets) / args.points, 1),
+                    'objectsPerPoint': round(float(count) / args.points, 1),
+                    'elapsed': round(elapsed, 3),
+                    'rate': round(args.points / elapsed, 1) if elapsed else None,
+                    }
+                sys.stdout.write(json.dumps(line, sort_keys=True) + '\n')
+                sys.stdout.flush()
+
+            compact.install()
+            continue
+
+        if flow == 'segment':
+            for name, klass in SMAPS:
+                for size in segment_sizes:
+                    segments, ok, elapsed = segment_flow(klass, size, args)
+
+                    line = {
+                        'flow': flow,
+                        'smap': name,
+                        'loop': args.loop,
+                        'segmentSize': size,
+                        'segments': segments,
+                        'ok': ok,
+                        'elapsed': round(elapsed, 3),
+                        'rate': round(ok / elapsed, 1) if elapsed else None,
+                        }
+                    sys.stdout.write(json.dumps(line, sort_keys=True) + '\n')
+                    sys.stdout.flush()
+            continue
+
+        if flow == 'smap':
+            for name, klass in SMAPS:
+                for count in outstanding:
+                    ok, elapsed = smap_flow(klass, count, args)
+
+                    line = {
+                        'flow': flow,
+                        'smap': name,
+                        'taskManager': args.task_manager,
+                        'outstanding': count,
+                        'ok': ok,
+                        'elapsed': round(elapsed, 3),
+                        'rate': round(ok / elapsed, 1) if elapsed else None,
+                        }
+                    sys.stdout.write(json.dumps(line, sort_keys=True) + '\n')
+                    sys.stdout.flush()
+            continue
+
+        if flow in ('wakeup', 'flood'):
+            line = {
+                'flow': flow,
+                'loop': args.loop,
+                }
+            if flow == 'wakeup':
+                line.update(wakeups=args.wakeups, interval=args.interval)
+                line.update(wakeup_flow(args))
+            else:
+                line.update(flood=args.flood, timer=args.flood_timer)
+                line.update(flood_flow(args))
+            sys.stdout.write(json.dumps(line, sort_keys=True) + '\n')
+            sys.stdout.flush()
+            continue
+
+        if flow == 'publicip':
+            passed, failed = publicip_flow(args)
+
+            line = {
+                'flow': flow,
+                'loop': args.loop,
+                'ok': len(passed),
+                'passed': passed,
+                'failed': failed,
+                }
+            sys.stdout.write(json.dumps(line, sort_keys=True) + '\n')
+            sys.stdout.flush()
+            continue
+
+        if flow in ('timers', 'churn'):
+            if flow == 'timers':
+                ok, elapsed = timers_flow(args)
+            else:
+                ok, elapsed = churn_flow(args)
+
+            line = {
+                'flow': flow,
+                'loop': args.loop,
+                'taskManager': args.task_manager,
+                'tasks': args.timers,
+                'ok': ok,
+                'elapsed': round(elapsed, 3),
+                'rate': round(ok / elapsed, 1) if elapsed else None,
+                }
+            sys.stdout.write(json.dumps(line, sort_keys=True) + '\n')
+            sys.stdout.flush()
+            continue
+
+        # the DeltaBatch flows in worker processes
+        if (args.workers > 1) and (flow in BATCH_FLOWS):
+            started = _time()
+            ok = sharded_flow(BATCH_FLOWS[flow], args)
+            elapsed = _time() - started
+
+            line = {
+                'flow': flow,
+                'loop': args.loop,
+                'taskManager': args.task_manager,
+                'workers': args.workers,
+                'devices': args.devices,
+                'ok': ok,
+                'elapsed': round(elapsed, 3),
+                'rate': round(args.devices / elapsed, 1) if elapsed else None,
+                }
+            sys.stdout.write(json.dumps(line, sort_keys=True) + '\n')
+            sys.stdout.flush()
+            continue
+
+        farm = DeltaFarm(args.devices,
+            latency=args.latency,
+            error_rate=args.error_rate,
+            drop_percent=args.drop,
+            seed=args.seed,
+            )
+
+        started = _time()
+        if flow in BATCH_FLOWS:
+            ok = batch_flow(farm, BATCH_FLOWS[flow], args)
+        else:
+            ok = proxy_flow(farm, args)
+        elapsed = _time() - started
+
+        line = {
+            'flow': flow,
+            'loop': args.loop,
+            'taskManager': args.task_manager,
+            'devices': args.devices,
+            'ok': ok,
+            'elapsed': round(elapsed, 3),
+            'rate': round(args.devices / elapsed, 1) if elapsed else None,
+            'counters': farm.counters(),
+            }
+        sys.stdout.write(json.dumps(line, sort_keys=True) + '\n')
+        sys.stdout.flush()
+
+    _log.debug("fini")
+
+if __name__ == "__main__":
+    main()
@@ -1,35 +1,49 @@
 #!/usr/bin/env python
 
 """
-This application 
+This application checks the proxy IP in the BACnet settings of one or more
+Delta controllers against the public IP of this site and writes the public
+IP to the controllers where they differ.  Devices are given as instances
+or lo-hi ranges, for example: DeltaIPProxyChecker.py 1200 1300-1310
+
+Controllers with small buffers can be given fewer requests in flight by the
+maximum APDU length in their I-Am: --max-per-device 4 --device-window 480=1
 """
 
 import sys
 
-from collections import deque 
-
-from json import load
-from urllib2 import urlopen
-
-from bacpypes.debugging import bacpypes_debugging, ModuleLogger, xtob
+from bacpypes.debugging import bacpypes_debugging, ModuleLogger, DebugContents, xtob
 from bacpypes.consolelogging import ConfigArgumentParser
 #from bacpypes.consolecmd import ConsoleCmd
 
-from bacpypes.core import run, enable_sleeping, stop, deferred
+from bacpypes.core import stop, deferred
 from bacpypes.iocb import IOCB
+from bacpypes.task import FunctionTask
 
 from bacpypes.pdu import Address, GlobalBroadcast
-from bacpypes.object import get_datatype
-from bacpypes.apdu import WhoIsRequest, IAmRequest, ReadPropertyRequest, WritePropertyRequest, SimpleAckPDU
+from bacpypes.apdu import WhoIsRequest, IAmRequest, ReadPropertyRequest, SimpleAckPDU
 from bacpypes.basetypes import ServicesSupported
 from bacpypes.errors import DecodingError
-from bacpypes.primitivedata import Unsigned, TagList, OpeningTag, ClosingTag, ContextTag
-from bacpypes.constructeddata import Array, Any
 
 from bacpypes.app import BIPSimpleApplication
 from bacpypes.service.device import LocalDeviceObject
 
-from decode import bcp, net, contextTagsToWrite  
+from decode import bcp, net
+from decode.template import get_template
+
+from fleet.devices import parse_device_list, device_ranges
+from fleet.scheduler import IOCBScheduler
+from fleet.publicip import PublicIPResolver, validate_ip
+from fleet.profile import DeviceProfileController
+from fleet.discovery import DiscoveryCache, DEFAULT_PATH, no_response
+from fleet.diff import diff_settings, write_request
+
+import engine
+from engine.loop import run
+from engine.coroutine import coroutine, request_io
+from engine.dispatch import defer, APPLICATION
+from engine.app import WindowedIOController, parse_windows
+from engine.appservice import index_transactions
 
 # some debugging
 _debug = 0
@@ -41,310 +55,269 @@ this_application = None
 #device = 75000
 device = 1200
 
-# point list, set according to your device
-point_list = [
-    ['192.168.1.50', 'device', 100, 'modelName'],
-    ['192.168.1.50', 'device', 100, 'applicationSoftwareVersion'],
-    ]
+# identification properties read from each device before the BACnet settings
+point_list = ['modelName', 'applicationSoftwareVersion']
 
+# BACnet settings object, property and array index for a NET DSC-xxxx 3.40
+bacnet_settings = (278, 1, 1101, 5)
 
 #
-#   WhoIsIAmApplication
+#   DeviceState
 #
 
 @bacpypes_debugging
-class WhoIsIAmApplication(BIPSimpleApplication):
-
-    def __init__(self, *args):
-        if _debug: WhoIsIAmApplication._debug("__init__ %r", args)
-        BIPSimpleApplication.__init__(self, *args)
-
-        # turn the point list into a queue
-        self.point_queue = deque(point_list)
-        
-        # make a list of the response values
-        self.response_values = []
-
-        # keep track of requests to line up responses
-        self._request = None
-        
-        # list of the response values from "bacnet settings" (NET, BCP)
-        self.response_bacset = []
-        
+class DeviceState(DebugContents):
+
+    _debug_contents = ('deviceInstance', 'address', 'profile', 'proxyIP', 'result')
+
+    def __init__(self, device_instance):
+        if _debug: DeviceState._debug("__init__ %r", device_instance)
+
+        # the device and where it was found
+        self.deviceInstance = device_instance
+        self.address = None
+
+        # the address came from the discovery cache
+        self.cached = False
+
+        # identification properties
+        self.profile = None
+
+        # BACnet settings object (NET or BCP), adjust depending on object
+        # type and firmware 3.33 or 3.40
+        self.obj, self.inst, self.prop, self.idx = bacnet_settings
+
+        # decoded "bacnet settings" (NET, BCP)
+        self.response_bacset = None
+
         # variable for Proxy IP
         self.proxyIP = "0.0.0.0"
 
-    def request(self, apdu):
-        if _debug: WhoIsIAmApplication._debug("request %r", apdu)
+        # how it all turned out
+        self.result = None
 
-        # save a copy of the request
-        self._request = apdu
+#
+#   WhoIsIAmApplication
+#
 
-        # forward it along
-        BIPSimpleApplication.request(self, apdu)
+@bacpypes_debugging
+class WhoIsIAmApplication(WindowedIOController, BIPSimpleApplication):
+
+    def __init__(self, device_list, localDevice, localAddress,
+            max_outstanding=16, max_per_device=1, timeout=10.0, resolver=None,
+            deviceInfoCache=None, windows=None):
+        if _debug: WhoIsIAmApplication._debug("__init__ %r %r %r", device_list, localDevice, localAddress)
+        super(WhoIsIAmApplication, self).__init__(localDevice, localAddress,
+            deviceInfoCache or DiscoveryCache(path=None),
+            window=max_per_device, windows=windows)
+
+        # find the transactions by address and invoke ID
+        index_transactions(self)
+
+        # state for each device, and those not finished yet
+        self.devices = dict((i, DeviceState(i)) for i in device_list)
+        self.unfinished = set(self.devices)
+
+        # limit the number of requests in flight, the window of each device
+        # is the limit for the device
+        self.scheduler = IOCBScheduler(self, max_outstanding, None)
+
+        # reads the identification properties through the scheduler
+        self.profiles = DeviceProfileController(self.scheduler, point_list)
+
+        # how long to wait for I-Am's
+        self.timeout = timeout
+
+        # where the public IP comes from
+        self.resolver = resolver or PublicIPResolver()
+
+    def device_class(self, address):
+        """The maximum APDU length of the device is in the discovery cache
+        from its I-Am before anything is sent to it."""
+        record = self.deviceInfoCache.addresses.get(address)
+        if record is None:
+            return super(WhoIsIAmApplication, self).device_class(address)
+
+        return record.maxApduLengthAccepted
+
+    def start(self):
+        if _debug: WhoIsIAmApplication._debug("start")
+
+        # start looking up the public IP while the devices answer
+        self.resolver.request_io(IOCB())
+
+        # devices with a fresh entry in the cache need no Who-Is
+        unknown = []
+        for dev in self.devices.values():
+            record = self.deviceInfoCache.lookup(dev.deviceInstance)
+            if record:
+                dev.address = record.address
+                dev.cached = True
+                defer(APPLICATION, self.check_device, dev)
+            else:
+                unknown.append(dev.deviceInstance)
 
-    def confirmation(self, apdu):
-        if _debug: WhoIsIAmApplication._debug("confirmation %r", apdu)
+        if unknown:
+            self.discover(unknown)
 
-        # forward it along
-        BIPSimpleApplication.confirmation(self, apdu)
+    def discover(self, instances):
+        if _debug: WhoIsIAmApplication._debug("discover %r", instances)
+
+        # ask for the devices, one Who-Is for each run of instances
+        for lo, hi in device_ranges(sorted(instances)):
+            WhoIsIAmCmd().do_whois("%d %d" % (lo, hi))
+
+        # give up on those that do not answer
+        FunctionTask(self.discovery_timeout, instances).install_task(delta=self.timeout)
+
+    def discovery_timeout(self, instances):
+        if _debug: WhoIsIAmApplication._debug("discovery_timeout %r", instances)
+
+        for device_instance in instances:
+            dev = self.devices[device_instance]
+            if dev.address is None:
+                self.finish(dev, "no response")
 
     def indication(self, apdu):
         if _debug: WhoIsIAmApplication._debug("indication %r", apdu)
 
-        if (isinstance(self._request, WhoIsRequest)) and (isinstance(apdu, IAmRequest)):
+        if isinstance(apdu, IAmRequest):
             device_type, device_instance = apdu.iAmDeviceIdentifier
             if device_type != 'device':
                 raise DecodingError("invalid object type")
 
-            if (self._request.deviceInstanceRangeLowLimit is not None) and \
-                    (device_instance < self._request.deviceInstanceRangeLowLimit):
-                pass
-            elif (self._request.deviceInstanceRangeHighLimit is not None) and \
-                    (device_instance > self._request.deviceInstanceRangeHighLimit):
-                pass
-            else:
-                # Received I-am from target's Device instance
-                dev_ObjID = apdu.iAmDeviceIdentifier
-                dev_pdusource = apdu.pduSource
- 
-                point_list[0][0] = str(dev_pdusource)
-                point_list[1][0] = str(dev_pdusource)
-                point_list[0][2] = dev_ObjID[1]
-                point_list[1][2] = dev_ObjID[1]
-
-                #fire off request. read device properties model name and software version
-                deferred(self.next_request)                
-         
-        # forward it along
-        BIPSimpleApplication.indication(self, apdu)
-        
-    def next_request(self):
-        if _debug: WhoIsIAmApplication._debug("next_request")
-
-        # check to see if we're done
-        if not self.point_queue:
-            if _debug: WhoIsIAmApplication._debug("    - done")
-            
-            # dump out the results... ici caller fonction qui analyse quel type de panneau et ensuite faire read du IP Proxy..
-            for request, response in zip(point_list, self.response_values):
-                print(request, response)
-            
-            # Adjust depending on object type NET or BCP and also version dependent 3.33 or 3.40
-            # Here is NET object DSC-xxxx 3.40 
-            self.net_obj_id(278,1,1101,5) 
+            # Received I-am from one of the target's Device instance
+            dev = self.devices.get(device_instance)
+            if dev:
+                self.deviceInfoCache.add_device_info(apdu)
+            if dev and (dev.address is None) and (device_instance in self.unfinished):
+                dev.address = apdu.pduSource
 
-            return
+                #fire off requests. read device properties model name and software version
+                defer(APPLICATION, self.check_device, dev)
 
-        # get the next request
-        addr, obj_type, obj_inst, prop_id = self.point_queue.popleft()
+        # forward it along
+        BIPSimpleApplication.indication(self, apdu)
 
-        # build a request
-        request = ReadPropertyRequest(
-            objectIdentifier=(obj_type, obj_inst),
-            propertyIdentifier=prop_id,
-            )
-        request.pduDestination = Address(addr)
-        if _debug: WhoIsIAmApplication._debug("    - request: %r", request)
+    def check_device(self, dev):
+        if _debug: WhoIsIAmApplication._debug("check_device %r", dev)
 
-        # make an IOCB
-        iocb = IOCB(request)
-
-        # set a callback for the response
-        iocb.add_callback(self.complete_request)
-        if _debug: WhoIsIAmApplication._debug("    - iocb: %r", iocb)
-
-        # send the request
-        this_application.request_io(iocb)
-        
-    def complete_request(self, iocb):
-        if _debug: WhoIsIAmApplication._debug("complete_request %r", iocb)
-
-        if iocb.ioResponse:
-            apdu = iocb.ioResponse
-
-            # find the datatype
-            datatype = get_datatype(apdu.objectIdentifier[0], apdu.propertyIdentifier)
-            if _debug: WhoIsIAmApplication._debug("    - datatype: %r", datatype)
-            if not datatype:
-                raise TypeError("unknown datatype")
-
-            # special case for array parts, others are managed by cast_out
-            if issubclass(datatype, Array) and (apdu.propertyArrayIndex is not None):
-                if apdu.propertyArrayIndex == 0:
-                    value = apdu.propertyValue.cast_out(Unsigned)
-                else:
-                    value = apdu.propertyValue.cast_out(datatype.subtype)
-            else:
-                value = apdu.propertyValue.cast_out(datatype)
-            if _debug: WhoIsIAmApplication._debug("    - value: %r", value)
+        # the conversation finishes the device, unless something goes wrong
+        iocb = self.conversation(dev)
+        iocb.add_callback(self.conversation_done, dev)
 
-            # save the value
-            self.response_values.append(value)
+    @coroutine
+    def conversation(self, dev):
+        if _debug: WhoIsIAmApplication._debug("conversation %r", dev)
 
+        # one ReadPropertyMultiple for the identification properties, or
+        # pipelined reads if the device does not do that
+        iocb = yield request_io(self.profiles, IOCB(dev.address, dev.deviceInstance))
         if iocb.ioError:
             if _debug: WhoIsIAmApplication._debug("    - error: %r", iocb.ioError)
-            self.response_values.append(iocb.ioError)
-
-        # fire off another request
-        deferred(self.next_request) 
-     
-    def net_obj_id(self,obj,inst,prop,idx):
-        self.obj = obj
-        self.inst = inst
-        self.prop = prop
-        self.idx = idx
-        
-        deferred(self.read_prop_vendor)
-
-    def read_prop_vendor(self):
-        #get bacnet source pdu from point_list array. point_list has been override by next_request method
-        addr = point_list[0][0]
-
-        obj_type = self.obj
-        obj_inst = self.inst
-        prop_id = self.prop
-        
-        # build a request
+
+            # the device moved, find it again
+            if dev.cached and no_response(iocb.ioError):
+                if _debug: WhoIsIAmApplication._debug("    - stale cache entry")
+                self.deviceInfoCache.invalidate(dev.deviceInstance)
+                dev.address = None
+                dev.cached = False
+                self.discover([dev.deviceInstance])
+                return
+
+            for prop_id in point_list:
+                sys.stdout.write("%d %s %s: %s\n" % (dev.deviceInstance, dev.address, prop_id, iocb.ioError))
+        else:
+            dev.profile = profile = iocb.ioResponse
+            if _debug: WhoIsIAmApplication._debug("    - profile: %r", profile)
+
+            # dump out the results
+            for prop_id in point_list:
+                response = getattr(profile, prop_id)
+                if response is None:
+                    response = profile.errors.get(prop_id)
+                sys.stdout.write("%d %s %s: %s\n" % (dev.deviceInstance, dev.address, prop_id, response))
+
+        # read the proxy IP
         request = ReadPropertyRequest(
-            objectIdentifier=(obj_type, obj_inst),
-            propertyIdentifier=int(prop_id),
+            objectIdentifier=(dev.obj, dev.inst),
+            propertyIdentifier=int(dev.prop),
             )
-        request.pduDestination = Address(addr)
-        
-        request.propertyArrayIndex = self.idx
-        #if _debug: ReadPropertyAnyConsoleCmd._debug("    - request: %r", request)
-        
-        # make an IOCB
-        iocb = IOCB(request)
-
-        #if _debug: ReadPropertyAnyConsoleCmd._debug("    - iocb: %r", iocb)
-        
-        # set a callback for the response
-        iocb.add_callback(self.prop_vendor_ack)
-        
-        # give it to the application
-        this_application.request_io(iocb)
-        
-    def prop_vendor_ack(self,iocb):
-       
-        # do something for success
-        if iocb.ioResponse:
-            apdu = iocb.ioResponse
-
-        # decode results from bacnet_settings's read property 
-        self.response_bacset = net.dcode(apdu) 
-        
-        # get actual proxy IP from Device
-        actual_IP = self.response_bacset[1]
-        
-        # Check public IP
-        public_IP = self.get_public_ip()
-        print public_IP
-        
-        # check if IPs are real IPV4  
-        # If both IPs are different, do a write property to the correct object
-        if self.validate_ip(actual_IP) and self.validate_ip(public_IP):
-            if actual_IP != public_IP:
-                self.proxyIP = public_IP
-                deferred(self.write_bac_set) 
-                print actual_IP, public_IP
-            else:
-                print "IPs are the same"
-                stop()
-        else:
-            print "IPs are not valid"
-            stop()
-                
-        #deferred(self.write_bac_set) 
-        
-        # do something for error/reject/abort
+        request.pduDestination = dev.address
+        request.propertyArrayIndex = dev.idx
+
+        iocb = yield request_io(self.scheduler, request)
         if iocb.ioError:
-            sys.stdout.write(str(iocb.ioError) + '\n')
-
-        
-    def write_bac_set(self):
-        
-        addr = point_list[0][0]
-        obj_type = self.obj
-        obj_inst = self.inst
-        prop_id = self.prop
-        
-        tags = self.response_bacset[0]
-        proxy_ip = self.proxyIP
-        print tags
-        print proxy_ip
+            self.finish(dev, str(iocb.ioError))
+            return
 
-        try:
+        # decode results from bacnet_settings's read property
+        settings = dev.response_bacset = net.dcode(iocb.ioResponse)
 
-            # build a request
-            request = WritePropertyRequest(
-                objectIdentifier=(obj_type, obj_inst),
-                propertyIdentifier=prop_id,
-                )
-            request.pduDestination = Address(addr)
-            request.propertyArrayIndex = self.idx
+        # Check public IP, the resolver may have it already
+        iocb = yield request_io(self.resolver, IOCB())
+        if iocb.ioError:
+            self.finish(dev, "no public IP: %s" % (iocb.ioError,))
+            return
 
-            # build a custom datastructure... BACnet settings IP net or bcp
-            tag_list = contextTagsToWrite.build_list(self.response_bacset,proxy_ip)
-            
-            #if _debug: WriteSomethingConsoleCmd._debug("    - tag_list: %r", tag_list)
+        actual_IP = settings.proxy_ip
+        public_IP = iocb.ioResponse
 
-            # stuff the tag list into an Any
-            request.propertyValue = Any()
-            request.propertyValue.decode(tag_list)
+        # check if IPs are real IPV4
+        if not (validate_ip(actual_IP) and validate_ip(public_IP)):
+            self.finish(dev, "IPs are not valid %s %s" % (actual_IP, public_IP))
+            return
+        if actual_IP == public_IP:
+            self.finish(dev, "IPs are the same %s" % (actual_IP,))
+            return
+        dev.proxyIP = public_IP
+
+        # write back the tags read from the device with only the proxy IP
+        # changed, the foreign IP and the other settings stay as they are
+        template = get_template(dev.obj, dev.prop, settings.firmware)
+        changes = diff_settings(settings, {'proxy_ip': dev.proxyIP}, template)
+        if not changes:
+            self.finish(dev, "IPs are the same %s" % (settings.proxy_ip,))
+            return
 
-            #if _debug: WriteSomethingConsoleCmd._debug("    - request: %r", request)
+        request = write_request(settings, changes, template, dev.address, dev.idx)
+        if _debug: WhoIsIAmApplication._debug("    - request: %r", request)
 
-            # make an IOCB
-            iocb = IOCB(request)
-            #if _debug: WriteSomethingConsoleCmd._debug("    - iocb: %r", iocb)
-            
-            # set a callback for the response
-            iocb.add_callback(self.simple_ack)
+        iocb = yield request_io(self.scheduler, request)
+        if iocb.ioError:
+            self.finish(dev, str(iocb.ioError))
+        elif not isinstance(iocb.ioResponse, SimpleAckPDU):
+            if _debug: WhoIsIAmApplication._debug("    - not an ack")
+            self.finish(dev, "not an ack")
+        else:
+            self.finish(dev, "ack %s" % (dev.proxyIP,))
 
-            # give it to the application
-            this_application.request_io(iocb)
+    def conversation_done(self, iocb, dev):
+        if _debug: WhoIsIAmApplication._debug("conversation_done %r %r", iocb, dev)
 
-        except Exception as error:
-            #WriteSomethingConsoleCmd._exception("exception: %r", error)  
-            print error 
-            
-    def simple_ack(self,iocb):
-        if iocb.ioResponse:
-            # should be an ack
-            if not isinstance(iocb.ioResponse, SimpleAckPDU):
-                #if _debug: WriteSomethingConsoleCmd._debug("    - not an ack")
-                #return
-                stop()
-
-            sys.stdout.write("ack\n") 
-            stop()
-                
-        # do something for error/reject/abort
+        # an exception escaped the conversation
         if iocb.ioError:
-            sys.stdout.write(str(iocb.ioError) + '\n')
-            stop() 
-            
-    def get_public_ip(self):
-        my_ip = load(urlopen('http://jsonip.com'))['ip']
-        return my_ip
- 
-    def validate_ip(self,s):
-        a = s.split('.')
-        if len(a) != 4:
-            return False
-        for x in a:
-            if not x.isdigit():
-                return False
-            i = int(x)
-            if i < 0 or i > 255:
-                return False
-            
-        return True
-    
-    
-#        
+            WhoIsIAmApplication._error("exception: %r", iocb.ioError)
+            self.finish(dev, str(iocb.ioError))
+
+    def finish(self, dev, result):
+        if _debug: WhoIsIAmApplication._debug("finish %r %r", dev, result)
+
+        # only once
+        if dev.deviceInstance not in self.unfinished:
+            return
+        self.unfinished.discard(dev.deviceInstance)
+
+        dev.result = result
+        sys.stdout.write("%d %s %s\n" % (dev.deviceInstance, dev.address, result))
+        sys.stdout.flush()
+
+        # stop when every device is done
+        if not self.unfinished:
+            stop()
+
+
+#
 #   WhoIsIAmConsoleCmd
 #
 
@@ -379,7 +352,7 @@ class WhoIsIAmCmd():
 
         except Exception as err:
             WhoIsIAmCmd._exception("exception: %r", err)
-            
+
 
 #
 #   main
@@ -389,11 +362,71 @@ def main():
     global this_device, this_application
 
     # parse the command line arguments
-    args = ConfigArgumentParser(description=__doc__).parse_args()
+    parser = ConfigArgumentParser(description=__doc__)
+
+    # devices to check, defaults to the single device
+    parser.add_argument('devices', type=str, nargs='*',
+        default=[str(device)],
+        help='device instances or lo-hi ranges',
+        )
+
+    # limits for requests in flight
+    parser.add_argument('--max-outstanding', type=int,
+        default=16,
+        help='maximum number of requests in flight',
+        )
+    parser.add_argument('--max-per-device', type=int,
+        default=1,
+        help='maximum number of requests in flight to one device',
+        )
+    parser.add_argument('--device-window', type=str, action='append',
+        help='LENGTH=SIZE, requests in flight to devices with that maximum APDU length, may be repeated',
+        )
+
+    # how long to wait for I-Am's
+    parser.add_argument('--timeout', type=float,
+        default=10.0,
+        help='seconds to wait for devices to answer the Who-Is',
+        )
+
+    # public IP lookup
+    parser.add_argument('--public-ip-provider', type=str, action='append',
+        help='URL that answers with the public IP, may be repeated',
+        )
+    parser.add_argument('--public-ip-quorum', type=int,
+        default=1,
+        help='number of providers that must agree',
+        )
+    parser.add_argument('--public-ip-ttl', type=float,
+        default=300.0,
+        help='seconds to keep the public IP',
+        )
+
+    # where the devices were found last time
+    parser.add_argument('--discovery-cache', type=str,
+        default=DEFAULT_PATH,
+        help='file of devices found by earlier runs',
+        )
+    parser.add_argument('--discovery-ttl', type=float,
+        default=86400.0,
+        help='seconds before a device is found again with a Who-Is',
+        )
+
+    args = parser.parse_args()
 
     if _debug: _log.debug("initialization")
     if _debug: _log.debug("    - args: %r", args)
 
+    # the engine changes to the library and the compiled codecs of the
+    # property services, before any PDU is made
+    engine.install(codecs=True)
+
+    try:
+        devices = parse_device_list(args.devices)
+        windows = parse_windows(args.device_window)
+    except ValueError as err:
+        parser.error(str(err))
+
     # make a device object
     this_device = LocalDeviceObject(
         objectName=args.ini.objectname,
@@ -415,7 +448,23 @@ def main():
     this_device.protocolServicesSupported = pss.value
 
     # make a simple application
-    this_application = WhoIsIAmApplication(this_device, args.ini.address)
+    this_application = WhoIsIAmApplication(
+        devices,
+        this_device, args.ini.address,
+        max_outstanding=args.max_outstanding,
+        max_per_device=args.max_per_device,
+        timeout=args.timeout,
+        resolver=PublicIPResolver(
+            providers=args.public_ip_provider,
+            quorum=args.public_ip_quorum,
+            ttl=args.public_ip_ttl,
+            ),
+        deviceInfoCache=DiscoveryCache(
+            path=args.discovery_cache,
+            ttl=args.discovery_ttl,
+            ),
+        windows=windows,
+        )
     if _debug: _log.debug("    - this_application: %r", this_application)
 
     # get the services supported
@@ -425,19 +474,16 @@ def main():
     # let the device object know
     this_device.protocolServicesSupported = services_supported.value
 
-    # make a console
-    #this_console = WhoIsIAmConsoleCmd().do_whois("1200 1200")
-    this_console = WhoIsIAmCmd().do_whois(str(device)+" "+str(device))
-
-    if _debug: _log.debug("    - this_console: %r", this_console)
-
-    # enable sleeping will help with threads
-    enable_sleeping()
+    # send out the Who-Is requests when the core is running
+    deferred(this_application.start)
 
     _log.debug("running")
 
     run()
-     
+
+    # keep what was found for next time
+    this_application.deviceInfoCache.flush()
+
     _log.debug("fini")
 
 
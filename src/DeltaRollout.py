@@ -0,0 +1,294 @@
+#!/usr/bin/env python
+
+"""
+This application saves the settings of a set of Delta controllers to flash
+and restarts them, a wave of devices at a time.  A restarted device has to
+send an I-Am or answer a read before the deadline, when too many devices of
+a wave fail the rest are left alone.  Progress is written as JSON lines.
+
+Exemple: DeltaRollout.py 1200 1300-1310 --wave-size 5 --health read
+"""
+
+import sys
+import json
+
+from bacpypes.debugging import bacpypes_debugging, ModuleLogger
+from bacpypes.consolelogging import ConfigArgumentParser
+
+from bacpypes.core import stop, deferred
+from bacpypes.iocb import IOCB
+from bacpypes.task import FunctionTask
+
+from bacpypes.pdu import GlobalBroadcast
+from bacpypes.apdu import WhoIsRequest, IAmRequest
+from bacpypes.errors import DecodingError
+
+from bacpypes.app import BIPSimpleApplication
+from bacpypes.service.device import LocalDeviceObject
+
+import engine
+from engine.loop import run
+from engine.appservice import index_transactions
+from fleet.devices import parse_device_list, device_ranges
+from fleet.discovery import DiscoveryCache, DEFAULT_PATH
+from fleet.rollout import Rollout, OPERATIONS, HEALTH_CHECKS
+
+# some debugging
+_debug = 0
+_log = ModuleLogger(globals())
+
+# globals
+this_application = None
+
+#
+#   RolloutApplication
+#
+
+@bacpypes_debugging
+class RolloutApplication(BIPSimpleApplication):
+
+    def __init__(self, device_list, rollout_args, localDevice, localAddress,
+            timeout=10.0, deviceInfoCache=None):
+        if _debug: RolloutApplication._debug("__init__ %r %r %r %r", device_list, rollout_args, localDevice, localAddress)
+        BIPSimpleApplication.__init__(self, localDevice, localAddress,
+            deviceInfoCache or DiscoveryCache(path=None))
+
+        # find the transactions by address and invoke ID
+        index_transactions(self)
+
+        self.device_list = device_list
+        self.device_set = set(device_list)
+        self.rollout_args = rollout_args
+
+        # how long to wait for I-Am's
+        self.timeout = timeout
+
+        # where the devices are
+        self.addresses = {}
+
+        # made when the devices are found
+        self.rollout = None
+        self.discovery_task = None
+
+    def start(self):
+        if _debug: RolloutApplication._debug("start")
+
+        # devices with a fresh entry in the cache need no Who-Is
+        unknown = []
+        for device_instance in self.device_list:
+            record = self.deviceInfoCache.lookup(device_instance)
+            if record:
+                self.addresses[device_instance] = record.address
+            else:
+                unknown.append(device_instance)
+
+        if not unknown:
+            deferred(self.discovery_done)
+            return
+
+        # ask for the rest, one Who-Is for each run of instances
+        for lo, hi in device_ranges(unknown):
+            request = WhoIsRequest(
+                deviceInstanceRangeLowLimit=lo,
+                deviceInstanceRangeHighLimit=hi,
+                )
+            request.pduDestination = GlobalBroadcast()
+            self.request_io(IOCB(request))
+
+        # give up on those that do not answer
+        self.discovery_task = FunctionTask(self.discovery_done)
+        self.discovery_task.install_task(delta=self.timeout)
+
+    def indication(self, apdu):
+        if _debug: RolloutApplication._debug("indication %r", apdu)
+
+        if isinstance(apdu, IAmRequest):
+            device_type, device_instance = apdu.iAmDeviceIdentifier
+            if device_type != 'device':
+                raise DecodingError("invalid object type")
+
+            if device_instance in self.device_set:
+                self.deviceInfoCache.add_device_info(apdu)
+
+                # restarted devices say they are back
+                if self.rollout:
+                    self.rollout.i_am(apdu)
+
+                elif device_instance not in self.addresses:
+                    self.addresses[device_instance] = apdu.pduSource
+
+                    # everybody answered
+                    if len(self.addresses) == len(self.device_list):
+                        self.discovery_task.suspend_task()
+                        deferred(self.discovery_done)
+
+        # forward it along
+        BIPSimpleApplication.indication(self, apdu)
+
+    def discovery_done(self):
+        if _debug: RolloutApplication._debug("discovery_done")
+
+        for device_instance in self.device_list:
+            if device_instance not in self.addresses:
+                self.write({'event': 'failed', 'device': device_instance, 'error': "no response"})
+
+        targets = [(device_instance, self.addresses[device_instance])
+            for device_instance in self.device_list
+            if device_instance in self.addresses]
+
+        self.rollout = Rollout(self, targets,
+            progress=self.write,
+            done=stop,
+            **self.rollout_args
+            )
+        self.rollout.start()
+
+    def write(self, line):
+        sys.stdout.write(json.dumps(line, sort_keys=True) + '\n')
+        sys.stdout.flush()
+
+#
+#   __main__
+#
+
+def main():
+    global this_application
+
+    # parse the command line arguments
+    parser = ConfigArgumentParser(description=__doc__)
+
+    parser.add_argument('devices', type=str, nargs='+',
+        help='device instances or lo-hi ranges',
+        )
+    parser.add_argument('--operations', type=str,
+        default=','.join(OPERATIONS),
+        help='what to do to each device, any of %s' % (', '.join(OPERATIONS),),
+        )
+    parser.add_argument('--state', type=str,
+        default='warmstart',
+        help='reinitialized state of the devices',
+        )
+    parser.add_argument('--password', type=str,
+        help='reinitialize device password',
+        )
+
+    # waves
+    parser.add_argument('--wave-size', type=int,
+        default=10,
+        help='number of devices in a wave',
+        )
+    parser.add_argument('--concurrency', type=int,
+        help='maximum number of requests in flight, defaults to the wave size',
+        )
+    parser.add_argument('--max-failures', type=int,
+        default=0,
+        help='failed devices a wave can have before the rollout stops',
+        )
+
+    # health gate
+    parser.add_argument('--health', type=str,
+        default='iam', choices=HEALTH_CHECKS,
+        help='wait for an I-Am or read the system status',
+        )
+    parser.add_argument('--deadline', type=float,
+        default=120.0,
+        help='seconds for a restarted device to come back',
+        )
+    parser.add_argument('--settle', type=float,
+        default=5.0,
+        help='seconds after the restart before the first read',
+        )
+    parser.add_argument('--interval', type=float,
+        default=5.0,
+        help='seconds between reads',
+        )
+
+    # discovery
+    parser.add_argument('--timeout', type=float,
+        default=10.0,
+        help='seconds to wait for devices to answer the Who-Is',
+        )
+    parser.add_argument('--discovery-cache', type=str,
+        default=DEFAULT_PATH,
+        help='file of devices found by earlier runs',
+        )
+    parser.add_argument('--discovery-ttl', type=float,
+        default=86400.0,
+        help='seconds before a device is found again with a Who-Is',
+        )
+
+    args = parser.parse_args()
+
+    if _debug: _log.debug("initialization")
+    if _debug: _log.debug("    - args: %r", args)
+
+    # the engine changes to the library and the compiled codecs of the
+    # property services, before any PDU is made
+    engine.install(codecs=True)
+
+    operations = [operation.strip() for operation in args.operations.split(',') if operation.strip()]
+    for operation in operations:
+        if operation not in OPERATIONS:
+            parser.error("unknown operation: %r" % (operation,))
+    if args.wave_size < 1:
+        parser.error("wave size must be at least one")
+    try:
+        devices = parse_device_list(args.devices)
+    except ValueError as err:
+        parser.error(str(err))
+
+    rollout_args = dict(
+        operations=operations,
+        wave_size=args.wave_size,
+        concurrency=args.concurrency,
+        state=args.state,
+        password=args.password,
+        health=args.health,
+        deadline=args.deadline,
+        settle=args.settle,
+        interval=args.interval,
+        max_failures=args.max_failures,
+        )
+
+    # make a device object
+    this_device = LocalDeviceObject(
+        objectName=args.ini.objectname,
+        objectIdentifier=int(args.ini.objectidentifier),
+        maxApduLengthAccepted=int(args.ini.maxapdulengthaccepted),
+        segmentationSupported=args.ini.segmentationsupported,
+        vendorIdentifier=int(args.ini.vendoridentifier),
+        )
+
+    # make a simple application
+    this_application = RolloutApplication(
+        devices, rollout_args,
+        this_device, args.ini.address,
+        timeout=args.timeout,
+        deviceInfoCache=DiscoveryCache(
+            path=args.discovery_cache,
+            ttl=args.discovery_ttl,
+            ),
+        )
+    if _debug: _log.debug("    - this_application: %r", this_application)
+
+    # get the services supported
+    services_supported = this_application.get_services_supported()
+    if _debug: _log.debug("    - services_supported: %r", services_supported)
+
+    # let the device object know
+    this_device.protocolServicesSupported = services_supported.value
+
+    # find the devices when the core is running
+    deferred(this_application.start)
+
+    _log.debug("running")
+
+    run()
+
+    # keep what was found for next time
+    this_application.deviceInfoCache.flush()
+
+    _log.debug("fini")
+
+if __name__ == "__main__":
+    main()
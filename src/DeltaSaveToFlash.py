@@ -10,20 +10,21 @@ integers.
 
 import sys
 
-from bacpypes.debugging import bacpypes_debugging, ModuleLogger, xtob
+from bacpypes.debugging import bacpypes_debugging, ModuleLogger
 from bacpypes.consolelogging import ConfigArgumentParser
 from bacpypes.consolecmd import ConsoleCmd
 
-from bacpypes.core import run, enable_sleeping
 from bacpypes.iocb import IOCB
 
 from bacpypes.pdu import Address
 from bacpypes.app import BIPSimpleApplication
 from bacpypes.service.device import LocalDeviceObject
 
-from bacpypes.primitivedata import TagList, ApplicationTag
-from bacpypes.constructeddata import Any
-from bacpypes.apdu import WritePropertyRequest, SimpleAckPDU
+from bacpypes.apdu import SimpleAckPDU
+
+import engine
+from engine.loop import run
+from fleet.jobs import save_to_flash_request
 
 # some debugging
 _debug = 0
@@ -46,32 +47,14 @@ class SaveToFlashConsoleCmd(ConsoleCmd):
 
         try:
             addr, obj_inst = args[:2]
-            
-            # object type = 8 (device). property = 1151 (SaveToFlash)  
-            obj_type = 8
-            obj_inst = int(obj_inst)
-            prop_id = 1151
-
-            # build a request
-            request = WritePropertyRequest(
-                objectIdentifier=(obj_type, obj_inst),
-                propertyIdentifier=prop_id,
-                )
-            request.pduDestination = Address(addr)
+
+            # object type = 8 (device). property = 1151 (SaveToFlash), an
+            # Enumerated value of 1 means SaveToFlash
+            request = save_to_flash_request(addr, obj_inst)
 
             if len(args) == 5:
                 request.propertyArrayIndex = int(args[4])
 
-            # send an Enumerated value of 1 means SaveToFlash
-            tag_list = TagList([
-                ApplicationTag(9, xtob('01'))
-                ])
-            if _debug: SaveToFlashConsoleCmd._debug("    - tag_list: %r", tag_list)
-
-            # stuff the tag list into an Any
-            request.propertyValue = Any()
-            request.propertyValue.decode(tag_list)
-
             if _debug: SaveToFlashConsoleCmd._debug("    - request: %r", request)
 
             # make an IOCB
@@ -114,6 +97,9 @@ def main():
     if _debug: _log.debug("initialization")
     if _debug: _log.debug("    - args: %r", args)
 
+    # the engine changes to the library, before any PDU is made
+    engine.install()
+
     # make a device object
     this_device = LocalDeviceObject(
         objectName=args.ini.objectname,
@@ -138,9 +124,6 @@ def main():
     this_console = SaveToFlashConsoleCmd()
     if _debug: _log.debug("    - this_console: %r", this_console)
 
-    # enable sleeping will help with threads
-    enable_sleeping()
-
     _log.debug("running")
 
     run()
@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+
+"""
+This application reads the BACnet settings of a set of Delta controllers,
+compares them with a desired state and writes only the devices and fields
+that are different.  The desired state is a JSON file:
+
+    {
+        "kind": "net",
+        "array_index": 5,
+        "defaults": {"proxy_ip": "72.12.96.12"},
+        "devices": {
+            "1200": {"address": "192.168.5.50"},
+            "1201": {"ip_port": 47809}
+            }
+    }
+
+Devices without an address are looked up in the discovery cache.  The
+results are written as JSON lines.
+
+Exemple: DeltaSettingsSync.py desired.json --dry-run
+"""
+
+import sys
+import json
+
+from bacpypes.debugging import bacpypes_debugging, ModuleLogger
+from bacpypes.consolelogging import ConfigArgumentParser
+
+from bacpypes.core import stop, deferred
+from bacpypes.iocb import IOCB
+
+from bacpypes.pdu import Address
+from bacpypes.apdu import SimpleAckPDU
+
+from bacpypes.app import BIPSimpleApplication
+from bacpypes.service.device import LocalDeviceObject
+
+from decode import bcp, net
+from decode.template import get_template
+
+import engine
+from engine.loop import run
+from engine.appservice import index_transactions
+from fleet.jobs import read_settings_request
+from fleet.scheduler import IOCBScheduler
+from fleet.discovery import DiscoveryCache, DEFAULT_PATH
+from fleet.diff import normalize, diff_settings, write_request
+
+# some debugging
+_debug = 0
+_log = ModuleLogger(globals())
+
+# globals
+this_application = None
+
+# settings kinds, the decoding module and the default array index
+_kinds = {
+    'bcp': (bcp, bcp.ARRAY_INDEX),
+    'net': (net, net.ARRAY_INDEX_DSC),
+    }
+
+#
+#   load_spec
+#
+
+def load_spec(path, cache):
+    """Read the desired state, return the decoding module, the array index
+    and a list of (device instance, address, desired values) tuples."""
+    with open(path, 'rb') as f:
+        spec = json.load(f)
+
+    module, array_index = _kinds[spec.get('kind', 'net')]
+    array_index = int(spec.get('array_index', array_index))
+    defaults = spec.get('defaults', {})
+
+    # check the field names before anything is sent
+    template = get_template(module.OBJECT_TYPE, module.PROPERTY_ID, spec.get('firmware', '3.40'))
+
+    targets = []
+    for device_instance, fields in sorted(spec.get('devices', {}).items(), key=lambda item: int(item[0])):
+        device_instance = int(device_instance)
+        fields = dict(fields)
+
+        address = fields.pop('address', None)
+        if address:
+            address = Address(str(address))
+        else:
+            record = cache.lookup(device_instance)
+            address = record and record.address
+
+        desired = dict(defaults)
+        desired.update(fields)
+        for name, value in desired.items():
+            normalize(template, name, value)
+
+        targets.append((device_instance, address, desired))
+
+    return module, array_index, targets
+
+#
+#   SyncApplication
+#
+
+@bacpypes_debugging
+class SyncApplication(BIPSimpleApplication):
+
+    def __init__(self, module, array_index, targets, localDevice, localAddress,
+            max_outstanding=16, dry_run=False, deviceInfoCache=None):
+        if _debug: SyncApplication._debug("__init__ %r %r (%d targets) %r %r", module, array_index, len(targets), localDevice, localAddress)
+        BIPSimpleApplication.__init__(self, localDevice, localAddress, deviceInfoCache)
+
+        # find the transactions by address and invoke ID
+        index_transactions(self)
+
+        self.module = module
+        self.arrayIndex = array_index
+        self.targets = targets
+        self.dry_run = dry_run
+
+        # devices not finished yet
+        self.unfinished = len(targets)
+
+        # limit the number of requests in flight
+        self.scheduler = IOCBScheduler(self, max_outstanding, 1)
+
+    def start(self):
+        if _debug: SyncApplication._debug("start")
+
+        if not self.targets:
+            stop()
+            return
+
+        for device_instance, address, desired in self.targets:
+            if address is None:
+                self.finish(device_instance, None, 'failed', error="unknown address")
+                continue
+
+            # read what the device has now
+            iocb = IOCB(read_settings_request(address, self.module, self.arrayIndex))
+            iocb.add_callback(self.read_ack, device_instance, address, desired)
+            self.scheduler.request_io(iocb)
+
+    def read_ack(self, iocb, device_instance, address, desired):
+        if _debug: SyncApplication._debug("read_ack %r %r %r %r", iocb, device_instance, address, desired)
+
+        # do something for error/reject/abort
+        if iocb.ioError:
+            self.finish(device_instance, address, 'failed', error="read: %s" % (iocb.ioError,))
+            return
+
+        try:
+            settings = self.module.dcode(iocb.ioResponse)
+            template = get_template(self.module.OBJECT_TYPE, self.module.PROPERTY_ID, settings.firmware)
+            changes = diff_settings(settings, desired, template)
+        except Exception as error:
+            SyncApplication._exception("exception: %r", error)
+            self.finish(device_instance, address, 'failed', error=str(error))
+            return
+
+        # nothing to do, nothing built
+        if not changes:
+            self.finish(device_instance, address, 'unchanged')
+            return
+
+        if self.dry_run:
+            self.finish(device_instance, address, 'different', changes=changes)
+            return
+
+        try:
+            request = write_request(settings, changes, template, address, self.arrayIndex)
+            if _debug: SyncApplication._debug("    - request: %r", request)
+        except Exception as error:
+            SyncApplication._exception("exception: %r", error)
+            self.finish(device_instance, address, 'failed', error=str(error), changes=changes)
+            return
+
+        iocb = IOCB(request)
+        iocb.add_callback(self.write_ack, device_instance, address, changes)
+        self.scheduler.request_io(iocb)
+
+    def write_ack(self, iocb, device_instance, address, changes):
+        if _debug: SyncApplication._debug("write_ack %r %r %r %r", iocb, device_instance, address, changes)
+
+        # do something for error/reject/abort
+        if iocb.ioError:
+            self.finish(device_instance, address, 'failed', error="write: %s" % (iocb.ioError,), changes=changes)
+        elif not isinstance(iocb.ioResponse, SimpleAckPDU):
+            self.finish(device_instance, address, 'failed', error="write: not an ack", changes=changes)
+        else:
+            self.finish(device_instance, address, 'written', changes=changes)
+
+    def finish(self, device_instance, address, status, **kwargs):
+        if _debug: SyncApplication._debug("finish %r %r %r %r", device_instance, address, status, kwargs)
+
+        line = {
+            'device': device_instance,
+            'address': str(address) if address else None,
+            'status': status,
+            }
+        if 'changes' in kwargs:
+            kwargs['changes'] = dict((name, {'current': current, 'desired': wanted})
+                for name, (current, wanted) in kwargs['changes'].items())
+        line.update(kwargs)
+
+        sys.stdout.write(json.dumps(line, sort_keys=True) + '\n')
+        sys.stdout.flush()
+
+        # stop when every device is done
+        self.unfinished -= 1
+        if not self.unfinished:
+            stop()
+
+#
+#   __main__
+#
+
+def main():
+    global this_application
+
+    # parse the command line arguments
+    parser = ConfigArgumentParser(description=__doc__)
+
+    parser.add_argument('spec', type=str,
+        help='JSON file of the desired settings',
+        )
+    parser.add_argument('--dry-run', action='store_true',
+        default=False,
+        help='report the differences without writing',
+        )
+    parser.add_argument('--max-outstanding', type=int,
+        default=16,
+        help='maximum number of requests in flight',
+        )
+    parser.add_argument('--discovery-cache', type=str,
+        default=DEFAULT_PATH,
+        help='file of devices found by earlier runs',
+        )
+
+    args = parser.parse_args()
+
+    if _debug: _log.debug("initialization")
+    if _debug: _log.debug("    - args: %r", args)
+
+    # the engine changes to the library and the compiled codecs of the
+    # property services, before any PDU is made
+    engine.install(codecs=True)
+
+    # check the whole file before anything is sent, there is no Who-Is so
+    # any address in the cache is better than none
+    cache = DiscoveryCache(path=args.discovery_cache, ttl=float('inf'))
+    module, array_index, targets = load_spec(args.spec, cache)
+    if _debug: _log.debug("    - %d targets", len(targets))
+
+    # make a device object
+    this_device = LocalDeviceObject(
+        objectName=args.ini.objectname,
+        objectIdentifier=int(args.ini.objectidentifier),
+        maxApduLengthAccepted=int(args.ini.maxapdulengthaccepted),
+        segmentationSupported=args.ini.segmentationsupported,
+        vendorIdentifier=int(args.ini.vendoridentifier),
+        )
+
+    # make a simple application
+    this_application = SyncApplication(
+        module, array_index, targets,
+        this_device, args.ini.address,
+        max_outstanding=args.max_outstanding,
+        dry_run=args.dry_run,
+        deviceInfoCache=cache,
+        )
+    if _debug: _log.debug("    - this_application: %r", this_application)
+
+    # get the services supported
+    services_supported = this_application.get_services_supported()
+    if _debug: _log.debug("    - services_supported: %r", services_supported)
+
+    # let the device object know
+    this_device.protocolServicesSupported = services_supported.value
+
+    # read the devices when the core is running
+    deferred(this_application.start)
+
+    _log.debug("running")
+
+    run()
+
+    _log.debug("fini")
+
+if __name__ == "__main__":
+    main()
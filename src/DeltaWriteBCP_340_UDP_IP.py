@@ -17,16 +17,17 @@ from bacpypes.debugging import bacpypes_debugging, ModuleLogger, xtob
 from bacpypes.consolelogging import ConfigArgumentParser
 from bacpypes.consolecmd import ConsoleCmd
 
-from bacpypes.core import run, enable_sleeping
 from bacpypes.iocb import IOCB
 
 from bacpypes.pdu import Address
 from bacpypes.app import BIPSimpleApplication
 from bacpypes.service.device import LocalDeviceObject
 
-from bacpypes.primitivedata import TagList, OpeningTag, ClosingTag, ContextTag
-from bacpypes.constructeddata import Any
-from bacpypes.apdu import WritePropertyRequest, SimpleAckPDU
+from bacpypes.apdu import SimpleAckPDU
+
+from decode import bcp
+import engine
+from engine.loop import run
 
 # some debugging
 _debug = 0
@@ -48,76 +49,15 @@ class WriteSomethingConsoleCmd(ConsoleCmd):
         if _debug: WriteSomethingConsoleCmd._debug("do_write %r", args)
 
         try:
-            addr, obj_type, obj_inst, prop_id = args[:4]
-
-            obj_type = 162 #int(obj_type)
-            obj_inst = 1 #int(obj_inst)
-            prop_id = 1034 #int(prop_id)
-
-            # build a request
-            request = WritePropertyRequest(
-                objectIdentifier=(obj_type, obj_inst),
-                propertyIdentifier=prop_id,
+            addr = args[0]
+
+            # build the request from the BACnet settings BCP object IP BBMD Foreign port eTCH 3.40
+            # template, IP Type 00=Regular, 01=Foreign, 02=BBMD
+            request = bcp.template_340.request(addr,
+                net_number=0x9c40,
+                ip_type=2,
+                proxy_ip='70.54.200.18',
                 )
-            request.pduDestination = Address(addr)
-
-            if len(args) >= 5: 
-                request.propertyArrayIndex = 2 #int(args[4])
-
-            if len(args) == 6:
-                #convert ip to byte array and then to hex string
-                proxy = bytearray(args[5])
-                proxy_hex = str(proxy).encode('hex')
-
-            # build a custom datastructure... BACnet settings BCP object IP BBMD Foreign port eTCH 3.40
-            # Context #0 inside Opening tag #9 is the IP Type 00=Regular, 01=Foreign, 02=BBMD
-            # Context #4 inside Opening tag #9 is the Proxy IP in hex
-            tag_list = TagList([
-                OpeningTag(0),
-                ContextTag(0, xtob('19')),
-                ContextTag(1, xtob('01')),
-                ClosingTag(0),
-                ContextTag(1, xtob('01')),
-                ContextTag(2, xtob('00')),
-                ContextTag(3, xtob('9c40')),
-                ContextTag(4, xtob('00')),
-                OpeningTag(5),
-                ContextTag(0, xtob('00')),
-                ContextTag(1, xtob('00')), 
-                ClosingTag(5),
-                ContextTag(6, xtob('00')),
-                ContextTag(7, xtob('00')),
-                OpeningTag(8),
-                ContextTag(0, xtob('00')),
-                ContextTag(1, xtob('00')), 
-                ContextTag(2, xtob('00')),
-                ContextTag(3, xtob('00')),
-                ContextTag(4, xtob('00')), 
-                ContextTag(5, xtob('00')),
-                ContextTag(6, xtob('00')),
-                ContextTag(7, xtob('00')),
-                ContextTag(8, xtob('ffffffff')), 
-                ClosingTag(8),               
-                OpeningTag(9),
-                ContextTag(0, xtob('02')),
-                ContextTag(1, xtob('bac0')), 
-                ContextTag(2, xtob('00')),
-                ContextTag(3, xtob('3c')),
-                ContextTag(4, xtob('4636c812')), 
-                ContextTag(5, xtob('00')),
-                ContextTag(6, xtob('ffffffff')), 
-                ClosingTag(9), 
-                ContextTag(10, xtob('00')),
-                ContextTag(11, xtob('00')),
-                ContextTag(12, xtob('00')),
-                ContextTag(13, xtob('00000000'))                
-                ])
-            if _debug: WriteSomethingConsoleCmd._debug("    - tag_list: %r", tag_list)
-
-            # stuff the tag list into an Any
-            request.propertyValue = Any()
-            request.propertyValue.decode(tag_list)
-
             if _debug: WriteSomethingConsoleCmd._debug("    - request: %r", request)
 
             # make an IOCB
@@ -160,6 +100,9 @@ def main():
     if _debug: _log.debug("initialization")
     if _debug: _log.debug("    - args: %r", args)
 
+    # the engine changes to the library, before any PDU is made
+    engine.install()
+
     # make a device object
     this_device = LocalDeviceObject(
         objectName=args.ini.objectname,
@@ -184,9 +127,6 @@ def main():
     this_console = WriteSomethingConsoleCmd()
     if _debug: _log.debug("    - this_console: %r", this_console)
 
-    # enable sleeping will help with threads
-    enable_sleeping()
-
     _log.debug("running")
 
     run()
@@ -17,18 +17,21 @@ from bacpypes.debugging import bacpypes_debugging, ModuleLogger
 from bacpypes.consolelogging import ConfigArgumentParser
 from bacpypes.consolecmd import ConsoleCmd
 
-from bacpypes.core import run, enable_sleeping
 from bacpypes.iocb import IOCB
 
 from bacpypes.pdu import Address
 from bacpypes.object import get_datatype, get_object_class
 
 from bacpypes.apdu import ReadPropertyRequest, Error, AbortPDU, ReadPropertyACK
-from bacpypes.primitivedata import Tag
 
 from bacpypes.app import BIPSimpleApplication
 from bacpypes.service.device import LocalDeviceObject
 
+from decode import bcp
+from decode.settings import dump_settings
+import engine
+from engine.loop import run
+
 
 # some debugging
 _debug = 0
@@ -84,195 +87,12 @@ class ReadPropertyAnyConsoleCmd(ConsoleCmd):
             # do something for success
             if iocb.ioResponse:
                 apdu = iocb.ioResponse
-                
-                temp = ""
-                opening_tag_0 = ""    
-                context_tag_1_2 = ""  
-                IP_NetNumber = 0 
-                context_tag_4 = ""  
-                opening_tag_5 = ""
-                context_tag_6_7 = ""
-                opening_tag_8 = ""
-                IP_type = ""    
-                IP_Port = 0 
-                Foreign_ttl = 0  
-                Proxy_IP = "0.0.0.0"                                                           
-                Foreign_IP = "0.0.0.0"  
-                context_tag_5_6 = ""    
-                context_tag_10_13 = ""
-
-                #get tag type
-                value_tag = apdu.propertyValue.tagList.Peek()
-
-                #opening tag #0
-                if value_tag.tagClass == Tag.openingTagClass:
-
-                    value_tag = apdu.propertyValue.tagList.Pop()
-                    value_tag = apdu.propertyValue.tagList.Peek()	
-
-                    for i in range(0,2):
-                        if (i >= 0) and (i <= 1):
-                            opening_tag_0 = opening_tag_0 + str(value_tag.tagData).encode('hex')	
-
-                        value_tag = apdu.propertyValue.tagList.Pop()
-                        value_tag = apdu.propertyValue.tagList.Peek()
-                        if (value_tag.tagClass == Tag.closingTagClass): break
-
-                    sys.stdout.write("opening_tag_0: "+str(opening_tag_0)+"\n")
-
-                else:
-                    pass
-
-                #Go forward in tagList
-                value_tag = apdu.propertyValue.tagList.Pop()
-                value_tag = apdu.propertyValue.tagList.Peek()                
-                
-                #context tag #1,2,3,4. Get Net Number
-                if value_tag.tagClass == Tag.contextTagClass:
-
-                    for i in range(1,5):
-                        if (i >= 1) and (i <= 2):
-                            context_tag_1_2 = context_tag_1_2 + str(value_tag.tagData).encode('hex') 
-                        elif (i == 3):
-                            IP_NetNumber = int(str(value_tag.tagData).encode('hex'),16)  
-                        elif (i == 4):
-                            context_tag_4 = str(value_tag.tagData).encode('hex')                                                         
-
-                        value_tag = apdu.propertyValue.tagList.Pop()
-                        value_tag = apdu.propertyValue.tagList.Peek()
-                        if (value_tag.tagClass == Tag.openingTagClass): break
-
-                    sys.stdout.write("context_tag_1_2: "+str(context_tag_1_2)+"\n")
-                    sys.stdout.write("IP_NetNumber: "+str(IP_NetNumber)+"\n")
-                    sys.stdout.write("context_tag_4: "+str(context_tag_4)+"\n")                    
-
-                else:
-                    pass                
-
-                #get next tag type
-                value_tag = apdu.propertyValue.tagList.Peek()
-
-                #opening tag #5
-                if value_tag.tagClass == Tag.openingTagClass:
-
-                    value_tag = apdu.propertyValue.tagList.Pop()
-                    value_tag = apdu.propertyValue.tagList.Peek()    
-
-                    for i in range(0,2):
-                        if (i >= 0) and (i <= 1):
-                            opening_tag_5 = opening_tag_5 + str(value_tag.tagData).encode('hex')    
-
-                        value_tag = apdu.propertyValue.tagList.Pop()
-                        value_tag = apdu.propertyValue.tagList.Peek()
-                        if (value_tag.tagClass == Tag.closingTagClass): break
-
-                    sys.stdout.write("opening_tag_5: "+str(opening_tag_5)+"\n")
-
-                else:
-                    pass
-
-                #Go forward in tagList
-                value_tag = apdu.propertyValue.tagList.Pop()
-                value_tag = apdu.propertyValue.tagList.Peek()                
-              
-                #context tag #6,7 Get Net Number
-                if value_tag.tagClass == Tag.contextTagClass:
-
-                    for i in range(6,8):
-                        if (i >= 6) and (i <= 7):
-                            context_tag_6_7 = context_tag_6_7 + str(value_tag.tagData).encode('hex') 
- 
-                        value_tag = apdu.propertyValue.tagList.Pop()
-                        value_tag = apdu.propertyValue.tagList.Peek()
-                        if (value_tag.tagClass == Tag.openingTagClass): break
-
-                    sys.stdout.write("context_tag_6_7: "+str(context_tag_6_7)+"\n")
-
-                else:
-                    pass    
-
-                #get next tag type
-                value_tag = apdu.propertyValue.tagList.Peek()
-
-                #opening tag #8
-                if value_tag.tagClass == Tag.openingTagClass:
-
-                    value_tag = apdu.propertyValue.tagList.Pop()
-                    value_tag = apdu.propertyValue.tagList.Peek()    
-
-                    for i in range(0,9):
-                        if (i >= 0) and (i <= 8):
-                            opening_tag_8 = opening_tag_8 + str(value_tag.tagData).encode('hex')    
-
-                        value_tag = apdu.propertyValue.tagList.Pop()
-                        value_tag = apdu.propertyValue.tagList.Peek()
-                        if (value_tag.tagClass == Tag.closingTagClass): break
-
-                    sys.stdout.write("opening_tag_8: "+str(opening_tag_8)+"\n")
-
-                else:
-                    pass
-
-                #Go forward in tagList
-                value_tag = apdu.propertyValue.tagList.Pop()
-                value_tag = apdu.propertyValue.tagList.Peek()                
-              
-                #opening tag #9. Get Device Type, IP port,  Proxy addr and Foreign addr
-                if value_tag.tagClass == Tag.openingTagClass:
-                    
-                    value_tag = apdu.propertyValue.tagList.Pop()
-                    value_tag = apdu.propertyValue.tagList.Peek() 
-
-                    for i in range(0,7):
-                        if (i == 0):  
-                            IP_type = str(value_tag.tagData).encode('hex') 
-                        elif (i == 1): 
-                            IP_Port = int(str(value_tag.tagData).encode('hex'),16) 
-                        elif (i == 2): 
-                            temp = bytearray.fromhex(str(value_tag.tagData).encode('hex'))
-                            if len(temp) == 4: Foreign_IP = str(temp[0])+"."+str(temp[1])+"."+str(temp[2])+"."+str(temp[3]) 
-                        elif (i == 3): 
-                            Foreign_ttl = int(str(value_tag.tagData).encode('hex'),16)
-                        elif (i == 4): 
-                            temp = bytearray.fromhex(str(value_tag.tagData).encode('hex'))
-                            if len(temp) == 4: Proxy_IP = str(temp[0])+"."+str(temp[1])+"."+str(temp[2])+"."+str(temp[3])
-                        if (i >= 5) and (i <= 6):   
-                            context_tag_5_6 = context_tag_5_6 + str(value_tag.tagData).encode('hex')                             
-                             
-                        value_tag = apdu.propertyValue.tagList.Pop()
-                        value_tag = apdu.propertyValue.tagList.Peek()
-                        if (value_tag.tagClass == Tag.closingTagClass): break
-
-                    sys.stdout.write("Bacnet IP Type (00=Regular 01=Foreign 02=BBMD): "+str(IP_type)+"\n")
-                    sys.stdout.write("BACnet IP Port: "+str(IP_Port)+"\n")
-                    sys.stdout.write("Bacnet IP Foreign Address: "+str(Foreign_IP)+"\n")
-                    sys.stdout.write("Bacnet IP Foreign time to live: "+str(Foreign_ttl)+"\n")
-                    sys.stdout.write("Bacnet IP Proxy Address: "+str(Proxy_IP)+"\n")
-                    sys.stdout.write("context_tag_5_6: "+str(context_tag_5_6)+"\n")
-                    
-                else:
-                    pass   
-
-                #Go forward in tagList
-                value_tag = apdu.propertyValue.tagList.Pop()
-                value_tag = apdu.propertyValue.tagList.Peek()                
-              
-                #context tag #10,11,12,13
-                if value_tag.tagClass == Tag.contextTagClass:
-
-                    for i in range(10,14):
-                        if (i >= 10) and (i <= 13):
-                            context_tag_10_13 = context_tag_10_13 + str(value_tag.tagData).encode('hex') 
- 
-                        value_tag = apdu.propertyValue.tagList.Pop()
-                        value_tag = apdu.propertyValue.tagList.Peek()
-                        if (i == 14): break
-
-                    sys.stdout.write("context_tag_10_13: "+str(context_tag_10_13)+"\n")
-
-                else:
-                    pass  
-                
+
+                # decode the BACnet settings in one pass
+                settings = bcp.dcode(apdu)
+                if _debug: ReadPropertyAnyConsoleCmd._debug("    - settings: %r", settings)
+
+                dump_settings(settings)
                 sys.stdout.flush()
 
             # do something for error/reject/abort
@@ -295,6 +115,10 @@ def main():
     if _debug: _log.debug("initialization")
     if _debug: _log.debug("    - args: %r", args)
 
+    # the engine changes to the library and the compiled codecs of the
+    # property services, before any PDU is made
+    engine.install(codecs=True)
+
     # make a device object
     this_device = LocalDeviceObject(
         objectName=args.ini.objectname,
@@ -319,9 +143,6 @@ def main():
     this_console = ReadPropertyAnyConsoleCmd()
     if _debug: _log.debug("    - this_console: %r", this_console)
 
-    # enable sleeping will help with threads
-    enable_sleeping()
-
     _log.debug("running")
 
     run()
@@ -17,18 +17,21 @@ from bacpypes.debugging import bacpypes_debugging, ModuleLogger
 from bacpypes.consolelogging import ConfigArgumentParser
 from bacpypes.consolecmd import ConsoleCmd
 
-from bacpypes.core import run, enable_sleeping
 from bacpypes.iocb import IOCB
 
 from bacpypes.pdu import Address
 from bacpypes.object import get_datatype, get_object_class
 
 from bacpypes.apdu import ReadPropertyRequest, Error, AbortPDU, ReadPropertyACK
-from bacpypes.primitivedata import Tag
 
 from bacpypes.app import BIPSimpleApplication
 from bacpypes.service.device import LocalDeviceObject
 
+from decode import net
+from decode.settings import dump_settings
+import engine
+from engine.loop import run
+
 
 # some debugging
 _debug = 0
@@ -86,68 +89,11 @@ class ReadPropertyAnyConsoleCmd(ConsoleCmd):
             if iocb.ioResponse:
                 apdu = iocb.ioResponse
 
-				#get tag length
-                value_tag = apdu.propertyValue.tagList.Peek()
-				
-				#context tag
-                if value_tag.tagClass == Tag.openingTagClass:
-					l = apdu.propertyValue.tagList.__len__()
-					IP_NetNumber = 0 
-					context_tag_2 = 0					
-					IP_type = ""  			
-					Foreign_IP = ""  	
-					Foreign_ttl = 0  	
-					Proxy_IP = ""  
-					context_tag_6_7_8 = ""
-					IP_Port = 0  
-					context_tag_10_11_12 = ""
-					context_tag_13 = "" 
-					context_tag_14_17 = "" 
-
- 					value_tag = apdu.propertyValue.tagList.Pop()
-					value_tag = apdu.propertyValue.tagList.Peek()	
-
-					for i in range(1,l-1):
-						if i == 1:
-							IP_NetNumber = int(str(value_tag.tagData).encode('hex'),16)			
-						elif (i == 2):
-							context_tag_2 = str(value_tag.tagData).encode('hex')
-						elif (i <= 3):
-							IP_type = str(value_tag.tagData).encode('hex')
-						elif (i == 4):
-							Foreign_IP = value_tag.tagData
-						elif (i == 5):
-							Foreign_ttl = int(str(value_tag.tagData).encode('hex'),16)
-						elif (i == 6):
-							Proxy_IP = value_tag.tagData
-						elif (i >= 7) and (i <= 9):
-							context_tag_6_7_8 = context_tag_6_7_8 + str(value_tag.tagData).encode('hex')
-						elif (i == 10): 	
-							IP_Port = int(str(value_tag.tagData).encode('hex'),16)
-						elif (i >= 11) and (i <= 13):
-							context_tag_10_11_12 = context_tag_10_11_12 + str(value_tag.tagData).encode('hex')
-						elif (i == 14):					
-							context_tag_13 = str(value_tag.tagData).encode('hex')
-						elif (i >= 15) and (i <= 18):
-							context_tag_14_17 = context_tag_14_17 + str(value_tag.tagData).encode('hex') 
-
-						value_tag = apdu.propertyValue.tagList.Pop()
-						value_tag = apdu.propertyValue.tagList.Peek()
-
-					sys.stdout.write("Bacnet IP Net Number: "+str(IP_NetNumber)+"\n")
-					sys.stdout.write("context_tag_2: "+str(context_tag_2)+"\n")
-					sys.stdout.write("Bacnet IP Type (00=Regular 01=Foreign 02=BBMD): "+str(IP_type)+"\n")
-					sys.stdout.write("Bacnet IP Foreign Address: "+str(Foreign_IP)+"\n")
-					sys.stdout.write("Bacnet IP Foreign time to live: "+str(Foreign_ttl)+"\n")
-					sys.stdout.write("Bacnet IP Proxy Address: "+str(Proxy_IP)+"\n")
-					sys.stdout.write("BACnet IP Port: "+str(IP_Port)+"\n")
-					sys.stdout.write("context_tag_6_7_8: "+str(context_tag_6_7_8)+"\n")
-					sys.stdout.write("context_tag_10_11_12: "+str(context_tag_10_11_12)+"\n")
-					sys.stdout.write("context_tag_13: "+str(context_tag_13)+"\n")
-					sys.stdout.write("context_tag_14_17: "+str(context_tag_14_17)+"\n")
-                else:
-       				pass
+                # decode the BACnet settings in one pass
+                settings = net.dcode(apdu)
+                if _debug: ReadPropertyAnyConsoleCmd._debug("    - settings: %r", settings)
 
+                dump_settings(settings)
                 sys.stdout.flush()
 
             # do something for error/reject/abort
@@ -170,6 +116,10 @@ def main():
     if _debug: _log.debug("initialization")
     if _debug: _log.debug("    - args: %r", args)
 
+    # the engine changes to the library and the compiled codecs of the
+    # property services, before any PDU is made
+    engine.install(codecs=True)
+
     # make a device object
     this_device = LocalDeviceObject(
         objectName=args.ini.objectname,
@@ -194,9 +144,6 @@ def main():
     this_console = ReadPropertyAnyConsoleCmd()
     if _debug: _log.debug("    - this_console: %r", this_console)
 
-    # enable sleeping will help with threads
-    enable_sleeping()
-
     _log.debug("running")
 
     run()
@@ -12,7 +12,7 @@ from bacpypes.debugging import bacpypes_debugging, ModuleLogger
 from bacpypes.consolelogging import ConfigArgumentParser
 #from bacpypes.consolecmd import ConsoleCmd
 
-from bacpypes.core import run, enable_sleeping, stop
+from bacpypes.core import stop, deferred
 from bacpypes.iocb import IOCB
 
 from bacpypes.pdu import Address, GlobalBroadcast
@@ -23,6 +23,10 @@ from bacpypes.errors import DecodingError
 from bacpypes.app import BIPSimpleApplication
 from bacpypes.service.device import LocalDeviceObject
 
+import engine
+from engine.loop import run
+from fleet.discovery import DiscoveryCache
+
 # some debugging
 _debug = 0
 _log = ModuleLogger(globals())
@@ -77,6 +81,10 @@ class WhoIsIAmApplication(BIPSimpleApplication):
             else:
                 # print out the contents
                 dev_ObjID = apdu.iAmDeviceIdentifier
+
+                # remember where it is for next time
+                self.deviceInfoCache.add_device_info(apdu)
+
                 #sys.stdout.write('pduSource = ' + repr(apdu.pduSource) + '\n')
                 #sys.stdout.write('iAmDeviceIdentifier = ' + str(apdu.iAmDeviceIdentifier) + '\n')
                 #sys.stdout.write('maxAPDULengthAccepted = ' + str(apdu.maxAPDULengthAccepted) + '\n')
@@ -186,6 +194,9 @@ def main():
     if _debug: _log.debug("initialization")
     if _debug: _log.debug("    - args: %r", args)
 
+    # the engine changes to the library, before any PDU is made
+    engine.install()
+
     # make a device object
     this_device = LocalDeviceObject(
         objectName=args.ini.objectname,
@@ -206,9 +217,10 @@ def main():
     # set the property value to be just the bits
     this_device.protocolServicesSupported = pss.value
 
-    # make a simple application
+    # make a simple application, devices found by earlier runs are in the
+    # discovery cache
     this_application = WhoIsIAmApplication(
-        this_device, args.ini.address,
+        this_device, args.ini.address, DiscoveryCache(),
         )
     if _debug: _log.debug("    - this_application: %r", this_application)
 
@@ -219,19 +231,23 @@ def main():
     # let the device object know
     this_device.protocolServicesSupported = services_supported.value
 
-    # make a console
-    this_console = WhoIsIAmConsoleCmd().do_whois("1200 1200")
+    # make a console, no Who-Is when the device is in the cache
+    if this_application.deviceInfoCache.lookup(1200):
+        this_console = None
+        deferred(arret, 1200)
+    else:
+        this_console = WhoIsIAmConsoleCmd().do_whois("1200 1200")
 
     
     if _debug: _log.debug("    - this_console: %r", this_console)
 
-    # enable sleeping will help with threads
-    enable_sleeping()
-
     _log.debug("running")
 
     run()
-     
+
+    # keep what was found for next time
+    this_application.deviceInfoCache.flush()
+
     _log.debug("fini")
 
 
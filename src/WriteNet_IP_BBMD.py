@@ -17,16 +17,17 @@ from bacpypes.debugging import bacpypes_debugging, ModuleLogger, xtob
 from bacpypes.consolelogging import ConfigArgumentParser
 from bacpypes.consolecmd import ConsoleCmd
 
-from bacpypes.core import run, enable_sleeping
 from bacpypes.iocb import IOCB
 
 from bacpypes.pdu import Address
 from bacpypes.app import BIPSimpleApplication
 from bacpypes.service.device import LocalDeviceObject
 
-from bacpypes.primitivedata import TagList, OpeningTag, ClosingTag, ContextTag
-from bacpypes.constructeddata import Any
-from bacpypes.apdu import WritePropertyRequest, SimpleAckPDU
+from bacpypes.apdu import SimpleAckPDU
+
+from decode import net
+import engine
+from engine.loop import run
 
 # some debugging
 _debug = 0
@@ -54,50 +55,18 @@ class WriteSomethingConsoleCmd(ConsoleCmd):
             obj_inst = int(obj_inst)
             prop_id = int(prop_id)
 
-            # build a request
-            request = WritePropertyRequest(
-                objectIdentifier=(obj_type, obj_inst),
-                propertyIdentifier=prop_id,
-                )
-            request.pduDestination = Address(addr)
-
-            if len(args) >= 5: 
-                request.propertyArrayIndex = int(args[4])
+            if (obj_type, obj_inst, prop_id) != (net.OBJECT_TYPE, net.OBJECT_INSTANCE, net.PROPERTY_ID):
+                raise ValueError("only the NET BACnet settings can be written")
 
+            values = {}
             if len(args) == 6:
-				#convert ip to byte array and then to hex string
-				proxy = bytearray(args[5])
-				proxy_hex = str(proxy).encode('hex')
-
-            # build a custom datastructure... BACnet settings IP BBMD Foreign port DSC 3.40
-            tag_list = TagList([
-                OpeningTag(1),
-                ContextTag(0, xtob('9ca4')),
-                ContextTag(1, xtob('02')),
-                ContextTag(2, xtob('02')),
-                ContextTag(3, xtob('003030302e3030302e3030302e303030')),
-                ContextTag(4, xtob('3c')),
-                ContextTag(5, xtob("00"+ proxy_hex)),
-                ContextTag(6, xtob('00')), 
-                ContextTag(7, xtob('00')),
-                ContextTag(8, xtob('00')),
-                ContextTag(9, xtob('bac0')),
-                ContextTag(10, xtob('00')), 
-                ContextTag(11, xtob('00')),
-                ContextTag(12, xtob('00')),
-                ContextTag(13, xtob('ffffffff')), 
-                ContextTag(14, xtob('00')),
-                ContextTag(15, xtob('00')),  
-                ContextTag(16, xtob('00')),
-                ContextTag(17, xtob('00')), 
-                ClosingTag(1)
-                ])
-            if _debug: WriteSomethingConsoleCmd._debug("    - tag_list: %r", tag_list)
-
-            # stuff the tag list into an Any
-            request.propertyValue = Any()
-            request.propertyValue.decode(tag_list)
+                values['proxy_ip'] = args[5]
 
+            # build the request from the BACnet settings IP BBMD Foreign port DSC 3.40 template
+            request = net.template_340.request(addr,
+                array_index=int(args[4]) if len(args) >= 5 else None,
+                **values
+                )
             if _debug: WriteSomethingConsoleCmd._debug("    - request: %r", request)
 
             # make an IOCB
@@ -140,6 +109,9 @@ def main():
     if _debug: _log.debug("initialization")
     if _debug: _log.debug("    - args: %r", args)
 
+    # the engine changes to the library, before any PDU is made
+    engine.install()
+
     # make a device object
     this_device = LocalDeviceObject(
         objectName=args.ini.objectname,
@@ -164,9 +136,6 @@ def main():
     this_console = WriteSomethingConsoleCmd()
     if _debug: _log.debug("    - this_console: %r", this_console)
 
-    # enable sleeping will help with threads
-    enable_sleeping()
-
     _log.debug("running")
 
     run()
@@ -0,0 +1,8 @@
+#!/usr/bin/env python
+
+"""
+Decode
+
+Codecs for the proprietary "BACnet settings" property of Delta controllers,
+the BCP object (162) property 1034 and the NET object (278) property 1101.
+"""
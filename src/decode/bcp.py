@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+
+"""
+BCP
+
+BACnet settings of the BCP object (162), property 1034 array index 2, as
+found on eTCH and DCU controllers with firmware 3.40.
+
+    [0] { 0, 1 }            [5] { 0, 1 }
+    1, 2, 3 net number, 4   6, 7
+    [8] { 0 .. 8 }
+    [9] { 0 IP type, 1 port, 2 foreign IP, 3 foreign TTL, 4 proxy IP, 5, 6 }
+    10, 11, 12, 13
+"""
+
+from bacpypes.debugging import bacpypes_debugging, ModuleLogger, xtob
+from bacpypes.primitivedata import TagList, OpeningTag, ClosingTag, ContextTag
+
+from decode.settings import Layout, register_layout, decode_settings, \
+    unsigned, ip_octets
+from decode import template
+
+# some debugging
+_debug = 0
+_log = ModuleLogger(globals())
+
+# object, instance, property and array index
+OBJECT_TYPE = 162
+OBJECT_INSTANCE = 1
+PROPERTY_ID = 1034
+ARRAY_INDEX = 2
+
+#
+#   Layouts
+#
+
+layout_340 = Layout('bcp', '3.40', 0, [
+    ('net_number', (3,), unsigned),
+    ('ip_type', (9, 0), unsigned),
+    ('ip_port', (9, 1), unsigned),
+    ('foreign_ip', (9, 2), ip_octets),
+    ('foreign_ttl', (9, 3), unsigned),
+    ('proxy_ip', (9, 4), ip_octets),
+    ])
+
+register_layout(OBJECT_TYPE, PROPERTY_ID, layout_340)
+
+#
+#   Write templates
+#
+
+# Context #0 inside Opening tag #9 is the IP Type 00=Regular, 01=Foreign, 02=BBMD
+# Context #2 inside Opening tag #9 is the Foreign IP in hex
+# Context #4 inside Opening tag #9 is the Proxy IP in hex
+template_340 = template.WriteTemplate(layout_340,
+    OBJECT_TYPE, OBJECT_INSTANCE, PROPERTY_ID, ARRAY_INDEX,
+    TagList([
+        OpeningTag(0),
+        ContextTag(0, xtob('19')),
+        ContextTag(1, xtob('01')),
+        ClosingTag(0),
+        ContextTag(1, xtob('01')),
+        ContextTag(2, xtob('00')),
+        ContextTag(3, xtob('9e3b')),
+        ContextTag(4, xtob('00')),
+        OpeningTag(5),
+        ContextTag(0, xtob('00')),
+        ContextTag(1, xtob('00')),
+        ClosingTag(5),
+        ContextTag(6, xtob('00')),
+        ContextTag(7, xtob('00')),
+        OpeningTag(8),
+        ContextTag(0, xtob('00')),
+        ContextTag(1, xtob('00')),
+        ContextTag(2, xtob('00')),
+        ContextTag(3, xtob('00')),
+        ContextTag(4, xtob('00')),
+        ContextTag(5, xtob('00')),
+        ContextTag(6, xtob('00')),
+        ContextTag(7, xtob('00')),
+        ContextTag(8, xtob('ffffffff')),
+        ClosingTag(8),
+        OpeningTag(9),
+        ContextTag(0, xtob('02')),
+        ContextTag(1, xtob('bac0')),
+        ContextTag(2, xtob('00')),
+        ContextTag(3, xtob('3c')),
+        ContextTag(4, xtob('60012a08')),
+        ContextTag(5, xtob('00')),
+        ContextTag(6, xtob('ffffffff')),
+        ClosingTag(9),
+        ContextTag(10, xtob('00')),
+        ContextTag(11, xtob('00')),
+        ContextTag(12, xtob('00')),
+        ContextTag(13, xtob('00000000'))
+        ]),
+    {
+    'net_number': template.unsigned,
+    'ip_type': template.unsigned,
+    'ip_port': template.unsigned,
+    'foreign_ip': template.ip_octets,
+    'foreign_ttl': template.unsigned,
+    'proxy_ip': template.ip_octets,
+    })
+
+template.register_template(template_340)
+
+#
+#   dcode
+#
+
+@bacpypes_debugging
+def dcode(apdu, firmware='3.40'):
+    """Decode the ReadPropertyACK of the BCP BACnet settings."""
+    if _debug: dcode._debug("dcode %r %r", apdu, firmware)
+
+    return decode_settings(apdu, firmware)
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+"""
+NET
+
+BACnet settings of the NET object (278), property 1101, array index 5 for a
+DSC and 6 for a DSM-RTR or eBMGR, with firmware 3.40.  The foreign and proxy
+addresses are character strings like 000.000.000.000.
+
+    [1] { 0 net number, 1, 2 IP type, 3 foreign IP, 4 foreign TTL,
+          5 proxy IP, 6, 7, 8, 9 port, 10 .. 17 }
+"""
+
+from bacpypes.debugging import bacpypes_debugging, ModuleLogger, xtob
+from bacpypes.primitivedata import TagList, OpeningTag, ClosingTag, ContextTag
+
+from decode.settings import Layout, register_layout, decode_settings, \
+    unsigned, ip_string
+from decode import template
+
+# some debugging
+_debug = 0
+_log = ModuleLogger(globals())
+
+# object, instance, property and array index
+OBJECT_TYPE = 278
+OBJECT_INSTANCE = 1
+PROPERTY_ID = 1101
+ARRAY_INDEX_DSC = 5
+ARRAY_INDEX_RTR = 6
+
+#
+#   Layouts
+#
+
+layout_340 = Layout('net', '3.40', 1, [
+    ('net_number', (1, 0), unsigned),
+    ('ip_type', (1, 2), unsigned),
+    ('foreign_ip', (1, 3), ip_string),
+    ('foreign_ttl', (1, 4), unsigned),
+    ('proxy_ip', (1, 5), ip_string),
+    ('ip_port', (1, 9), unsigned),
+    ])
+
+register_layout(OBJECT_TYPE, PROPERTY_ID, layout_340)
+
+#
+#   Write templates
+#
+
+# BACnet settings IP BBMD Foreign port DSC 3.40
+template_340 = template.WriteTemplate(layout_340,
+    OBJECT_TYPE, OBJECT_INSTANCE, PROPERTY_ID, ARRAY_INDEX_DSC,
+    TagList([
+        OpeningTag(1),
+        ContextTag(0, xtob('9ca4')),
+        ContextTag(1, xtob('02')),
+        ContextTag(2, xtob('02')),
+        ContextTag(3, xtob('003030302e3030302e3030302e303030')),
+        ContextTag(4, xtob('3c')),
+        ContextTag(5, xtob('003030302e3030302e3030302e303030')),
+        ContextTag(6, xtob('00')),
+        ContextTag(7, xtob('00')),
+        ContextTag(8, xtob('00')),
+        ContextTag(9, xtob('bac0')),
+        ContextTag(10, xtob('00')),
+        ContextTag(11, xtob('00')),
+        ContextTag(12, xtob('00')),
+        ContextTag(13, xtob('ffffffff')),
+        ContextTag(14, xtob('00')),
+        ContextTag(15, xtob('00')),
+        ContextTag(16, xtob('00')),
+        ContextTag(17, xtob('00')),
+        ClosingTag(1)
+        ]),
+    {
+    'net_number': template.unsigned,
+    'ip_type': template.unsigned,
+    'foreign_ip': template.ip_string,
+    'foreign_ttl': template.unsigned,
+    'proxy_ip': template.ip_string,
+    'ip_port': template.unsigned,
+    })
+
+template.register_template(template_340)
+
+#
+#   dcode
+#
+
+@bacpypes_debugging
+def dcode(apdu, firmware='3.40'):
+    """Decode the ReadPropertyACK of the NET BACnet settings."""
+    if _debug: dcode._debug("dcode %r %r", apdu, firmware)
+
+    return decode_settings(apdu, firmware)
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+
+"""
+Settings
+
+A layout describes where the interesting fields live in the nested context
+tags of a BACnet settings property.  Each field is identified by its path,
+the context numbers of the opening tags that enclose it followed by its own
+context number.  A layout is compiled once into a dictionary keyed by path
+and a response is decoded in a single forward pass over its tags, no tags
+are popped and the tag data is converted directly from the octets.
+"""
+
+import sys
+import struct
+from collections import namedtuple
+
+from bacpypes.debugging import bacpypes_debugging, ModuleLogger
+from bacpypes.errors import DecodingError
+from bacpypes.primitivedata import Tag
+
+# some debugging
+_debug = 0
+_log = ModuleLogger(globals())
+
+# globals
+_layouts = {}
+
+#
+#   BACnetSettings
+#
+
+BACnetSettings = namedtuple('BACnetSettings',
+    [ 'kind', 'firmware'
+    , 'net_number', 'ip_type', 'ip_port'
+    , 'foreign_ip', 'foreign_ttl', 'proxy_ip'
+    , 'tags'
+    ])
+
+#
+#   Field conversions
+#
+
+_unsigned_formats = {1: '>B', 2: '>H', 4: '>L'}
+
+def unsigned(data):
+    """Octets of an unsigned value, most significant first."""
+    fmt = _unsigned_formats.get(len(data))
+    if fmt:
+        return struct.unpack(fmt, data)[0]
+
+    value = 0
+    for c in bytearray(data):
+        value = (value << 8) + c
+    return value
+
+def ip_octets(data):
+    """Four octets of an IPv4 address, anything else is no address."""
+    if len(data) != 4:
+        return "0.0.0.0"
+    return "%d.%d.%d.%d" % struct.unpack('BBBB', data)
+
+def ip_string(data):
+    """Character string with an ANSI encoding octet and a dotted address
+    that may be padded with zeros, like 000.000.000.000."""
+    if data[:1] == b'\x00':
+        data = data[1:]
+    data = data.decode('ascii', 'replace').strip()
+
+    parts = data.split('.')
+    if (len(parts) == 4) and all(part.isdigit() for part in parts):
+        return "%d.%d.%d.%d" % tuple(int(part) for part in parts)
+    return data
+
+#
+#   Layout
+#
+
+@bacpypes_debugging
+class Layout(object):
+
+    def __init__(self, kind, firmware, root, fields):
+        """Compile a layout, the root is the context number of the opening
+        tag expected first and fields is a sequence of (name, path, fn)."""
+        if _debug: Layout._debug("__init__ %r %r %r ...", kind, firmware, root)
+
+        self.kind = kind
+        self.firmware = firmware
+        self.root = root
+
+        # path to (name, conversion function)
+        self.fields = {}
+        for name, path, fn in fields:
+            if name not in BACnetSettings._fields:
+                raise ValueError("unknown field: %r" % (name,))
+            self.fields[tuple(path)] = (name, fn)
+
+    def decode(self, taglist):
+        """Decode the tags into a BACnetSettings record."""
+        if _debug: Layout._debug("decode %r", taglist)
+
+        tags = taglist.tagList
+        if (not tags) or (tags[0].tagClass != Tag.openingTagClass) or (tags[0].tagNumber != self.root):
+            raise DecodingError("%s settings must start with opening tag %d" % (self.kind, self.root))
+
+        fields = self.fields
+        values = {}
+
+        # the stack is a tuple of the enclosing opening tag numbers
+        stack = ()
+        for tag in tags:
+            tag_class = tag.tagClass
+            if tag_class == Tag.contextTagClass:
+                field = fields.get(stack + (tag.tagNumber,))
+                if field:
+                    name, fn = field
+                    values[name] = fn(tag.tagData)
+            elif tag_class == Tag.openingTagClass:
+                stack += (tag.tagNumber,)
+            elif tag_class == Tag.closingTagClass:
+                if (not stack) or (stack[-1] != tag.tagNumber):
+                    raise DecodingError("mismatched closing tag %d" % (tag.tagNumber,))
+                stack = stack[:-1]
+            else:
+                raise DecodingError("unexpected application tag")
+
+        if stack:
+            raise DecodingError("missing closing tag %d" % (stack[-1],))
+
+        return BACnetSettings(
+            self.kind, self.firmware,
+            values.get('net_number'), values.get('ip_type'), values.get('ip_port'),
+            values.get('foreign_ip'), values.get('foreign_ttl'), values.get('proxy_ip'),
+            tags,
+            )
+
+#
+#   register_layout
+#
+
+def register_layout(obj_type, prop_id, layout):
+    """Make a layout available for an object type and property."""
+    _layouts[(obj_type, prop_id, layout.firmware)] = layout
+
+#
+#   get_layout
+#
+
+def get_layout(obj_type, prop_id, firmware):
+    """Return the layout for an object type, property and firmware."""
+    layout = _layouts.get((obj_type, prop_id, firmware))
+    if not layout:
+        raise DecodingError("no layout for %r %r firmware %r" % (obj_type, prop_id, firmware))
+    return layout
+
+#
+#   decode_settings
+#
+
+@bacpypes_debugging
+def decode_settings(apdu, firmware):
+    """Decode the BACnet settings from a ReadPropertyACK."""
+    if _debug: decode_settings._debug("decode_settings %r %r", apdu, firmware)
+
+    layout = get_layout(apdu.objectIdentifier[0], apdu.propertyIdentifier, firmware)
+    return layout.decode(apdu.propertyValue.tagList)
+
+#
+#   dump_settings
+#
+
+def dump_settings(settings, file=sys.stdout):
+    """Write out the interesting fields of a BACnetSettings record."""
+    file.write("Bacnet IP Net Number: %s\n" % (settings.net_number,))
+    file.write("Bacnet IP Type (00=Regular 01=Foreign 02=BBMD): %02d\n" % (settings.ip_type or 0,))
+    file.write("BACnet IP Port: %s\n" % (settings.ip_port,))
+    file.write("Bacnet IP Foreign Address: %s\n" % (settings.foreign_ip,))
+    file.write("Bacnet IP Foreign time to live: %s\n" % (settings.foreign_ttl,))
+    file.write("Bacnet IP Proxy Address: %s\n" % (settings.proxy_ip,))
@@ -0,0 +1,382 @@
+#!/usr/bin/env python
+
+"""
+Template
+
+A write template is the tag list of a BACnet settings property, as the
+write tools have always built it, encoded once.  The fields that change from
+one device to the next are slots identified by the same paths as the decoding
+layout.  Writing a device is a copy of the encoded buffer with the slot
+octets patched in place, the rest of the request is never encoded again.
+When a value does not have the same length as the template default the
+encoded pieces around the slots are joined with new tag headers instead.
+
+Every other tag of a template is a default, which is what the blind write
+tools have always written.  A tool that has read the settings of the device
+first uses modify() instead, the tags that were read are written back with
+only the changed fields replaced, and the result is decoded again and
+checked against the settings that were read before it is sent.
+"""
+
+import struct
+
+from bacpypes.debugging import bacpypes_debugging, ModuleLogger
+from bacpypes.pdu import Address
+from bacpypes.primitivedata import Tag, TagList, ContextTag
+from bacpypes.constructeddata import Any
+from bacpypes.apdu import APDU, WritePropertyRequest
+
+# some debugging
+_debug = 0
+_log = ModuleLogger(globals())
+
+# globals
+_templates = {}
+
+#
+#   Field encoders
+#
+
+def unsigned(value):
+    """Shortest octets of an unsigned value, most significant first."""
+    value = int(value)
+    if value < 0:
+        raise ValueError("unsigned value required")
+
+    data = bytearray()
+    while True:
+        data.insert(0, value & 0xFF)
+        value >>= 8
+        if not value:
+            break
+    return bytes(data)
+
+def ip_octets(value):
+    """Four octets of a dotted IPv4 address."""
+    parts = [int(part) for part in value.split('.')]
+    if (len(parts) != 4) or not all(0 <= part <= 255 for part in parts):
+        raise ValueError("invalid IPv4 address: %r" % (value,))
+    return struct.pack('BBBB', *parts)
+
+def ip_string(value):
+    """Character string with an ANSI encoding octet."""
+    return b'\x00' + value.encode('ascii')
+
+#
+#   TemplateWriteRequest
+#
+
+@bacpypes_debugging
+class TemplateWriteRequest(WritePropertyRequest):
+
+    """A WritePropertyRequest with service parameters that are already
+    encoded, only the header is filled in when it is sent."""
+
+    def __init__(self, service_data, *args, **kwargs):
+        if _debug: TemplateWriteRequest._debug("__init__ ... %r %r", args, kwargs)
+        super(TemplateWriteRequest, self).__init__(*args, **kwargs)
+
+        self.serviceData = service_data
+
+    def encode(self, apdu):
+        if _debug: TemplateWriteRequest._debug("encode %r", apdu)
+
+        # copy the header fields
+        apdu.update(self)
+
+        # the rest is ready to go
+        apdu.put_data(self.serviceData)
+
+#
+#   WriteTemplate
+#
+
+@bacpypes_debugging
+class WriteTemplate(object):
+
+    def __init__(self, layout, obj_type, obj_inst, prop_id, array_index, tag_list, fields):
+        """Compile a template from a tag list of default values, fields is a
+        dictionary of field name to encoder and the field paths come from the
+        decoding layout."""
+        if _debug: WriteTemplate._debug("__init__ %r %r %r %r %r ...", layout, obj_type, obj_inst, prop_id, array_index)
+
+        self.layout = layout
+        self.objectType = obj_type
+        self.objectInstance = obj_inst
+        self.propertyIdentifier = prop_id
+        self.arrayIndex = array_index
+        self.tagList = tag_list
+        self.encoders = fields
+
+        # field names by path
+        names = dict((path, name) for path, (name, fn) in layout.fields.items() if name in fields)
+        if len(names) != len(fields):
+            raise ValueError("fields missing from the %s layout" % (layout.kind,))
+
+        # encode the tags, noting where the slots are
+        chunks = []
+        slots = []
+        chunk = bytearray()
+        stack = ()
+        for tag in tag_list.tagList:
+            if tag.tagClass == Tag.openingTagClass:
+                stack += (tag.tagNumber,)
+            elif tag.tagClass == Tag.closingTagClass:
+                stack = stack[:-1]
+            elif tag.tagClass == Tag.contextTagClass:
+                name = names.get(stack + (tag.tagNumber,))
+                if name:
+                    chunks.append(bytes(chunk))
+                    slots.append((name, tag.tagNumber, tag.tagData))
+                    chunk = bytearray()
+                    continue
+            chunk.extend(_encode_tags([tag]))
+        chunks.append(bytes(chunk))
+
+        if len(slots) != len(fields):
+            raise ValueError("fields missing from the tag list")
+
+        self.chunks = chunks
+        self.slots = slots
+
+        # the default encoding and where the slot data lives in it
+        self.buffer = bytearray()
+        self.offsets = {}
+        for chunk, (name, tag_number, data) in zip(chunks, slots):
+            self.buffer.extend(chunk)
+            self.buffer.extend(_context_header(tag_number, len(data)))
+            self.offsets[name] = (len(self.buffer), len(data))
+            self.buffer.extend(data)
+        self.buffer.extend(chunks[-1])
+
+        # service parameters before and after the value, by array index
+        self._wrappers = {}
+
+        # the compiled encoding must match the tag list
+        self.verify()
+
+    def encode_value(self, **values):
+        """Return the encoded value with the given fields patched."""
+        if _debug: WriteTemplate._debug("encode_value %r", values)
+
+        patches = []
+        for name, value in values.items():
+            if name not in self.encoders:
+                raise ValueError("not a template field: %r" % (name,))
+            patches.append((name, self.encoders[name](value)))
+
+        # patch in place when everything fits
+        offsets = self.offsets
+        for name, data in patches:
+            if len(data) != offsets[name][1]:
+                break
+        else:
+            buffer = bytearray(self.buffer)
+            for name, data in patches:
+                offset, length = offsets[name]
+                buffer[offset:offset + length] = data
+            return bytes(buffer)
+
+        # join the pieces with new headers
+        patches = dict(patches)
+        parts = [self.chunks[0]]
+        for (name, tag_number, data), chunk in zip(self.slots, self.chunks[1:]):
+            data = patches.get(name, data)
+            parts.append(_context_header(tag_number, len(data)))
+            parts.append(data)
+            parts.append(chunk)
+        return b''.join(parts)
+
+    def request(self, address, array_index=None, **values):
+        """Return a request for the device at address."""
+        if _debug: WriteTemplate._debug("request %r %r %r", address, array_index, values)
+
+        if array_index is None:
+            array_index = self.arrayIndex
+        if not isinstance(address, Address):
+            address = Address(address)
+
+        prefix, suffix = self._wrapper(array_index)
+
+        request = TemplateWriteRequest(
+            prefix + self.encode_value(**values) + suffix,
+            objectIdentifier=(self.objectType, self.objectInstance),
+            propertyIdentifier=self.propertyIdentifier,
+            )
+        request.propertyArrayIndex = array_index
+        request.pduDestination = address
+
+        return request
+
+    def modify(self, address, tags, array_index=None, **values):
+        """Return a request for the device at address that writes back the
+        tags read from it with only the given fields changed."""
+        if _debug: WriteTemplate._debug("modify %r %r %r", address, array_index, values)
+
+        if array_index is None:
+            array_index = self.arrayIndex
+        if not isinstance(address, Address):
+            address = Address(address)
+
+        prefix, suffix = self._wrapper(array_index)
+
+        request = TemplateWriteRequest(
+            prefix + _encode_tags(self.modify_tags(tags, **values)) + suffix,
+            objectIdentifier=(self.objectType, self.objectInstance),
+            propertyIdentifier=self.propertyIdentifier,
+            )
+        request.propertyArrayIndex = array_index
+        request.pduDestination = address
+
+        return request
+
+    def modify_tags(self, tags, **values):
+        """Return a copy of the tags read from a device with the given
+        fields changed, every other tag is the one that was read."""
+        if _debug: WriteTemplate._debug("modify_tags %r", values)
+
+        patches = {}
+        for name, value in values.items():
+            if name not in self.encoders:
+                raise ValueError("not a template field: %r" % (name,))
+            patches[name] = self.encoders[name](value)
+
+        modified = []
+        patched = set()
+        stack = ()
+        for tag in tags:
+            if tag.tagClass == Tag.openingTagClass:
+                stack += (tag.tagNumber,)
+            elif tag.tagClass == Tag.closingTagClass:
+                stack = stack[:-1]
+            elif tag.tagClass == Tag.contextTagClass:
+                name = self.layout.fields.get(stack + (tag.tagNumber,), (None, None))[0]
+                if name in patches:
+                    tag = ContextTag(tag.tagNumber, patches[name])
+                    patched.add(name)
+            modified.append(tag)
+
+        if len(patched) != len(patches):
+            raise ValueError("fields missing from the tags read: %s" % (', '.join(sorted(set(patches) - patched)),))
+
+        # what goes out must be what was read with the changes
+        self.verify_modified(tags, modified, patches)
+
+        return modified
+
+    def verify_modified(self, tags, modified, patches):
+        """Check the modified tags decode to the settings that were read,
+        except for the patched fields that decode to their new values."""
+        if _debug: WriteTemplate._debug("verify_modified %r", patches)
+
+        expected = self.layout.decode(TagList(list(tags)))._asdict()
+        for path, (name, fn) in self.layout.fields.items():
+            if name in patches:
+                expected[name] = fn(patches[name])
+        actual = self.layout.decode(TagList(list(modified)))._asdict()
+
+        del expected['tags'], actual['tags']
+        if actual != expected:
+            raise RuntimeError("%s read-modify-write changes more than %s" % (self.layout.kind, ', '.join(sorted(patches))))
+
+    def tag_list(self, **values):
+        """Return the tag list the write tools would have built."""
+        tags = []
+        stack = ()
+        for tag in self.tagList.tagList:
+            if tag.tagClass == Tag.openingTagClass:
+                stack += (tag.tagNumber,)
+            elif tag.tagClass == Tag.closingTagClass:
+                stack = stack[:-1]
+            elif tag.tagClass == Tag.contextTagClass:
+                path = stack + (tag.tagNumber,)
+                name = self.layout.fields.get(path, (None, None))[0]
+                if name in values:
+                    tag = ContextTag(tag.tagNumber, self.encoders[name](values[name]))
+            tags.append(tag)
+
+        return TagList(tags)
+
+    def verify(self, array_index=None, **values):
+        """Check the template request is byte for byte the same as the one
+        built from a tag list stuffed into an Any."""
+        if _debug: WriteTemplate._debug("verify %r %r", array_index, values)
+
+        if array_index is None:
+            array_index = self.arrayIndex
+
+        request = WritePropertyRequest(
+            objectIdentifier=(self.objectType, self.objectInstance),
+            propertyIdentifier=self.propertyIdentifier,
+            )
+        request.propertyArrayIndex = array_index
+        request.propertyValue = Any()
+        request.propertyValue.decode(self.tag_list(**values))
+
+        expected = APDU()
+        request.encode(expected)
+
+        actual = APDU()
+        self.request(Address(0), array_index, **values).encode(actual)
+
+        if actual.pduData != expected.pduData:
+            raise RuntimeError("%s template does not match the tag list" % (self.layout.kind,))
+
+    def _wrapper(self, array_index):
+        wrapper = self._wrappers.get(array_index)
+        if not wrapper:
+            # encode the request with an empty value, it ends with the
+            # opening and closing tags of the value
+            request = WritePropertyRequest(
+                objectIdentifier=(self.objectType, self.objectInstance),
+                propertyIdentifier=self.propertyIdentifier,
+                )
+            request.propertyArrayIndex = array_index
+            request.propertyValue = Any()
+
+            apdu = APDU()
+            request.encode(apdu)
+
+            data = bytes(apdu.pduData)
+            wrapper = self._wrappers[array_index] = (data[:-1], data[-1:])
+
+        return wrapper
+
+#
+#   register_template
+#
+
+def register_template(template):
+    """Make a template available for its object type and property."""
+    _templates[(template.objectType, template.propertyIdentifier, template.layout.firmware)] = template
+
+#
+#   get_template
+#
+
+def get_template(obj_type, prop_id, firmware):
+    """Return the template for an object type, property and firmware."""
+    template = _templates.get((obj_type, prop_id, firmware))
+    if not template:
+        raise ValueError("no template for %r %r firmware %r" % (obj_type, prop_id, firmware))
+    return template
+
+#
+#   Helper functions
+#
+
+_headers = {}
+
+def _encode_tags(tags):
+    apdu = APDU()
+    TagList(tags).encode(apdu)
+    return bytes(apdu.pduData)
+
+def _context_header(tag_number, length):
+    """Return the encoded header of a context tag, the data is not
+    included."""
+    header = _headers.get((tag_number, length))
+    if header is None:
+        header = _encode_tags([ContextTag(tag_number, b'\x00' * length)])[:-length or None]
+        _headers[(tag_number, length)] = header
+    return header
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+
+"""
+Engine
+
+Replacements for the parts of the bacpypes core that do not keep up when one
+process talks to thousands of controllers: the event loop, the task manager,
+the timers, the request queues of the devices and the transaction tables.
+
+Importing the engine changes nothing in the library.  install() puts in the
+compact classes of engine.compact and the cursors of engine.pdudata and
+engine.taglist, which change classes of the bacpypes core for the whole
+process, so it is up to the application to call it at the start of main(),
+before any PDU or tag list is made:
+
+    import engine
+    engine.install()
+
+The compiled codecs of engine.codec are a second copy of the encoding of the
+services the tools use the most, they are only installed when they are asked
+for with engine.install(codecs=True), which the tools that read and write
+properties do.  Each class only gets its codec when a sample of it encodes
+and decodes the same as with the library.
+"""
+
+from bacpypes.debugging import ModuleLogger
+
+from engine import compact, pdudata, taglist, codec
+
+# some debugging
+_debug = 0
+_log = ModuleLogger(globals())
+
+# the modules that change the library, in the order they are installed
+_modules = (compact, pdudata, taglist)
+
+#
+#   install
+#
+
+def install(codecs=False):
+    """Install the changes to the library, before any PDU is made, and the
+    compiled codecs when they are asked for."""
+    if _debug: _log.debug("install codecs=%r", codecs)
+
+    for module in _modules:
+        module.install()
+    if codecs:
+        codec.install()
+
+#
+#   uninstall
+#
+
+def uninstall():
+    """Put back the library, the objects made in between cannot be used
+    after this, it is for measuring."""
+    if _debug: _log.debug("uninstall")
+
+    codec.uninstall()
+    for module in reversed(_modules):
+        module.uninstall()
+
+#
+#   installed
+#
+
+def installed():
+    """Return True when the changes are installed, with or without the
+    codecs."""
+    return all(module.installed() for module in _modules)
@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+
+"""
+Application
+
+The ApplicationIOController has a SieveQueue for each device, so there is
+only one request in flight to a device at a time and nothing in between to
+say how long the others waited.  The WindowedIOController keeps a
+DeviceWindow for each device instead, a FIFO of the requests waiting and the
+requests in flight by invoke ID, up to the size of the window.  Delta field
+controllers with small buffers answer Abort/Busy when too much is pipelined,
+so the window size can be set for each class of device:
+
+    class MyApplication(WindowedIOController, BIPSimpleApplication):
+        ...
+
+    app = MyApplication(localDevice, localAddress, window=4, windows={480: 1})
+
+By default the class of a device is the maximum APDU length it accepts, when
+the device information cache knows it.  The depth of the queue and the time
+the requests waited are kept for each device.  The window of a device is
+dropped when it has nothing waiting and nothing in flight, so a sweep of a
+large fleet does not leave a window behind for every device, only its
+counters are kept until the device is talked to again.
+"""
+
+import sys
+
+from time import time as _time
+from collections import deque
+
+from bacpypes.debugging import bacpypes_debugging, ModuleLogger, DebugContents
+from bacpypes.core import deferred
+from bacpypes.iocb import PENDING
+
+from bacpypes.apdu import ConfirmedRequestPDU, SimpleAckPDU, ComplexAckPDU, \
+    ErrorPDU, RejectPDU, AbortPDU
+from bacpypes.app import ApplicationIOController
+
+# some debugging
+_debug = 0
+_log = ModuleLogger(globals())
+
+#
+#   DeviceWindow
+#
+
+class DeviceWindow(DebugContents):
+
+    """The requests waiting for a device and those in flight, by invoke ID,
+    None for an unconfirmed request."""
+
+    _debug_contents = ('address', 'deviceClass', 'size', 'active', 'maxDepth', 'requests')
+
+    def __init__(self, address, device_class, size):
+        self.address = address
+        self.deviceClass = device_class
+        self.size = size
+
+        # a FIFO of (when, iocb) and the requests in flight
+        self.queue = deque()
+        self.active = {}
+
+        # the deepest the queue has been, the number of requests sent and
+        # how long they waited
+        self.maxDepth = 0
+        self.requests = 0
+        self.waited = 0.0
+        self.maxWaited = 0.0
+
+    def idle(self):
+        return not self.queue and not self.active
+
+    def counters(self):
+        """Return what is kept of the window when it is dropped."""
+        return (self.deviceClass, self.size, self.maxDepth, self.requests,
+            self.waited, self.maxWaited)
+
+    def restore(self, counters):
+        """Pick up the counters of the window that was dropped."""
+        self.deviceClass, self.size, self.maxDepth, self.requests, \
+            self.waited, self.maxWaited = counters
+
+    def metrics(self):
+        """Return the depth of the queue and the time the requests waited,
+        in seconds."""
+        return {
+            'deviceClass': self.deviceClass,
+            'window': self.size,
+            'active': len(self.active),
+            'depth': len(self.queue),
+            'maxDepth': self.maxDepth,
+            'requests': self.requests,
+            'meanWait': (self.waited / self.requests) if self.requests else 0.0,
+            'maxWait': self.maxWaited,
+            }
+
+#
+#   parse_windows
+#
+
+def parse_windows(values):
+    """Turn LENGTH=SIZE strings from the command line into the windows of
+    the classes of devices, by maximum APDU length."""
+    windows = {}
+    for value in values or ():
+        try:
+            length, size = value.split('=')
+            windows[int(length)] = int(size)
+        except ValueError:
+            raise ValueError("window must be LENGTH=SIZE: %r" % (value,))
+
+    return windows
+
+#
+#   WindowedIOController
+#
+
+@bacpypes_debugging
+class WindowedIOController(ApplicationIOController):
+
+    def __init__(self, *args, **kwargs):
+        """The window is the number of requests in flight to a device, the
+        windows override it for classes of devices."""
+        window = kwargs.pop('window', 1)
+        windows = kwargs.pop('windows', None) or {}
+        if _debug: WindowedIOController._debug("__init__ window=%r windows=%r", window, windows)
+
+        if (window < 1) or any(size < 1 for size in windows.values()):
+            raise ValueError("windows must be at least one")
+
+        super(WindowedIOController, self).__init__(*args, **kwargs)
+
+        self.window = window
+        self.windows = dict(windows)
+
+        # a window for each address with work, and the counters of the
+        # windows that have been dropped
+        self.window_by_address = {}
+        self.idle_windows = {}
+
+    def device_class(self, address):
+        """Return the class of a device for the size of its window, by
+        default the maximum APDU length it accepts, None when it is not
+        known."""
+        info = self.deviceInfoCache.cache.get(address)
+        if info is None:
+            return None
+
+        return info.maxApduLengthAccepted
+
+    def window_metrics(self):
+        """Return the metrics of the window of each device, by address."""
+        metrics = {}
+        for address, counters in self.idle_windows.items():
+            window = DeviceWindow(address, None, None)
+            window.restore(counters)
+            metrics[str(address)] = window.metrics()
+        for address, window in self.window_by_address.items():
+            metrics[str(address)] = window.metrics()
+
+        return metrics
+
+    def _drop(self, window):
+        """Drop the window of a device that has nothing to do, keep its
+        counters."""
+        if _debug: WindowedIOController._debug("_drop %r", window)
+
+        if self.window_by_address.get(window.address) is window:
+            del self.window_by_address[window.address]
+            self.idle_windows[window.address] = window.counters()
+
+    def process_io(self, iocb):
+        if _debug: WindowedIOController._debug("process_io %r", iocb)
+
+        # get the destination address from the pdu
+        destination_address = iocb.args[0].pduDestination
+        if _debug: WindowedIOController._debug("    - destination_address: %r", destination_address)
+
+        # look up the window, the class of the device may have changed
+        # since it was last idle
+        window = self.window_by_address.get(destination_address)
+        if (window is None) or window.idle():
+            device_class = self.device_class(destination_address)
+            size = self.windows.get(device_class, self.window)
+
+            if window is None:
+                window = DeviceWindow(destination_address, device_class, size)
+                counters = self.idle_windows.pop(destination_address, None)
+                if counters:
+                    window.restore(counters)
+                    window.deviceClass = device_class
+                    window.size = size
+                self.window_by_address[destination_address] = window
+            else:
+                window.deviceClass = device_class
+                window.size = size
+        if _debug: WindowedIOController._debug("    - window: %r", window)
+
+        # add it to the end of the queue
+        window.queue.append((_time(), iocb))
+        if len(window.queue) > window.maxDepth:
+            window.maxDepth = len(window.queue)
+
+        self._fill(window)
+
+    def _fill(self, window):
+        """Send the requests at the front of the queue while there is room
+        in the window."""
+        if _debug: WindowedIOController._debug("_fill %r", window)
+
+        while window.queue and (len(window.active) < window.size):
+            when, iocb = window.queue.popleft()
+
+            # aborted while it was waiting
+            if iocb.ioState != PENDING:
+                continue
+
+            delay = _time() - when
+            window.requests += 1
+            window.waited += delay
+            if delay > window.maxWaited:
+                window.maxWaited = delay
+
+            try:
+                # hopefully there won't be an error
+                err = None
+
+                self._send(window, iocb)
+            except:
+                # extract the error
+                err = sys.exc_info()[1]
+
+            # if there was an error, abort the request
+            if err:
+                for invokeID, active_iocb in window.active.items():
+                    if active_iocb is iocb:
+                        del window.active[invokeID]
+                self.abort_io(iocb, err)
+
+        # the requests may all have been aborted
+        if window.idle():
+            self._drop(window)
+
+    def _send(self, window, iocb):
+        if _debug: WindowedIOController._debug("_send %r %r", window, iocb)
+
+        apdu = iocb.args[0]
+
+        # the confirmation is matched to the request by its invoke ID
+        if isinstance(apdu, ConfirmedRequestPDU):
+            if apdu.apduInvokeID is None:
+                apdu.apduInvokeID = self.smap.get_next_invoke_id(window.address)
+            invokeID = apdu.apduInvokeID
+        else:
+            invokeID = None
+
+        # this is now an active request
+        self.active_io(iocb)
+        window.active[invokeID] = iocb
+
+        # send it downstream, an unconfirmed request is complete right away
+        self.request(apdu)
+
+    def _app_complete(self, address, apdu):
+        if _debug: WindowedIOController._debug("_app_complete %r %r", address, apdu)
+
+        # look up the window
+        window = self.window_by_address.get(address)
+        if not window:
+            WindowedIOController._debug("no window for %r" % (address,))
+            return
+        if _debug: WindowedIOController._debug("    - window: %r", window)
+
+        # find the request in flight
+        invokeID = None if apdu is None else apdu.apduInvokeID
+        iocb = window.active.pop(invokeID, None)
+        if not iocb:
+            WindowedIOController._debug("no active request for %r %r" % (address, invokeID))
+            return
+
+        # this request is complete
+        if (apdu is None) or isinstance(apdu, (SimpleAckPDU, ComplexAckPDU)):
+            self.complete_io(iocb, apdu)
+        elif isinstance(apdu, (ErrorPDU, RejectPDU, AbortPDU)):
+            self.abort_io(iocb, apdu)
+        else:
+            raise RuntimeError("unrecognized APDU type")
+        if _debug: WindowedIOController._debug("    - controller finished")
+
+        # send the next ones outside of the callback chain
+        if window.queue:
+            deferred(self._fill, window)
+        elif window.idle():
+            self._drop(window)
@@ -0,0 +1,446 @@
+#!/usr/bin/env python
+
+"""
+Application Service
+
+The StateMachineAccessPoint keeps the segmentation state machines in lists,
+finding a free invoke ID checks every client transaction for each candidate
+and every acknowledgement is matched by going through the list, so talking
+to a few hundred devices at once costs the square of the number of them.
+
+The IndexedStateMachineAccessPoint keeps the transactions in a
+TransactionTable, a dictionary by address and invoke ID that also counts the
+transactions of each device, so finding a free invoke ID and matching an
+acknowledgement take the same time however many there are.  The state
+machines are the bacpypes ones, they take themselves out of the table when
+they are done like they did from the list.
+
+The state machines it makes are BufferedClientSSM and BufferedServerSSM.
+The SSM sends each segment with a copy of its part of the APDU and adds each
+segment it receives to the end of the APDU being put back together.  The
+buffered ones slice a memoryview of the encoded APDU and write the segments
+into a bytearray that grows a window of segments at a time, the APDU gets
+its data once, when the last segment is in.
+
+The applications of the tools put it in their stack when they are made:
+
+    from engine.appservice import index_transactions
+    index_transactions(self)
+"""
+
+from copy import copy
+
+from bacpypes.debugging import bacpypes_debugging, ModuleLogger
+from bacpypes.comm import bind
+
+from bacpypes.pdu import Address
+from bacpypes.apdu import apdu_types, ConfirmedRequestPDU, \
+    UnconfirmedRequestPDU, SimpleAckPDU, ComplexAckPDU, ErrorPDU, \
+    RejectPDU, SegmentAckPDU, AbortPDU
+from bacpypes.appservice import StateMachineAccessPoint, ClientSSM, ServerSSM
+
+from engine import pdudata
+
+# some debugging
+_debug = 0
+_log = ModuleLogger(globals())
+
+# invoke ID's are one octet
+INVOKE_IDS = 256
+
+#
+#   TransactionTable
+#
+
+class TransactionTable:
+
+    """Takes the place of a list of transactions, they are indexed by the
+    address of the remote device and the invoke ID.  The key is kept in the
+    transaction when it is added, the address of a device can change while
+    a transaction is going on (a router is found, the device moves) and it
+    has to come out of the table under the key it went in with."""
+
+    def __init__(self):
+        self.transactions = {}
+        self.peers = {}
+
+    def __len__(self):
+        return len(self.transactions)
+
+    def __iter__(self):
+        return iter(list(self.transactions.values()))
+
+    def __contains__(self, tr):
+        key = getattr(tr, 'transactionKey', None)
+        return (key is not None) and (self.transactions.get(key) is tr)
+
+    def append(self, tr):
+        # a copy, the address of the device may be changed in place
+        key = (copy(tr.remoteDevice.address), tr.invokeID)
+        if key in self.transactions:
+            raise RuntimeError("invoke ID in use")
+
+        self.transactions[key] = tr
+        self.peers[key[0]] = self.peers.get(key[0], 0) + 1
+        tr.transactionKey = key
+
+    def remove(self, tr):
+        key = getattr(tr, 'transactionKey', None)
+        if (key is None) or (self.transactions.get(key) is not tr):
+            raise ValueError("transaction not in the table")
+
+        del self.transactions[key]
+        tr.transactionKey = None
+        count = self.peers[key[0]] - 1
+        if count:
+            self.peers[key[0]] = count
+        else:
+            del self.peers[key[0]]
+
+    def get(self, address, invokeID):
+        """Return the transaction with the device, None if there is none."""
+        return self.transactions.get((address, invokeID))
+
+    def peer_count(self, address):
+        """Return the number of transactions with the device."""
+        return self.peers.get(address, 0)
+
+#
+#   BufferedSSM
+#
+
+@bacpypes_debugging
+class BufferedSSM(object):
+
+    """Segments are slices of a memoryview of the APDU being sent, and the
+    segments received are written into a bytearray.  It goes before the
+    ClientSSM or ServerSSM, they do not call the __init__ of the classes
+    that follow."""
+
+    # the APDU being sent, and the one being put back together with the
+    # number of octets in it
+    segmentView = None
+    segmentBuffer = None
+    segmentLength = 0
+
+    def set_segmentation_context(self, apdu):
+        """This function is called to set the segmentation context."""
+        if _debug: BufferedSSM._debug("set_segmentation_context %r", apdu)
+
+        # set the context
+        self.segmentAPDU = apdu
+        self.segmentView = None
+        self.segmentBuffer = None
+        self.segmentLength = 0
+
+    def get_segment(self, indx):
+        """This function returns an APDU coorisponding to a particular
+        segment of a confirmed request or complex ack.  The segmentAPDU
+        is the context."""
+        if _debug: BufferedSSM._debug("get_segment %r", indx)
+
+        # check for no context
+        if not self.segmentAPDU:
+            raise RuntimeError("no segmentation context established")
+
+        # check for invalid segment number
+        if indx >= self.segmentCount:
+            raise RuntimeError("invalid segment number {0}, APDU has {1} segments".format(indx, self.segmentCount))
+
+        if self.segmentAPDU.apduType == ConfirmedRequestPDU.pduType:
+            if _debug: BufferedSSM._debug("    - confirmed request context")
+
+            segAPDU = ConfirmedRequestPDU(self.segmentAPDU.apduService)
+
+            segAPDU.apduMaxSegs = self.maxSegmentsAccepted
+            segAPDU.apduMaxResp = self.ssmSAP.maxApduLengthAccepted
+            segAPDU.apduInvokeID = self.invokeID
+
+            # segmented response accepted?
+            segAPDU.apduSA = self.ssmSAP.segmentationSupported in ('segmentedReceive', 'segmentedBoth')
+            if _debug: BufferedSSM._debug("    - segmented response accepted: %r", segAPDU.apduSA)
+
+        elif self.segmentAPDU.apduType == ComplexAckPDU.pduType:
+            if _debug: BufferedSSM._debug("    - complex ack context")
+
+            segAPDU = ComplexAckPDU(self.segmentAPDU.apduService, self.segmentAPDU.apduInvokeID)
+        else:
+            raise RuntimeError("invalid APDU type for segmentation context")
+
+        # maintain the the user data reference
+        segAPDU.pduUserData = self.segmentAPDU.pduUserData
+
+        # make sure the destination is set
+        segAPDU.pduDestination = self.remoteDevice.address
+
+        # segmented message?
+        if (self.segmentCount != 1):
+            segAPDU.apduSeg = True
+            segAPDU.apduMor = (indx < (self.segmentCount - 1)) # more follows
+            segAPDU.apduSeq = indx % 256                       # sequence number
+            segAPDU.apduWin = self.proposedWindowSize          # window size
+        else:
+            segAPDU.apduSeg = False
+            segAPDU.apduMor = False
+
+        # the octets of the APDU are not copied for each segment
+        if self.segmentView is None:
+            self.segmentView = memoryview(self.segmentAPDU.pduData)
+
+        # add the content, the PDUData of the bacpypes core only adds strings
+        offset = indx * self.segmentSize
+        segment = self.segmentView[offset:offset + self.segmentSize]
+        if not pdudata.installed():
+            segment = segment.tobytes()
+        segAPDU.put_data(segment)
+
+        # success
+        return segAPDU
+
+    def append_segment(self, apdu):
+        """This function writes the apdu content after the segments that
+        have been received.  The segmentAPDU is the context."""
+        if _debug: BufferedSSM._debug("append_segment %r", apdu)
+
+        # check for no context
+        if not self.segmentAPDU:
+            raise RuntimeError("no segmentation context established")
+
+        data = apdu.pduData
+        size = len(data)
+        window = max(1, self.actualWindowSize)
+
+        # the first segment is the context, the buffer has room for a
+        # window of segments after it and grows by a window at a time
+        if self.segmentBuffer is None:
+            first = self.segmentAPDU.pduData
+            self.segmentLength = len(first)
+            self.segmentBuffer = bytearray(self.segmentLength * (window + 1))
+            self.segmentBuffer[:self.segmentLength] = first
+
+        start = self.segmentLength
+        end = start + size
+        if end > len(self.segmentBuffer):
+            self.segmentBuffer.extend(bytearray(size * window))
+
+        self.segmentBuffer[start:end] = data
+        self.segmentLength = end
+
+        # the last one, the APDU is put back together
+        if not apdu.apduMor:
+            self.segmentAPDU.pduData = str(buffer(self.segmentBuffer, 0, end))
+            self.segmentBuffer = None
+
+#
+#   BufferedClientSSM
+#
+
+class BufferedClientSSM(BufferedSSM, ClientSSM):
+
+    """A client segmentation state machine with the buffers of a
+    BufferedSSM."""
+
+#
+#   BufferedServerSSM
+#
+
+class BufferedServerSSM(BufferedSSM, ServerSSM):
+
+    """A server segmentation state machine with the buffers of a
+    BufferedSSM."""
+
+#
+#   IndexedStateMachineAccessPoint
+#
+
+@bacpypes_debugging
+class IndexedStateMachineAccessPoint(StateMachineAccessPoint):
+
+    def __init__(self, localDevice=None, deviceInfoCache=None, sap=None, cid=None):
+        if _debug: IndexedStateMachineAccessPoint._debug("__init__ localDevice=%r deviceInfoCache=%r sap=%r cid=%r", localDevice, deviceInfoCache, sap, cid)
+        StateMachineAccessPoint.__init__(self, localDevice, deviceInfoCache, sap, cid)
+
+        self.clientTransactions = TransactionTable()
+        self.serverTransactions = TransactionTable()
+
+    def get_next_invoke_id(self, addr):
+        """Called by clients to get an unused invoke ID."""
+        if _debug: IndexedStateMachineAccessPoint._debug("get_next_invoke_id")
+
+        # every one is in use
+        if self.clientTransactions.peer_count(addr) >= INVOKE_IDS:
+            raise RuntimeError("no available invoke ID")
+
+        while True:
+            invokeID = self.nextInvokeID
+            self.nextInvokeID = (self.nextInvokeID + 1) % INVOKE_IDS
+
+            if self.clientTransactions.get(addr, invokeID) is None:
+                return invokeID
+
+    def confirmation(self, pdu):
+        """Packets coming up the stack are APDU's."""
+        if _debug: IndexedStateMachineAccessPoint._debug("confirmation %r", pdu)
+
+        # check device communication control
+        if self.dccEnableDisable == 'disable':
+            if (pdu.apduType == 0) and (pdu.apduService == 17):
+                if _debug: IndexedStateMachineAccessPoint._debug("    - continue with DCC request")
+            elif (pdu.apduType == 0) and (pdu.apduService == 20):
+                if _debug: IndexedStateMachineAccessPoint._debug("    - continue with reinitialize device")
+            elif (pdu.apduType == 1) and (pdu.apduService == 8):
+                if _debug: IndexedStateMachineAccessPoint._debug("    - continue with Who-Is")
+            else:
+                if _debug: IndexedStateMachineAccessPoint._debug("    - not a Who-Is, dropped")
+                return
+
+        # make a more focused interpretation
+        atype = apdu_types.get(pdu.apduType)
+        if not atype:
+            IndexedStateMachineAccessPoint._warning("    - unknown apduType: %r", pdu.apduType)
+            return
+
+        # decode it
+        apdu = atype()
+        apdu.decode(pdu)
+        if _debug: IndexedStateMachineAccessPoint._debug("    - apdu: %r", apdu)
+
+        if isinstance(apdu, ConfirmedRequestPDU):
+            # find duplicates of this request
+            tr = self.serverTransactions.get(apdu.pduSource, apdu.apduInvokeID)
+            if tr is None:
+                # find the remote device information
+                remoteDevice = self.deviceInfoCache.get_device_info(apdu.pduSource)
+
+                # build a server transaction, it is indexed by its invoke ID
+                tr = BufferedServerSSM(self, remoteDevice)
+                tr.invokeID = apdu.apduInvokeID
+
+                # add it to our transactions to track it
+                self.serverTransactions.append(tr)
+
+            # let it run with the apdu
+            tr.indication(apdu)
+
+        elif isinstance(apdu, UnconfirmedRequestPDU):
+            # deliver directly to the application
+            self.sap_request(apdu)
+
+        elif isinstance(apdu, (SimpleAckPDU, ComplexAckPDU, ErrorPDU, RejectPDU)):
+            # find the client transaction this is acking
+            tr = self.clientTransactions.get(apdu.pduSource, apdu.apduInvokeID)
+            if tr is None:
+                return
+
+            # send the packet on to the transaction
+            tr.confirmation(apdu)
+
+        elif isinstance(apdu, (AbortPDU, SegmentAckPDU)):
+            # find the transaction, sent by the server or the client
+            if apdu.apduSrv:
+                tr = self.clientTransactions.get(apdu.pduSource, apdu.apduInvokeID)
+                if tr is None:
+                    return
+
+                # send the packet on to the transaction
+                tr.confirmation(apdu)
+            else:
+                tr = self.serverTransactions.get(apdu.pduSource, apdu.apduInvokeID)
+                if tr is None:
+                    return
+
+                # send the packet on to the transaction
+                tr.indication(apdu)
+
+        else:
+            raise RuntimeError("invalid APDU (8)")
+
+    def sap_indication(self, apdu):
+        """This function is called when the application is requesting
+        a new transaction as a client."""
+        if _debug: IndexedStateMachineAccessPoint._debug("sap_indication %r", apdu)
+
+        # check device communication control
+        if self.dccEnableDisable == 'disable':
+            if _debug: IndexedStateMachineAccessPoint._debug("    - communications disabled")
+            return
+
+        elif self.dccEnableDisable == 'disableInitiation':
+            if _debug: IndexedStateMachineAccessPoint._debug("    - initiation disabled")
+
+            if (apdu.apduType == 1) and (apdu.apduService == 0):
+                if _debug: IndexedStateMachineAccessPoint._debug("    - continue with I-Am")
+            else:
+                if _debug: IndexedStateMachineAccessPoint._debug("    - not an I-Am")
+                return
+
+        if isinstance(apdu, UnconfirmedRequestPDU):
+            # deliver to the device
+            self.request(apdu)
+
+        elif isinstance(apdu, ConfirmedRequestPDU):
+            # make sure it has an invoke ID
+            if apdu.apduInvokeID is None:
+                apdu.apduInvokeID = self.get_next_invoke_id(apdu.pduDestination)
+            else:
+                # verify the invoke ID isn't already being used
+                if self.clientTransactions.get(apdu.pduDestination, apdu.apduInvokeID) is not None:
+                    raise RuntimeError("invoke ID in use")
+
+            # warning for bogus requests
+            if (apdu.pduDestination.addrType != Address.localStationAddr) and (apdu.pduDestination.addrType != Address.remoteStationAddr):
+                IndexedStateMachineAccessPoint._warning("%s is not a local or remote station", apdu.pduDestination)
+
+            # find the remote device information
+            remoteDevice = self.deviceInfoCache.get_device_info(apdu.pduDestination)
+            if _debug: IndexedStateMachineAccessPoint._debug("    - remoteDevice: %r", remoteDevice)
+
+            # create a client transaction state machine, it is indexed by
+            # its invoke ID
+            tr = BufferedClientSSM(self, remoteDevice)
+            tr.invokeID = apdu.apduInvokeID
+            if _debug: IndexedStateMachineAccessPoint._debug("    - client segmentation state machine: %r", tr)
+
+            # add it to our transactions to track it
+            self.clientTransactions.append(tr)
+
+            # let it run
+            tr.indication(apdu)
+
+        else:
+            raise RuntimeError("invalid APDU (9)")
+
+    def sap_confirmation(self, apdu):
+        """This function is called when the application is responding
+        to a request, the apdu may be a simple ack, complex ack, error, reject or abort."""
+        if _debug: IndexedStateMachineAccessPoint._debug("sap_confirmation %r", apdu)
+
+        if isinstance(apdu, (SimpleAckPDU, ComplexAckPDU, ErrorPDU, RejectPDU, AbortPDU)):
+            # find the appropriate server transaction
+            tr = self.serverTransactions.get(apdu.pduDestination, apdu.apduInvokeID)
+            if tr is None:
+                return
+
+            # pass control to the transaction
+            tr.confirmation(apdu)
+
+        else:
+            raise RuntimeError("invalid APDU (10)")
+
+#
+#   index_transactions
+#
+
+def index_transactions(app):
+    """Put an IndexedStateMachineAccessPoint in the stack of an application
+    in place of its StateMachineAccessPoint, before anything is sent."""
+    if _debug: _log.debug("index_transactions %r", app)
+
+    smap = IndexedStateMachineAccessPoint(app.localDevice)
+    smap.deviceInfoCache = app.deviceInfoCache
+
+    # between the application service access point and the network
+    bind(app.asap, smap, app.nsap)
+    app.smap = smap
+
+    return smap
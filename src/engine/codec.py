@@ -0,0 +1,800 @@
+#!/usr/bin/env python
+
+"""
+Codec
+
+Sequence.encode() and Sequence.decode() go through the sequenceElements of
+the class every time, checking whether each element is a SequenceOf, an
+atomic value, an AnyAtomic or a structure with isinstance() and
+issubclass(), and Choice.decode() tries each of its choices in turn until
+one matches the tag.  The answers are the same every time for a class.
+
+The codecs are only for the classes the tools encode and decode the most,
+the ReadProperty, ReadPropertyMultiple and WriteProperty requests and ACK's
+and the sequences in them, listed in CLASSES.  install() compiles a
+SequenceCodec or a ChoiceCodec for each of them and gives the class an
+encode() and a decode() of its own that use it, every other class of the
+library is left alone.  A compiled codec has one function to encode and one
+to decode each element, made for the kind of element with its name, class,
+context and tag numbers, and a ChoiceCodec finds the choice by the class and
+number of the tag in a dictionary.  A subclass that has elements of its own
+goes back to the functions of the library, and so does a class with an
+element there is no compiled function for (an AnyAtomic, an optional
+structure without a context, a choice that is not a structure with one).
+
+Most of the time goes to the tags and the atomic values rather than the
+elements, so the codecs also skip the objects that are thrown away: an
+element with a context is encoded in a tag that is turned into the context
+tag rather than copied into a new one, decoded from an application tag made
+without the constructors, and the atomic values of the bacpypes classes are
+decoded without their constructors.  The octets and the values are the same
+as the ones of the bacpypes functions, the codec flow of DeltaBenchmark.py
+compares them.
+
+The codecs are a second copy of the encoding of these classes, so install()
+checks them first: a sample of each class from samples() is encoded and
+decoded with the functions of the library and with the codec, and a class
+only gets its codec when the octets, the value and the octets of the value
+encoded again are the same.  A class that does not is left to the library
+with a warning.  The tools that read and write properties install them with
+engine.install(codecs=True), after the cursors of engine.pdudata and
+engine.taglist.  uninstall() puts back the functions that were there.
+"""
+
+from bacpypes.debugging import ModuleLogger
+from bacpypes.errors import MissingRequiredParameter, InvalidParameterDatatype, \
+    InvalidTag, TooManyArguments
+from bacpypes.pdu import PDU
+from bacpypes.primitivedata import Atomic, Enumerated, Tag, ApplicationTag, \
+    TagList, OpeningTag, ClosingTag, Real, CharacterString, expand_enumerations
+from bacpypes.constructeddata import Sequence, Choice, AnyAtomic, Any, \
+    _sequence_of_classes
+from bacpypes.basetypes import PropertyReference, PropertyValue, ErrorType
+from bacpypes.apdu import APDU, APCISequence, ConfirmedRequestPDU, apdu_types, \
+    ReadPropertyRequest, ReadPropertyACK, \
+    ReadPropertyMultipleRequest, ReadPropertyMultipleACK, WritePropertyRequest, \
+    ReadAccessSpecification, ReadAccessResult, ReadAccessResultElement, \
+    ReadAccessResultElementChoice
+
+# some debugging
+_debug = 0
+_log = ModuleLogger(globals())
+
+# tag classes
+_application = Tag.applicationTagClass
+_context = Tag.contextTagClass
+_opening = Tag.openingTagClass
+_closing = Tag.closingTagClass
+
+# the classes that are compiled, the services and the sequences and choices
+# they are made of
+CLASSES = (
+    ReadPropertyRequest, ReadPropertyACK,
+    ReadPropertyMultipleRequest, ReadPropertyMultipleACK,
+    WritePropertyRequest,
+    ReadAccessSpecification, PropertyReference,
+    ReadAccessResult, ReadAccessResultElement, ReadAccessResultElementChoice,
+    PropertyValue,
+    )
+
+# the codec of each class, compiled once
+_codecs = {}
+
+# the functions of the classes that are replaced, and what they were, None
+# when the class inherits them
+_original = None
+
+#
+#   tags and atomic values
+#
+
+def _to_context(tag, context):
+    """Turn the application tag an element was just encoded in into its
+    context tag, like app_to_context() without a new one."""
+    if tag.tagClass != _application:
+        raise ValueError("application tag required")
+
+    # application tagged boolean now has data
+    if tag.tagNumber == Tag.booleanAppTag:
+        tag.tagData = bytes(bytearray([tag.tagLVT]))
+
+    tag.tagClass = _context
+    tag.tagNumber = context
+    tag.tagLVT = len(tag.tagData)
+
+def _to_application(tag, app_tag):
+    """Return the application tag of a context tag, like context_to_app()
+    without going through the constructors."""
+    # context booleans have value in data
+    if app_tag == Tag.booleanAppTag:
+        return tag.context_to_app(app_tag)
+
+    app = ApplicationTag.__new__(ApplicationTag)
+    app.tagClass = _application
+    app.tagNumber = app_tag
+    app.tagLVT = len(tag.tagData)
+    app.tagData = tag.tagData
+
+    return app
+
+def _atomic_value(klass):
+    """Return a function that decodes the value of an atomic class from a
+    tag.  The constructors of the bacpypes classes only call decode() when
+    they are given a tag, so the instance is made without them, a class with
+    a constructor of its own is built with it."""
+    init = getattr(klass.__init__, '__func__', None)
+    if (init is None) or (init.__module__ != Atomic.__module__):
+        return lambda tag: klass(tag).value
+
+    # the constructor of an enumeration makes its translation table
+    if issubclass(klass, Enumerated) and ('_xlate_table' not in klass.__dict__):
+        expand_enumerations(klass)
+
+    new = klass.__new__
+    decode = klass.decode
+
+    def value(tag):
+        helper = new(klass)
+        decode(helper, tag)
+        return helper.value
+
+    return value
+
+#
+#   element kinds
+#
+
+def _kind(element):
+    """Return what the encoder and decoder of an element are made for, None
+    when there are none and the class is left to the library."""
+    if element.klass in _sequence_of_classes:
+        return 'sequenceOf'
+    elif issubclass(element.klass, Atomic):
+        return 'atomic'
+    elif issubclass(element.klass, AnyAtomic):
+        return None
+    elif (element.context is None) and element.optional:
+        # bacpypes puts the tags back when it does not decode
+        return None
+    else:
+        return 'structure'
+
+def _choice_kind(element):
+    """The choices that are compiled are structures with a context."""
+    if (_kind(element) != 'structure') or (element.context is None):
+        return None
+
+    return 'structure'
+
+#
+#   sequence element encoders
+#
+
+def _missing(self, name):
+    raise MissingRequiredParameter("%s is a missing required element of %s" % (name, self.__class__.__name__))
+
+def _sequence_of_encoder(element):
+    name = element.name
+    klass = element.klass
+    context = element.context
+    optional = element.optional
+
+    def encode(self, taglist):
+        value = getattr(self, name, None)
+        if value is None:
+            if not optional:
+                _missing(self, name)
+            return
+
+        if context is not None:
+            taglist.append(OpeningTag(context))
+        klass(value).encode(taglist)
+        if context is not None:
+            taglist.append(ClosingTag(context))
+
+    return encode
+
+def _atomic_encoder(element):
+    name = element.name
+    klass = element.klass
+    context = element.context
+    optional = element.optional
+
+    def encode(self, taglist):
+        value = getattr(self, name, None)
+        if value is None:
+            if not optional:
+                _missing(self, name)
+            return
+
+        tag = Tag()
+        klass(value).encode(tag)
+        if context is not None:
+            _to_context(tag, context)
+        taglist.append(tag)
+
+    return encode
+
+def _structure_encoder(element):
+    name = element.name
+    klass = element.klass
+    context = element.context
+    optional = element.optional
+
+    def encode(self, taglist):
+        value = getattr(self, name, None)
+        if value is None:
+            if not optional:
+                _missing(self, name)
+            return
+
+        if not isinstance(value, klass):
+            raise TypeError("%s must be of type %s" % (name, klass.__name__))
+
+        if context is not None:
+            taglist.append(OpeningTag(context))
+        value.encode(taglist)
+        if context is not None:
+            taglist.append(ClosingTag(context))
+
+    return encode
+
+_sequence_encoders = {
+    'sequenceOf': _sequence_of_encoder,
+    'atomic': _atomic_encoder,
+    'structure': _structure_encoder,
+    }
+
+#
+#   sequence element decoders
+#
+
+def _omitted(self, element, tag):
+    """There is no tag left or the sequence is closed, the element is None
+    if it is optional."""
+    if tag is None:
+        if element.optional:
+            setattr(self, element.name, None)
+        elif element.klass in _sequence_of_classes:
+            setattr(self, element.name, [])
+        else:
+            _missing(self, element.name)
+    else:
+        if not element.optional:
+            _missing(self, element.name)
+        setattr(self, element.name, None)
+
+def _sequence_of_decoder(element):
+    name = element.name
+    klass = element.klass
+    context = element.context
+    optional = element.optional
+
+    def decode(self, taglist):
+        tag = taglist.Peek()
+        if (tag is None) or (tag.tagClass == _closing):
+            _omitted(self, element, tag)
+            return
+
+        if context is not None:
+            if tag.tagClass != _opening or tag.tagNumber != context:
+                if not optional:
+                    raise MissingRequiredParameter("%s expected opening tag %d" % (name, context))
+                setattr(self, name, [])
+                return
+            taglist.Pop()
+
+        helper = klass()
+        helper.decode(taglist)
+        setattr(self, name, helper.value)
+
+        if context is not None:
+            tag = taglist.Pop()
+            if tag.tagClass != _closing or tag.tagNumber != context:
+                raise InvalidTag("%s expected closing tag %d" % (name, context))
+
+    return decode
+
+def _atomic_decoder(element):
+    name = element.name
+    klass = element.klass
+    context = element.context
+    optional = element.optional
+    app_tag = klass._app_tag
+    atomic_value = _atomic_value(klass)
+
+    def decode(self, taglist):
+        tag = taglist.Peek()
+        if (tag is None) or (tag.tagClass == _closing):
+            _omitted(self, element, tag)
+            return
+
+        if context is not None:
+            if tag.tagClass != _context or tag.tagNumber != context:
+                if not optional:
+                    raise InvalidTag("%s expected context tag %d" % (name, context))
+                setattr(self, name, None)
+                return
+            tag = _to_application(tag, app_tag)
+        else:
+            if tag.tagClass != _application or tag.tagNumber != app_tag:
+                if not optional:
+                    raise InvalidParameterDatatype("%s expected application tag %s" % (name, Tag._app_tag_name[app_tag]))
+                setattr(self, name, None)
+                return
+
+        taglist.Pop()
+        setattr(self, name, atomic_value(tag))
+
+    return decode
+
+def _structure_decoder(element):
+    name = element.name
+    klass = element.klass
+    context = element.context
+    optional = element.optional
+
+    def decode(self, taglist):
+        tag = taglist.Peek()
+        if (tag is None) or (tag.tagClass == _closing):
+            _omitted(self, element, tag)
+            return
+
+        if context is not None:
+            if tag.tagClass != _opening or tag.tagNumber != context:
+                if not optional:
+                    raise InvalidTag("%s expected opening tag %d" % (name, context))
+                setattr(self, name, None)
+                return
+            taglist.Pop()
+
+        value = klass()
+        value.decode(taglist)
+        setattr(self, name, value)
+
+        if context is not None:
+            tag = taglist.Pop()
+            if (not tag) or tag.tagClass != _closing or tag.tagNumber != context:
+                raise InvalidTag("%s expected closing tag %d" % (name, context))
+
+    return decode
+
+_sequence_decoders = {
+    'sequenceOf': _sequence_of_decoder,
+    'atomic': _atomic_decoder,
+    'structure': _structure_decoder,
+    }
+
+#
+#   SequenceCodec
+#
+
+class SequenceCodec:
+
+    """The encoders and decoders of the elements of a Sequence class."""
+
+    def __init__(self, cls):
+        if _debug: _log.debug("SequenceCodec %r", cls)
+
+        self.cls = cls
+        self.encoders = [_sequence_encoders[_kind(element)](element) for element in cls.sequenceElements]
+        self.decoders = [_sequence_decoders[_kind(element)](element) for element in cls.sequenceElements]
+
+    def encode(self, value, taglist):
+        if not isinstance(taglist, TagList):
+            raise TypeError("TagList expected")
+
+        for encoder in self.encoders:
+            encoder(value, taglist)
+
+    def decode(self, value, taglist):
+        if not isinstance(taglist, TagList):
+            raise TypeError("TagList expected")
+
+        for decoder in self.decoders:
+            decoder(value, taglist)
+
+#
+#   choice element decoders
+#
+
+def _choice_decoder(element):
+    """Return the class and number of the tag of a choice and a function
+    that decodes it, the tag is the one at the front of the list."""
+    name = element.name
+    klass = element.klass
+    context = element.context
+
+    def decode(taglist):
+        taglist.Pop()
+
+        value = klass()
+        value.decode(taglist)
+
+        tag = taglist.Pop()
+        if (not tag) or tag.tagClass != _closing or tag.tagNumber != context:
+            raise InvalidTag("%s expected closing tag %d" % (name, context))
+
+        return value
+
+    return (_opening, context), decode
+
+#
+#   ChoiceCodec
+#
+
+class ChoiceCodec:
+
+    """The choices of a Choice class by the class and number of their tag,
+    and the elements to encode."""
+
+    def __init__(self, cls):
+        if _debug: _log.debug("ChoiceCodec %r", cls)
+
+        self.cls = cls
+        self.names = [element.name for element in cls.choiceElements]
+        self.elements = [(element.name, element.klass, element.context)
+            for element in cls.choiceElements]
+
+        # the first choice that matches a tag is the one
+        self.choices = {}
+        for element in cls.choiceElements:
+            key, decoder = _choice_decoder(element)
+            self.choices.setdefault(key, (element.name, decoder))
+
+    def encode(self, value, taglist):
+        for name, klass, context in self.elements:
+            element_value = getattr(value, name, None)
+            if element_value is None:
+                continue
+            if not isinstance(element_value, klass):
+                raise TypeError("%s must be a %s" % (name, klass.__name__))
+
+            taglist.append(OpeningTag(context))
+            element_value.encode(taglist)
+            taglist.append(ClosingTag(context))
+            return
+
+        raise AttributeError("missing choice of %s" % (value.__class__.__name__,))
+
+    def decode(self, value, taglist):
+        tag = taglist.Peek()
+        if (tag is None) or (tag.tagClass == _closing):
+            raise AttributeError("missing choice of %s" % (value.__class__.__name__,))
+
+        choice = self.choices.get((tag.tagClass, tag.tagNumber))
+        if choice is None:
+            raise AttributeError("missing choice of %s" % (value.__class__.__name__,))
+        name, decoder = choice
+
+        element_value = decoder(taglist)
+
+        # the value of the choice and None everywhere else
+        for element_name in self.names:
+            setattr(value, element_name, None)
+        setattr(value, name, element_value)
+
+#
+#   compile
+#
+
+def _compile(cls):
+    """Return the codec of a class, compile it the first time, None when an
+    element cannot be compiled."""
+    if cls in _codecs:
+        return _codecs[cls]
+
+    if issubclass(cls, Choice):
+        if None in [_choice_kind(element) for element in cls.choiceElements]:
+            codec = None
+        else:
+            codec = ChoiceCodec(cls)
+    else:
+        if None in [_kind(element) for element in cls.sequenceElements]:
+            codec = None
+        else:
+            codec = SequenceCodec(cls)
+    _codecs[cls] = codec
+
+    return codec
+
+#
+#   class functions
+#
+
+def _sequence_functions(cls, codec):
+    """The encode() and decode() of a Sequence class, a subclass with other
+    elements uses the ones of Sequence."""
+    elements = cls.sequenceElements
+
+    def encode(self, taglist):
+        if self.sequenceElements is not elements:
+            return Sequence.encode(self, taglist)
+        codec.encode(self, taglist)
+
+    def decode(self, taglist):
+        if self.sequenceElements is not elements:
+            return Sequence.decode(self, taglist)
+        codec.decode(self, taglist)
+
+    return encode, decode
+
+def _apci_functions(cls, codec):
+    """The encode() and decode() of a service, like the ones of
+    APCISequence, which call the ones of Sequence rather than the ones of
+    the class."""
+    elements = cls.sequenceElements
+
+    def encode(self, apdu):
+        if self.sequenceElements is not elements:
+            return APCISequence.encode(self, apdu)
+
+        # copy the header fields
+        apdu.update(self)
+
+        self._tag_list = TagList()
+        codec.encode(self, self._tag_list)
+        self._tag_list.encode(apdu)
+
+    def decode(self, apdu):
+        if self.sequenceElements is not elements:
+            return APCISequence.decode(self, apdu)
+
+        # copy the header fields
+        self.update(apdu)
+
+        self._tag_list = TagList()
+        self._tag_list.decode(apdu)
+        codec.decode(self, self._tag_list)
+
+        # trailing unmatched tags
+        if self._tag_list:
+            raise TooManyArguments()
+
+    return encode, decode
+
+def _choice_functions(cls, codec):
+    """The encode() and decode() of a Choice class, a subclass with other
+    choices uses the ones of Choice."""
+    elements = cls.choiceElements
+
+    def encode(self, taglist):
+        if self.choiceElements is not elements:
+            return Choice.encode(self, taglist)
+        codec.encode(self, taglist)
+
+    def decode(self, taglist):
+        if self.choiceElements is not elements:
+            return Choice.decode(self, taglist)
+        codec.decode(self, taglist)
+
+    return encode, decode
+
+def _functions(cls):
+    codec = _compile(cls)
+    if codec is None:
+        return None
+    elif issubclass(cls, Choice):
+        return _choice_functions(cls, codec)
+    elif issubclass(cls, APCISequence):
+        return _apci_functions(cls, codec)
+    else:
+        return _sequence_functions(cls, codec)
+
+def _set_functions(cls, functions):
+    """Give a class an encode() and a decode(), None takes them out so the
+    class inherits them again."""
+    for name, function in zip(('encode', 'decode'), functions):
+        if function is None:
+            if name in cls.__dict__:
+                delattr(cls, name)
+        else:
+            setattr(cls, name, function)
+
+#
+#   samples
+#
+
+def samples():
+    """Return a value of each class in CLASSES by class, with the optional
+    elements and the choices the tools see."""
+    references = [
+        PropertyReference(propertyIdentifier='presentValue'),
+        PropertyReference(propertyIdentifier='priorityArray', propertyArrayIndex=8),
+        ]
+    specification = ReadAccessSpecification(
+        objectIdentifier=('analogValue', 1),
+        listOfPropertyReferences=references,
+        )
+
+    # a value and an error, the two choices of a result
+    value_choice = ReadAccessResultElementChoice(
+        propertyValue=Any(Real(21.5)),
+        )
+    error_choice = ReadAccessResultElementChoice(
+        propertyAccessError=ErrorType(errorClass='property', errorCode='unknownProperty'),
+        )
+    element = ReadAccessResultElement(
+        propertyIdentifier='objectName',
+        readResult=ReadAccessResultElementChoice(propertyValue=Any(CharacterString('AV1'))),
+        )
+    result = ReadAccessResult(
+        objectIdentifier=('analogValue', 1),
+        listOfResults=[
+            element,
+            ReadAccessResultElement(propertyIdentifier='presentValue', readResult=value_choice),
+            ReadAccessResultElement(propertyIdentifier='description', propertyArrayIndex=3,
+                readResult=error_choice),
+            ],
+        )
+    property_value = PropertyValue(
+        propertyIdentifier='presentValue',
+        value=Any(Real(21.5)),
+        priority=8,
+        )
+
+    values = {
+        PropertyReference: references[1],
+        PropertyValue: property_value,
+        ReadAccessSpecification: specification,
+        ReadAccessResult: result,
+        ReadAccessResultElement: element,
+        ReadAccessResultElementChoice: error_choice,
+        ReadPropertyRequest: ReadPropertyRequest(
+            objectIdentifier=('analogValue', 1),
+            propertyIdentifier='presentValue',
+            ),
+        ReadPropertyACK: ReadPropertyACK(
+            objectIdentifier=('analogValue', 1),
+            propertyIdentifier='priorityArray',
+            propertyArrayIndex=8,
+            propertyValue=Any(Real(21.5)),
+            ),
+        ReadPropertyMultipleRequest: ReadPropertyMultipleRequest(
+            listOfReadAccessSpecs=[specification],
+            ),
+        ReadPropertyMultipleACK: ReadPropertyMultipleACK(
+            listOfReadAccessResults=[result],
+            ),
+        WritePropertyRequest: WritePropertyRequest(
+            objectIdentifier=('analogValue', 1),
+            propertyIdentifier='presentValue',
+            propertyValue=Any(Real(21.5)),
+            priority=16,
+            ),
+        }
+
+    # the header fields of the services
+    for value in values.values():
+        if isinstance(value, APCISequence):
+            value.apduInvokeID = 1
+            if isinstance(value, ConfirmedRequestPDU):
+                value.apduMaxResp = 1476
+
+    return values
+
+#
+#   check
+#
+
+def _encode(value):
+    """Return the octets of a value, the APDU of a service or the tags of
+    a sequence or a choice."""
+    pdu = PDU()
+    if isinstance(value, APCISequence):
+        apdu = APDU()
+        value.encode(apdu)
+        apdu.encode(pdu)
+    else:
+        tags = TagList()
+        value.encode(tags)
+        tags.encode(pdu)
+
+    return str(pdu.pduData)
+
+def _decode(cls, octets):
+    """Return a value of the class decoded from its octets."""
+    if issubclass(cls, APCISequence):
+        apdu = APDU()
+        apdu.decode(PDU(octets))
+
+        source = apdu_types[apdu.apduType]()
+        source.decode(apdu)
+    else:
+        source = TagList()
+        source.decode(PDU(octets))
+
+    value = cls()
+    value.decode(source)
+
+    return value
+
+def check(cls, value, functions):
+    """Encode and decode the value with the functions of the library and
+    with the compiled ones, return None when the octets, the value and the
+    octets of the value encoded again are the same, otherwise what is not.
+    The classes of the elements are encoded by the library."""
+    if _debug: _log.debug("check %r", cls)
+
+    library_octets = _encode(value)
+    library_value = _decode(cls, library_octets)
+
+    original = (cls.__dict__.get('encode'), cls.__dict__.get('decode'))
+    _set_functions(cls, functions)
+    try:
+        octets = _encode(value)
+        compiled_value = _decode(cls, octets)
+    finally:
+        _set_functions(cls, original)
+
+    if octets != library_octets:
+        return "encoded %r, the library %r" % (octets, library_octets)
+    if compiled_value.dict_contents() != library_value.dict_contents():
+        return "decoded %r, the library %r" % (compiled_value.dict_contents(), library_value.dict_contents())
+    if _encode(compiled_value) != library_octets:
+        return "the value decoded encodes to other octets"
+
+    return None
+
+#
+#   install
+#
+
+def install():
+    """Encode and decode the classes in CLASSES with compiled codecs, those
+    that encode and decode their sample like the library."""
+    global _original
+    if _debug: _log.debug("install")
+
+    if _original is not None:
+        return
+
+    # compile and check them all before any is changed
+    values = samples()
+    functions = {}
+    for cls in CLASSES:
+        class_functions = _functions(cls)
+        if class_functions is None:
+            if _debug: _log.debug("    - not compiled: %r", cls)
+            continue
+
+        try:
+            error = check(cls, values[cls], class_functions)
+        except Exception as err:
+            error = "%s: %s" % (err.__class__.__name__, err)
+        if error:
+            _log.warning("%s is left to the library, %s", cls.__name__, error)
+            continue
+
+        functions[cls] = class_functions
+
+    _original = {}
+    for cls in CLASSES:
+        if cls in functions:
+            _original[cls] = (cls.__dict__.get('encode'), cls.__dict__.get('decode'))
+            _set_functions(cls, functions[cls])
+
+#
+#   uninstall
+#
+
+def uninstall():
+    """Put back the functions that were there, the codecs are kept for the
+    next install(), it is for measuring."""
+    global _original
+    if _debug: _log.debug("uninstall")
+
+    if _original is None:
+        return
+
+    for cls, functions in _original.items():
+        _set_functions(cls, functions)
+    _original = None
+
+#
+#   installed
+#
+
+def installed():
+    """Return True when the codecs are used."""
+    return _original is not None
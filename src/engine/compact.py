@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+
+"""
+Compact
+
+Every Tag, atomic value and PDU header of the bacpypes core keeps its
+attributes in a dictionary of its own, a few hundred bytes for a handful of
+numbers, and a gateway that keeps the values it read, with their tags and
+the APDU's they came in, pays that for each one of them.
+
+install() gives Tag, Atomic and PCI a __new__() that makes an instance of a
+subclass with __slots__ for the attributes the class sets: the class,
+number, length and data of a tag, the value of an atomic value and the
+encoding of a character string, the fields of the PCI, the NPCI and the
+APCI, and the cursor of engine.pdudata for the PDU's.  The subclass of a
+class is made the first time one is built, with the same name and module,
+so isinstance(), repr(), DebugContents and dict_contents() work like
+before.  An attribute without a slot, like the elements of a sequence, goes
+in a dictionary that is only made when there is one.  engine.install()
+installs it, first of all.
+
+Address is an old style class in bacpypes 0.16.7, the library cannot be
+made to build something else when it builds one, so CompactAddress is an
+Address with slots and compact_address() makes one, for the addresses that
+are kept like the ones of the discovery cache.
+"""
+
+from bacpypes.debugging import ModuleLogger
+from bacpypes.comm import PCI, PDUData
+from bacpypes.pdu import Address
+from bacpypes.primitivedata import Tag, Atomic, CharacterString
+from bacpypes.npdu import NPCI
+from bacpypes.apdu import APCI
+
+# some debugging
+_debug = 0
+_log = ModuleLogger(globals())
+
+# the attributes that get a slot in the subclasses of these classes
+_slots = (
+    (Tag, ('tagClass', 'tagNumber', 'tagLVT', 'tagData')),
+    (Atomic, ('value',)),
+    (CharacterString, ('strEncoding', 'strValue')),
+    (PCI, ('pduUserData', 'pduSource', 'pduDestination',
+        'pduExpectingReply', 'pduNetworkPriority')),
+    (NPCI, ('npduVersion', 'npduControl', 'npduDADR', 'npduSADR',
+        'npduHopCount', 'npduNetMessage', 'npduVendorID')),
+    (APCI, ('apduType', 'apduSeg', 'apduMor', 'apduSA', 'apduSrv', 'apduNak',
+        'apduSeq', 'apduWin', 'apduMaxSegs', 'apduMaxResp', 'apduService',
+        'apduInvokeID', 'apduAbortRejectReason')),
+    (PDUData, ('_pduBuffer', '_pduOffset', '_pduWrite')),
+    )
+
+# the classes that are given a __new__()
+_classes = (Tag, Atomic, PCI)
+
+# the compact subclass of each class, and of itself
+_compact = {}
+
+# set when installed
+_installed = False
+
+#
+#   compact_class
+#
+
+def compact_class(cls):
+    """Return the subclass of a class with slots, make it the first time."""
+    compact = _compact.get(cls)
+    if compact is not None:
+        return compact
+    if _debug: _log.debug("compact_class %r", cls)
+
+    slots = []
+    for base, names in _slots:
+        if issubclass(cls, base):
+            slots.extend(names)
+
+    compact = type(cls.__name__, (cls,), {
+        '__module__': cls.__module__,
+        '__slots__': tuple(slots),
+        })
+    _compact[cls] = _compact[compact] = compact
+
+    return compact
+
+def _new(cls, *args, **kwargs):
+    """The arguments are for __init__()."""
+    compact = _compact.get(cls)
+    if compact is None:
+        compact = compact_class(cls)
+
+    return object.__new__(compact)
+
+#
+#   CompactAddress
+#
+
+class CompactAddress(Address, object):
+
+    """An Address with slots, it is equal to and hashes like the Address it
+    was made from."""
+
+    __slots__ = ('addrType', 'addrNet', 'addrAddr', 'addrLen', 'addrIP',
+        'addrMask', 'addrHost', 'addrSubnet', 'addrPort', 'addrTuple',
+        'addrBroadcastTuple')
+
+def compact_address(address):
+    """Return a CompactAddress equal to an address, the same one if it is
+    already compact."""
+    if (address is None) or isinstance(address, CompactAddress):
+        return address
+
+    compact = CompactAddress.__new__(CompactAddress)
+    for name in CompactAddress.__slots__:
+        if hasattr(address, name):
+            setattr(compact, name, getattr(address, name))
+
+    return compact
+
+#
+#   install
+#
+
+def install():
+    """Build the compact subclasses of tags, atomic values and PCI's."""
+    global _installed
+    if _debug: _log.debug("install")
+
+    if _installed:
+        return
+
+    for cls in _classes:
+        cls.__new__ = staticmethod(_new)
+    _installed = True
+
+#
+#   uninstall
+#
+
+def uninstall():
+    """Build the classes of the bacpypes core again, the instances that are
+    compact stay that way, it is for measuring."""
+    global _installed
+    if _debug: _log.debug("uninstall")
+
+    if not _installed:
+        return
+
+    for cls in _classes:
+        del cls.__new__
+    _installed = False
+
+#
+#   installed
+#
+
+def installed():
+    """Return True when the tags, atomic values and PCI's are compact."""
+    return _installed
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+
+"""
+Coroutine
+
+A conversation with a device written as a generator instead of a chain of
+callbacks.  The generator yields an IOCB that has been given to a
+controller and is resumed with the same IOCB when it completes, so the
+results are checked the usual way.  Yielding a list of IOCBs waits for all
+of them and resumes with the list.
+
+    @coroutine
+    def check(app, address):
+        iocb = yield request_io(app, ReadPropertyRequest(...))
+        if iocb.ioError:
+            raise Return("failed")
+        ...
+
+A coroutine is an IOCB itself, it completes with the value given to Return
+(or None) and is aborted with the exception that escapes the generator.  So
+a coroutine can yield other coroutines, and thousands of them can run at
+once on one thread.
+
+This is the Python 2 form of awaitable IOCBs, there is no asyncio so the
+generators are driven by the IOCB callbacks of the bacpypes core.
+"""
+
+from functools import wraps
+
+from bacpypes.debugging import bacpypes_debugging, ModuleLogger
+from bacpypes.iocb import IOCB, IOGroup, COMPLETED
+from bacpypes.task import FunctionTask
+
+# some debugging
+_debug = 0
+_log = ModuleLogger(globals())
+
+#
+#   Return
+#
+
+class Return(Exception):
+
+    """Raised in a coroutine to complete it with a value."""
+
+    def __init__(self, value=None):
+        Exception.__init__(self, value)
+        self.value = value
+
+#
+#   Coroutine
+#
+
+@bacpypes_debugging
+class Coroutine(IOCB):
+
+    def __init__(self, generator):
+        if _debug: Coroutine._debug("__init__ %r", generator)
+        IOCB.__init__(self)
+
+        self.generator = generator
+
+        # what it is waiting for
+        self.waiting = None
+
+    def start(self):
+        """Run the generator up to the first thing it waits for."""
+        if _debug: Coroutine._debug("start")
+
+        self.step(None)
+
+    def step(self, value, error=None):
+        """Resume the generator with a value, or throw an error into it."""
+        if _debug: Coroutine._debug("step %r error=%r", value, error)
+
+        self.waiting = None
+        try:
+            if error is not None:
+                yielded = self.generator.throw(error)
+            else:
+                yielded = self.generator.send(value)
+        except Return as result:
+            self.complete(result.value)
+            return
+        except StopIteration:
+            self.complete(None)
+            return
+        except Exception as err:
+            if _debug: Coroutine._debug("    - exception: %r", err)
+            self.abort(err)
+            return
+
+        # lists are waited for together
+        if isinstance(yielded, (list, tuple)):
+            group = IOGroup()
+            for iocb in yielded:
+                if not isinstance(iocb, IOCB):
+                    self.step(None, TypeError("coroutines yield IOCBs: %r" % (iocb,)))
+                    return
+                group.add(iocb)
+            self.waiting = group
+            group.add_callback(self.resume, list(yielded))
+
+        elif isinstance(yielded, IOCB):
+            self.waiting = yielded
+            yielded.add_callback(self.resume, yielded)
+
+        else:
+            self.step(None, TypeError("coroutines yield IOCBs: %r" % (yielded,)))
+
+    def resume(self, iocb, value):
+        if _debug: Coroutine._debug("resume %r", iocb)
+
+        # aborted while waiting, let it go
+        if self.ioState >= COMPLETED:
+            if _debug: Coroutine._debug("    - no longer running")
+            self.generator.close()
+            return
+
+        self.step(value)
+
+#
+#   coroutine
+#
+
+def coroutine(fn):
+    """Decorate a generator function, calling it starts a Coroutine and
+    returns it."""
+    @wraps(fn)
+    def start(*args, **kwargs):
+        iocb = Coroutine(fn(*args, **kwargs))
+        iocb.start()
+        return iocb
+
+    return start
+
+#
+#   request_io
+#
+
+def request_io(controller, iocb):
+    """Give an IOCB, or a PDU wrapped in one, to a controller and return
+    the IOCB to wait for."""
+    if not isinstance(iocb, IOCB):
+        iocb = IOCB(iocb)
+
+    controller.request_io(iocb)
+
+    return iocb
+
+#
+#   sleep
+#
+
+def sleep(delay):
+    """Return an IOCB that completes after a delay."""
+    iocb = IOCB()
+    FunctionTask(iocb.complete, None).install_task(delta=delay)
+
+    return iocb
@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+
+"""
+Dispatch
+
+The bacpypes core takes the whole list of deferred functions at once and
+calls them before it goes back to the tasks and the sockets.  Every datagram
+that comes in is a deferred function, so the I-Am's of a global Who-Is can
+put thousands of them ahead of the timers of the transactions, which then
+time out for no reason.
+
+The DeferredQueue keeps the deferred functions in three classes, each one a
+FIFO:
+
+    CRITICAL        the protocol timers, the timeouts and retries of the
+                    segmentation state machines that have come due
+    IO              I/O completions, the deferred() of the bacpypes core
+    APPLICATION     the work of the application, starting a conversation
+
+The engine loop takes the due tasks of the protocol timers out of the task
+manager and puts them in the CRITICAL class (EventLoop.process_task() in
+engine.loop), before it calls the deferred functions.  Each pass calls the
+classes in order, up to a number of calls and a slice of time.  Every class
+gets its share of both, a class that runs out of its share of the slice
+waits for the next round even when it has calls left, and what is left of
+the budget and the slice then goes to the classes in order.  CRITICAL has
+the whole of both, so a flood of I/O completions never holds up a timeout,
+and the flood never starves the application completely.  The depth of each
+class and the time the functions waited are kept:
+
+    from engine.dispatch import defer, APPLICATION
+    defer(APPLICATION, app.start)
+"""
+
+from time import time as _time
+from collections import deque
+
+from bacpypes.debugging import bacpypes_debugging, ModuleLogger, DebugContents
+from bacpypes import core
+
+# some debugging
+_debug = 0
+_log = ModuleLogger(globals())
+
+# priority classes, the smaller the sooner
+CRITICAL = 0
+IO = 1
+APPLICATION = 2
+
+PRIORITIES = ('critical', 'io', 'application')
+
+# share of the budget and the slice each class gets before the leftover is
+# handed out
+SHARES = (1.0, 0.75, 0.25)
+
+# seconds of deferred functions in one pass
+SLICE = 0.05
+
+# the queue of the loop that is running
+_queue = None
+
+#
+#   DeferredQueue
+#
+
+@bacpypes_debugging
+class DeferredQueue(DebugContents):
+
+    _debug_contents = ('slice', 'maxDepth', 'calls', 'overruns')
+
+    def __init__(self, slice=SLICE, shares=SHARES):
+        if _debug: DeferredQueue._debug("__init__ slice=%r shares=%r", slice, shares)
+
+        if len(shares) != len(PRIORITIES):
+            raise ValueError("one share for each priority")
+
+        self.slice = slice
+        self.shares = tuple(shares)
+
+        # a FIFO of (when, fn, args, kwargs) for each class
+        self.queues = [deque() for priority in PRIORITIES]
+
+        # the deepest each class has been, how many calls and how long
+        # the calls waited
+        self.maxDepth = [0] * len(PRIORITIES)
+        self.calls = [0] * len(PRIORITIES)
+        self.waited = [0.0] * len(PRIORITIES)
+        self.maxWaited = [0.0] * len(PRIORITIES)
+
+        # passes that ran out of time with work left
+        self.overruns = 0
+
+    def __len__(self):
+        return sum(len(queue) for queue in self.queues)
+
+    def append(self, priority, fn, args=(), kwargs={}, when=None):
+        """Add a function to the end of its class."""
+        if when is None:
+            when = _time()
+
+        queue = self.queues[priority]
+        queue.append((when, fn, args, kwargs))
+        if len(queue) > self.maxDepth[priority]:
+            self.maxDepth[priority] = len(queue)
+
+    def collect(self):
+        """Move the deferred functions of the bacpypes core to the IO class,
+        they were deferred some time since the last pass."""
+        if not core.deferredFns:
+            return
+
+        fnlist = core.deferredFns
+        core.deferredFns = []
+
+        when = _time()
+        for fn, args, kwargs in fnlist:
+            self.append(IO, fn, args, kwargs, when)
+
+    def dispatch(self, budget):
+        """Call the deferred functions, up to the budget and the slice, and
+        return how many were called."""
+        if _debug: DeferredQueue._debug("dispatch %r", budget)
+
+        self.collect()
+
+        start = _time()
+        deadline = start + self.slice
+        count = 0
+
+        # each class gets its share of the budget and the slice, the time
+        # starts when its turn does so the ones before it cannot use it up
+        for priority, share in enumerate(self.shares):
+            limit = min(count + max(1, int(budget * share)), budget)
+            count = self._dispatch(priority, limit, count, _time() + self.slice * share)
+            if count >= budget:
+                if len(self):
+                    self.overruns += 1
+                return count
+
+            # what these called may have been deferred
+            self.collect()
+
+        # then the rest is handed out in order
+        for priority in range(len(PRIORITIES)):
+            count = self._dispatch(priority, budget, count, deadline)
+            if (count >= budget) or (_time() >= deadline):
+                if len(self):
+                    self.overruns += 1
+                return count
+
+            self.collect()
+
+        return count
+
+    def _dispatch(self, priority, limit, count, deadline):
+        queue = self.queues[priority]
+        waited = 0.0
+        calls = 0
+
+        while queue and (count < limit):
+            when, fn, args, kwargs = queue.popleft()
+
+            now = _time()
+            if now >= deadline:
+                queue.appendleft((when, fn, args, kwargs))
+                break
+
+            delay = now - when
+            waited += delay
+            if delay > self.maxWaited[priority]:
+                self.maxWaited[priority] = delay
+
+            try:
+                fn(*args, **kwargs)
+            except Exception as err:
+                DeferredQueue._exception("deferred %r: %s", fn, err)
+
+            calls += 1
+            count += 1
+
+        self.calls[priority] += calls
+        self.waited[priority] += waited
+        return count
+
+    def metrics(self):
+        """Return the depth of each class and the time the functions
+        waited to be called, in seconds."""
+        metrics = {}
+        for priority, name in enumerate(PRIORITIES):
+            calls = self.calls[priority]
+            metrics[name] = {
+                'depth': len(self.queues[priority]),
+                'maxDepth': self.maxDepth[priority],
+                'calls': calls,
+                'meanWait': (self.waited[priority] / calls) if calls else 0.0,
+                'maxWait': self.maxWaited[priority],
+                }
+        metrics['overruns'] = self.overruns
+        return metrics
+
+#
+#   defer
+#
+
+def defer(priority, fn, *args, **kwargs):
+    """Like bacpypes.core.deferred, with a priority class.  When the engine
+    loop is not running the function goes to the bacpypes core."""
+    if _debug: _log.debug("defer %r %r %r %r", priority, fn, args, kwargs)
+
+    queue = _queue
+    if queue is None:
+        core.deferred(fn, *args, **kwargs)
+        return
+
+    queue.append(priority, fn, args, kwargs)
+
+    # wake up the loop
+    if core.taskManager and core.taskManager.trigger:
+        core.taskManager.trigger.set()
+
+#
+#   metrics
+#
+
+def metrics():
+    """Return the metrics of the queue of the loop that is running, None
+    when there is none."""
+    queue = _queue
+    if queue is None:
+        return None
+
+    return queue.metrics()
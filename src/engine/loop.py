@@ -0,0 +1,630 @@
+#!/usr/bin/env python
+
+"""
+Loop
+
+An event loop that takes the place of bacpypes.core.run.  The core loop
+processes one due task for each call to asyncore.loop(), which builds the
+file descriptor sets and calls select() again, so when thousands of
+segmentation timers come due they are spread over thousands of system calls.
+This loop runs every due task and every deferred function in each pass, up
+to a budget for each so the sockets are not starved, and waits for the
+sockets with epoll (or poll, or select) keeping the registrations between
+passes.  The deferred functions go through a DeferredQueue, by priority and
+within a slice of time, and the protocol timers that come due, the timeouts
+and retries of the segmentation state machines, are moved to its CRITICAL
+class, so a flood of I/O completions does not hold them up.
+With metrics=True it is a MeteredEventLoop that keeps the histograms of
+engine.metrics, the EventLoop itself measures nothing.
+
+The asyncore dispatchers are used as they are, the UDPDirector, the TCP
+directors and the task manager trigger are found in asyncore.socket_map and
+their handlers are called by asyncore.readwrite().  The running flag and
+the deferred functions are the ones of bacpypes.core, so stop() and
+deferred() work the same way:
+
+    from engine.loop import run
+    run(backend='epoll', budget=1000)
+
+The loop does not spin and does not sleep.  When there is nothing to do it
+waits on the sockets with no timeout, and the work given to it by other
+threads, a deferred function, a task or a PDU for a director, wakes it up
+through a Waker, a pipe in the socket map.  The Waker takes the place of the
+task manager trigger while the loop runs, and the UDP and TCP directors are
+hooked to wake the loop when a request is queued, so the request_io() of a
+console thread goes out right away.  There is no reason to enable_sleeping()
+with this loop.
+
+The loop does not change the library when it is imported, the cursors of
+engine.pdudata and engine.taglist and the compact classes of engine.compact
+go with the loop but are installed by engine.install(), which the
+application calls at the start of main(), and the compiled codecs of
+engine.codec with engine.install(codecs=True).
+"""
+
+import os
+import asyncore
+import fcntl
+import select
+import signal
+import thread
+import threading
+import warnings
+
+from time import time as _time
+
+from bacpypes.debugging import bacpypes_debugging, ModuleLogger, DebugContents
+from bacpypes import core
+from bacpypes.core import stop, print_stack
+from bacpypes.task import TaskManager
+
+from engine import dispatch
+from engine import metrics as loop_metrics
+from engine.dispatch import DeferredQueue, CRITICAL, SLICE
+from engine.wheel import coarse_classes
+from engine.metrics import LoopMetrics, TimedPoller, dump
+
+# some debugging
+_debug = 0
+_log = ModuleLogger(globals())
+
+# event flags, the epoll and poll values are the same
+POLLIN = getattr(select, 'POLLIN', 0x001)
+POLLPRI = getattr(select, 'POLLPRI', 0x002)
+POLLOUT = getattr(select, 'POLLOUT', 0x004)
+POLLERR = getattr(select, 'POLLERR', 0x008)
+POLLHUP = getattr(select, 'POLLHUP', 0x010)
+
+# number of tasks and deferred functions in one pass
+BUDGET = 1000
+
+# the waker of the loop that is running
+_waker = None
+
+#
+#   Pollers
+#
+
+class EpollPoller:
+
+    """Wait for the registered file descriptors with epoll."""
+
+    def __init__(self):
+        self.epoll = select.epoll()
+
+    def register(self, fd, flags):
+        self.epoll.register(fd, flags)
+
+    def modify(self, fd, flags):
+        self.epoll.modify(fd, flags)
+
+    def unregister(self, fd):
+        self.epoll.unregister(fd)
+
+    def poll(self, timeout):
+        if timeout is None:
+            timeout = -1
+        return self.epoll.poll(timeout)
+
+    def close(self):
+        self.epoll.close()
+
+
+class PollPoller:
+
+    """Wait for the registered file descriptors with poll."""
+
+    def __init__(self):
+        self.poller = select.poll()
+
+    def register(self, fd, flags):
+        self.poller.register(fd, flags)
+
+    def modify(self, fd, flags):
+        self.poller.modify(fd, flags)
+
+    def unregister(self, fd):
+        self.poller.unregister(fd)
+
+    def poll(self, timeout):
+        # poll() takes milliseconds
+        if timeout is not None:
+            timeout = int(timeout * 1000.0 + 0.999)
+        return self.poller.poll(timeout)
+
+    def close(self):
+        pass
+
+
+class SelectPoller:
+
+    """Wait for the registered file descriptors with select, the sets are
+    kept between calls."""
+
+    def __init__(self):
+        self.readers = set()
+        self.writers = set()
+
+    def register(self, fd, flags):
+        if flags & (POLLIN | POLLPRI):
+            self.readers.add(fd)
+        if flags & POLLOUT:
+            self.writers.add(fd)
+
+    def modify(self, fd, flags):
+        self.unregister(fd)
+        self.register(fd, flags)
+
+    def unregister(self, fd):
+        self.readers.discard(fd)
+        self.writers.discard(fd)
+
+    def poll(self, timeout):
+        rfds, wfds, efds = select.select(self.readers, self.writers, self.readers, timeout)
+
+        events = {}
+        for fd in rfds:
+            events[fd] = events.get(fd, 0) | POLLIN
+        for fd in wfds:
+            events[fd] = events.get(fd, 0) | POLLOUT
+        for fd in efds:
+            events[fd] = events.get(fd, 0) | POLLPRI
+        return events.items()
+
+    def close(self):
+        pass
+
+# pollers by name, best first
+BACKENDS = [
+    ('epoll', EpollPoller, hasattr(select, 'epoll')),
+    ('poll', PollPoller, hasattr(select, 'poll')),
+    ('select', SelectPoller, True),
+    ]
+
+def get_backend(name=None):
+    """Return a poller, the best one this platform has when no name is
+    given."""
+    for backend_name, klass, available in BACKENDS:
+        if name and (backend_name != name):
+            continue
+        if not available:
+            raise ValueError("%s is not available" % (name,))
+        return klass()
+
+    raise ValueError("unknown backend: %r" % (name,))
+
+#
+#   Waker
+#
+
+@bacpypes_debugging
+class Waker(asyncore.file_dispatcher):
+
+    """A pipe that wakes up the loop when another thread has work for it,
+    Python 2 has no eventfd.  There is at most one byte in the pipe, and
+    setting it from the loop thread does nothing because the loop looks
+    for work before it waits again."""
+
+    def __init__(self):
+        if _debug: Waker._debug("__init__")
+
+        # make a pipe that never blocks
+        self._read_fd, self._write_fd = os.pipe()
+        for fd in (self._read_fd, self._write_fd):
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+        # continue with init, this puts it in the socket map
+        asyncore.file_dispatcher.__init__(self, self._read_fd)
+
+        # the thread that runs the loop
+        self.loopThread = None
+
+        # there is a byte in the pipe
+        self.pending = False
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        return False
+
+    def handle_read(self):
+        if _debug: Waker._debug("handle_read")
+
+        # empty the pipe before another byte is allowed in
+        try:
+            while os.read(self._read_fd, 512):
+                pass
+        except OSError:
+            pass
+        self.pending = False
+
+    def handle_close(self):
+        if _debug: Waker._debug("handle_close")
+
+    def isSet(self):
+        return self.pending
+
+    def set(self):
+        # the loop will see the work before it waits
+        if (self.pending) or (thread.get_ident() == self.loopThread):
+            return
+
+        self.pending = True
+        try:
+            os.write(self._write_fd, b'1')
+        except OSError:
+            pass
+
+    def clear(self):
+        pass
+
+    def close(self):
+        if _debug: Waker._debug("close")
+
+        # take it out of the socket map, the file_wrapper closes the read end
+        asyncore.file_dispatcher.close(self)
+        os.close(self._write_fd)
+
+#
+#   wakeup
+#
+
+def wakeup():
+    """Wake up the loop that is running, if there is one."""
+    waker = _waker
+    if waker is not None:
+        waker.set()
+
+#
+#   hook_directors
+#
+
+def hook_directors():
+    """Wake up the loop when a request is queued by a UDP or TCP director,
+    these are written when the socket is writable so a thread that queues
+    one would otherwise wait for the loop to come around."""
+    from bacpypes.udp import UDPDirector
+    from bacpypes.tcp import TCPClient, TCPServer
+
+    for klass in (UDPDirector, TCPClient, TCPServer):
+        indication = klass.__dict__['indication']
+        if getattr(indication, '_wakeup', False):
+            continue
+
+        def wakeup_indication(self, pdu, indication=indication):
+            indication(self, pdu)
+            wakeup()
+        wakeup_indication._wakeup = True
+
+        klass.indication = wakeup_indication
+
+#
+#   EventLoop
+#
+
+@bacpypes_debugging
+class EventLoop(DebugContents):
+
+    _debug_contents = ('poller', 'budget', 'spin', 'deferredQueue', 'passes', 'tasks', 'calls', 'events')
+
+    def __init__(self, backend=None, budget=BUDGET, spin=None, slice=SLICE):
+        if _debug: EventLoop._debug("__init__ backend=%r budget=%r spin=%r slice=%r", backend, budget, spin, slice)
+
+        if budget < 1:
+            raise ValueError("budget must be at least one")
+
+        self.poller = get_backend(backend)
+        self.budget = budget
+        self.spin = spin
+
+        # registered file descriptors, their dispatcher and flags
+        self.registered = {}
+
+        # reference the task manager (a singleton)
+        self.taskManager = TaskManager()
+
+        # other threads wake up the loop with this
+        self.waker = Waker()
+        hook_directors()
+
+        # the deferred functions by priority
+        self.deferredQueue = DeferredQueue(slice)
+
+        # the due tasks of these go to the CRITICAL class
+        self.criticalClasses = coarse_classes()
+
+        # what has been done
+        self.passes = 0
+        self.tasks = 0
+        self.calls = 0
+        self.events = 0
+
+    def run(self):
+        """Run until stop() is called."""
+        if _debug: EventLoop._debug("run")
+        global _waker
+
+        # deferred(), stop() and installing a task set the trigger
+        trigger = self.taskManager.trigger
+        self.taskManager.trigger = self.waker
+        self.waker.loopThread = thread.get_ident()
+        _waker = self.waker
+        dispatch._queue = self.deferredQueue
+
+        # the core has a reference to the task manager for stop()
+        core.taskManager = self.taskManager
+        core.running = True
+        try:
+            while core.running:
+                try:
+                    self.run_once()
+                except KeyboardInterrupt:
+                    if _debug: EventLoop._info("keyboard interrupt")
+                    core.running = False
+                except Exception as err:
+                    EventLoop._exception("an error has occurred: %s", err)
+        finally:
+            core.running = False
+            self.taskManager.trigger = trigger
+            self.waker.loopThread = None
+            _waker = None
+            dispatch._queue = None
+
+            # what was not called goes back to the core
+            for queue in self.deferredQueue.queues:
+                for when, fn, args, kwargs in queue:
+                    core.deferredFns.append((fn, args, kwargs))
+                queue.clear()
+            self.close()
+
+    def run_once(self, timeout=None):
+        """One pass, the due tasks, the deferred functions and then the
+        sockets.  Wait no longer than the timeout for socket activity, or
+        the spin if there is one, or until woken up."""
+        if _debug: EventLoop._debug("run_once timeout=%r", timeout)
+
+        self.passes += 1
+
+        # the due protocol timers go to the front of the deferred functions
+        budget, delta = self.run_tasks(self.budget)
+        calls = self.run_deferred(self.budget)
+
+        # more work to do or stopping, just check the sockets, and the
+        # functions that were called may have installed tasks that are due
+        if (budget <= 0) or calls or len(self.deferredQueue) or core.deferredFns or not core.running:
+            delta = 0.0
+        for limit in (self.spin, timeout):
+            if (limit is not None) and ((delta is None) or (limit < delta)):
+                delta = limit
+
+        self.poll(delta)
+
+    def run_deferred(self, budget):
+        """Call the deferred functions, including those they defer, by
+        priority and within the slice, and return how many were called."""
+        count = self.deferredQueue.dispatch(budget)
+
+        self.calls += count
+        return count
+
+    def run_tasks(self, budget):
+        """Process the tasks that are due, return what is left of the
+        budget and the time until the next task, None if there is none."""
+        taskManager = self.taskManager
+
+        count = 0
+        delta = None
+        while count < budget:
+            # get the next task
+            task, delta = taskManager.get_next_task()
+            if not task:
+                break
+
+            try:
+                self.process_task(task)
+            except Exception as err:
+                EventLoop._exception("task %r: %s", task, err)
+            count += 1
+
+        self.tasks += count
+        return (budget - count, delta)
+
+    def process_task(self, task):
+        """Process a task that is due, a protocol timer is moved to the
+        CRITICAL class of the deferred functions."""
+        if isinstance(task, self.criticalClasses):
+            self.deferredQueue.append(CRITICAL, self.process_critical, (task,))
+        else:
+            self.taskManager.process_task(task)
+
+    def process_critical(self, task):
+        """Process a protocol timer from the CRITICAL class, unless it was
+        started again after it came due."""
+        if task.isScheduled:
+            if _debug: EventLoop._debug("process_critical %r rescheduled", task)
+            return
+
+        self.taskManager.process_task(task)
+
+    def poll(self, timeout):
+        """Wait for socket activity and call the handlers."""
+        socket_map = asyncore.socket_map
+
+        # catch up with the dispatchers that came and went
+        registered = self.registered
+        for fd in list(registered):
+            if fd not in socket_map:
+                del registered[fd]
+                self._unregister(fd)
+
+        for fd, obj in socket_map.items():
+            flags = 0
+            if obj.readable():
+                flags |= POLLIN | POLLPRI
+            if obj.writable() and not obj.accepting:
+                flags |= POLLOUT
+            if flags:
+                flags |= POLLERR | POLLHUP
+
+            entry = registered.get(fd)
+            if entry is None:
+                self.poller.register(fd, flags)
+            elif entry[0] is not obj:
+                # the file descriptor was closed and used again, epoll has
+                # already forgotten it
+                self._unregister(fd)
+                self.poller.register(fd, flags)
+            elif entry[1] != flags:
+                self.poller.modify(fd, flags)
+            else:
+                continue
+            registered[fd] = (obj, flags)
+
+        try:
+            events = self.poller.poll(timeout)
+        except (select.error, IOError, OSError) as err:
+            # interrupted by a signal
+            if err.args[0] == 4:
+                return
+            raise
+
+        for fd, flags in events:
+            obj = socket_map.get(fd)
+            if obj is None:
+                continue
+            self.events += 1
+            asyncore.readwrite(obj, flags)
+
+    def _unregister(self, fd):
+        try:
+            self.poller.unregister(fd)
+        except (KeyError, ValueError, IOError, OSError):
+            pass
+
+    def close(self):
+        if _debug: EventLoop._debug("close")
+
+        for fd in self.registered:
+            self._unregister(fd)
+        self.registered = {}
+
+        # the waker is only closed once
+        if self.waker is not None:
+            self.waker.close()
+            self.waker = None
+
+#
+#   MeteredEventLoop
+#
+
+@bacpypes_debugging
+class MeteredEventLoop(EventLoop):
+
+    """An EventLoop that keeps the metrics of engine.metrics."""
+
+    _debug_contents = ('metrics',)
+
+    def __init__(self, backend=None, budget=BUDGET, spin=None, slice=SLICE):
+        if _debug: MeteredEventLoop._debug("__init__ backend=%r budget=%r spin=%r slice=%r", backend, budget, spin, slice)
+        EventLoop.__init__(self, backend, budget, spin, slice)
+
+        self.metrics = LoopMetrics()
+        self.metrics.deferredQueue = self.deferredQueue
+
+        # time the waits
+        self.poller = TimedPoller(self.poller, self.metrics.wait)
+
+    def run(self):
+        # this is the one to read
+        loop_metrics._metrics = self.metrics
+
+        EventLoop.run(self)
+
+    def run_once(self, timeout=None):
+        metrics = self.metrics
+        started = _time()
+        waited = metrics.wait.total
+
+        # count the traffic of the new dispatchers
+        dispatchers = metrics.dispatchers
+        for fd, obj in asyncore.socket_map.items():
+            entry = dispatchers.get(fd)
+            if (entry is None) or (entry[0] is not obj):
+                metrics.attach(fd, obj)
+
+        # the deferred functions waiting, those of the core included
+        self.deferredQueue.collect()
+        metrics.deferredDepth.record(len(self.deferredQueue))
+
+        EventLoop.run_once(self, timeout)
+
+        # the time of the pass without the wait
+        metrics.iteration.record(_time() - started - (metrics.wait.total - waited))
+
+    def run_tasks(self, budget):
+        taskManager = self.taskManager
+        taskLag = self.metrics.taskLag
+
+        count = 0
+        delta = None
+        while count < budget:
+            # get the next task
+            task, delta = taskManager.get_next_task()
+            if not task:
+                break
+
+            # how late it is
+            taskLag.record(max(_time() - task.taskTime, 0.0))
+
+            try:
+                self.process_task(task)
+            except Exception as err:
+                EventLoop._exception("task %r: %s", task, err)
+            count += 1
+
+        self.tasks += count
+        return (budget - count, delta)
+
+    def close(self):
+        EventLoop.close(self)
+
+        # put the sockets back
+        self.metrics.detach()
+
+#
+#   run
+#
+
+@bacpypes_debugging
+def run(backend=None, budget=BUDGET, spin=None, slice=SLICE, metrics=False,
+        sigterm=stop, sigusr1=print_stack, sigusr2=dump):
+    """Like bacpypes.core.run, with a choice of poller, a budget for the
+    number of tasks and deferred functions in one pass and a slice of time
+    for the deferred functions.  With no spin it waits until there is
+    something to do.  With metrics the loop is measured and the metrics are
+    written to stderr on SIGUSR2."""
+    if _debug: run._debug("run backend=%r budget=%r spin=%r slice=%r metrics=%r", backend, budget, spin, slice, metrics)
+
+    # the metrics signal only goes with the metrics
+    if not metrics:
+        sigusr2 = None
+
+    # install the signal handlers if they have been provided
+    if isinstance(threading.current_thread(), threading._MainThread):
+        if (sigterm is not None) and hasattr(signal, 'SIGTERM'):
+            signal.signal(signal.SIGTERM, sigterm)
+        if (sigusr1 is not None) and hasattr(signal, 'SIGUSR1'):
+            signal.signal(signal.SIGUSR1, sigusr1)
+        if (sigusr2 is not None) and hasattr(signal, 'SIGUSR2'):
+            signal.signal(signal.SIGUSR2, sigusr2)
+    elif sigterm or sigusr1 or sigusr2:
+        warnings.warn("no signal handlers for child threads")
+
+    if metrics:
+        loop = MeteredEventLoop(backend, budget, spin, slice)
+    else:
+        loop = EventLoop(backend, budget, spin, slice)
+    loop.run()
+
+    return loop
@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+
+"""
+Metrics
+
+What the engine loop is doing, to tell whether slow answers come from the
+network, the tasks running late or the deferred functions piling up.  The
+loop keeps histograms of:
+
+    iteration       the time a pass takes, without the wait
+    taskLag         how late the tasks run after they were due
+    wait            the time the poller waits for the sockets
+    deferredDepth   the number of deferred functions at the start of a pass
+
+and the bytes and packets sent and received by each dispatcher that has a
+socket.  Nothing is measured unless the loop is asked for it, then the
+metrics can be read with snapshot() or written to stderr with a signal:
+
+    from engine.loop import run
+    run(metrics=True)
+
+    kill -USR2 <pid>
+
+The histograms have a bucket for each power of two, microseconds for times,
+so recording a value is a bit_length() and an increment.
+"""
+
+import sys
+import json
+import socket
+
+from time import time as _time
+
+from bacpypes.debugging import bacpypes_debugging, ModuleLogger, DebugContents
+
+# some debugging
+_debug = 0
+_log = ModuleLogger(globals())
+
+# the metrics of the loop that is running, or the last one that ran
+_metrics = None
+
+#
+#   Histogram
+#
+
+class Histogram(DebugContents):
+
+    """Counts of values in power of two buckets, the values are multiplied
+    by the scale and made integers first."""
+
+    _debug_contents = ('count', 'total', 'max')
+
+    def __init__(self, scale=1.0):
+        self.scale = scale
+        self.buckets = [0] * 64
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, value):
+        self.buckets[int(value * self.scale).bit_length()] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, fraction):
+        """Return the upper bound of the bucket the fraction of the values
+        are in, in the units of the values."""
+        if not self.count:
+            return 0.0
+
+        needed = fraction * self.count
+        seen = 0
+        for bucket, count in enumerate(self.buckets):
+            seen += count
+            if seen >= needed:
+                return min(((1 << bucket) - 1) / self.scale, self.max)
+
+        return self.max
+
+    def dict_contents(self):
+        return {
+            'count': self.count,
+            'mean': (self.total / self.count) if self.count else 0.0,
+            'p50': self.percentile(0.50),
+            'p99': self.percentile(0.99),
+            'max': self.max,
+            'buckets': dict((1 << bucket, count) for bucket, count in enumerate(self.buckets) if count),
+            }
+
+#
+#   DispatcherStats
+#
+
+class DispatcherStats:
+
+    def __init__(self, name):
+        self.name = name
+        self.bytesIn = 0
+        self.bytesOut = 0
+        self.packetsIn = 0
+        self.packetsOut = 0
+
+    def dict_contents(self):
+        return {
+            'name': self.name,
+            'bytesIn': self.bytesIn,
+            'bytesOut': self.bytesOut,
+            'packetsIn': self.packetsIn,
+            'packetsOut': self.packetsOut,
+            }
+
+#
+#   CountingSocket
+#
+
+class CountingSocket(object):
+
+    """Stands in for the socket of a dispatcher and counts what goes through
+    it, everything else is passed along."""
+
+    def __init__(self, sock, stats):
+        self._sock = sock
+        self._stats = stats
+
+    def __getattr__(self, attr):
+        return getattr(self._sock, attr)
+
+    def recv(self, *args):
+        data = self._sock.recv(*args)
+        if data:
+            self._stats.bytesIn += len(data)
+            self._stats.packetsIn += 1
+        return data
+
+    def recvfrom(self, *args):
+        data, addr = self._sock.recvfrom(*args)
+        self._stats.bytesIn += len(data)
+        self._stats.packetsIn += 1
+        return data, addr
+
+    def send(self, data, *args):
+        sent = self._sock.send(data, *args)
+        self._stats.bytesOut += sent
+        self._stats.packetsOut += 1
+        return sent
+
+    def sendto(self, data, *args):
+        sent = self._sock.sendto(data, *args)
+        self._stats.bytesOut += sent
+        self._stats.packetsOut += 1
+        return sent
+
+#
+#   TimedPoller
+#
+
+class TimedPoller:
+
+    """Stands in for the poller of a loop and records how long it waits."""
+
+    def __init__(self, poller, histogram):
+        self.poller = poller
+        self.histogram = histogram
+
+    def register(self, fd, flags):
+        self.poller.register(fd, flags)
+
+    def modify(self, fd, flags):
+        self.poller.modify(fd, flags)
+
+    def unregister(self, fd):
+        self.poller.unregister(fd)
+
+    def poll(self, timeout):
+        started = _time()
+        try:
+            return self.poller.poll(timeout)
+        finally:
+            self.histogram.record(_time() - started)
+
+    def close(self):
+        self.poller.close()
+
+#
+#   LoopMetrics
+#
+
+@bacpypes_debugging
+class LoopMetrics(DebugContents):
+
+    _debug_contents = ('started', 'iteration', 'taskLag', 'wait', 'deferredDepth')
+
+    def __init__(self):
+        if _debug: LoopMetrics._debug("__init__")
+
+        self.started = _time()
+
+        self.iteration = Histogram(1e6)
+        self.taskLag = Histogram(1e6)
+        self.wait = Histogram(1e6)
+        self.deferredDepth = Histogram()
+
+        # stats for each dispatcher by file descriptor, and those of the
+        # dispatchers that have gone
+        self.dispatchers = {}
+        self.retired = []
+
+        # the deferred queue of the loop, for its metrics
+        self.deferredQueue = None
+
+    def attach(self, fd, obj):
+        """Count the traffic of a dispatcher that has a socket."""
+        sock = getattr(obj, 'socket', None)
+        if not isinstance(sock, socket.socket):
+            return
+        if _debug: LoopMetrics._debug("attach %r %r", fd, obj)
+
+        # the file descriptor has been used again
+        if fd in self.dispatchers:
+            self.retired.append(self.dispatchers.pop(fd)[1])
+
+        name = "%s %s" % (obj.__class__.__name__, getattr(obj, 'address', fd))
+        stats = DispatcherStats(name)
+        obj.socket = CountingSocket(sock, stats)
+        self.dispatchers[fd] = (obj, stats)
+
+    def detach(self):
+        """Give the dispatchers their sockets back."""
+        if _debug: LoopMetrics._debug("detach")
+
+        for obj, stats in self.dispatchers.values():
+            if isinstance(obj.socket, CountingSocket):
+                obj.socket = obj.socket._sock
+            self.retired.append(stats)
+        self.dispatchers = {}
+
+    def snapshot(self):
+        """Return the metrics as a dictionary that can be written as
+        JSON, times are in seconds."""
+        contents = {
+            'uptime': _time() - self.started,
+            'iteration': self.iteration.dict_contents(),
+            'taskLag': self.taskLag.dict_contents(),
+            'wait': self.wait.dict_contents(),
+            'deferredDepth': self.deferredDepth.dict_contents(),
+            'dispatchers': [stats.dict_contents() for stats in self.retired]
+                + [stats.dict_contents() for obj, stats in self.dispatchers.values()],
+            }
+        if self.deferredQueue is not None:
+            contents['deferred'] = self.deferredQueue.metrics()
+
+        return contents
+
+#
+#   snapshot
+#
+
+def snapshot():
+    """Return the metrics of the loop that is running, or the last one that
+    ran, None when no loop has been measuring."""
+    metrics = _metrics
+    if metrics is None:
+        return None
+
+    return metrics.snapshot()
+
+#
+#   dump
+#
+
+def dump(*args):
+    """Write the metrics to stderr, may be called with a signum and frame
+    parameter if called as a signal handler."""
+    contents = snapshot()
+    if contents is None:
+        sys.stderr.write("===== no loop metrics\n")
+    else:
+        sys.stderr.write("===== loop metrics\n")
+        sys.stderr.write(json.dumps(contents, sort_keys=True) + '\n')
+    sys.stderr.flush()
@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+
+"""
+PDU Data
+
+The PDUData of the bacpypes core keeps the octets of a packet in a string,
+get() takes the first one off with self.pduData = self.pduData[1:] and the
+put functions add to the end with +=, so decoding or encoding a packet copies
+all of it for every octet, and a large ReadPropertyMultiple ACK is copied
+hundreds of times on the way up.
+
+install() gives PDUData a cursor instead: the octets are a string that is
+never changed and an offset, get() and get_data() move the offset, and the
+put functions append to a bytearray.  pduData becomes a property, reading it
+gives the octets that have not been read yet as a string and setting it
+starts over, so the layers of the library that use it directly (the length
+checks, passing the rest of a packet on, the segmentation state machines)
+work as before and copy the packet once each rather than once for each
+octet.  TagList.decode() is replaced by one that reads tags until the cursor
+is at the end.  engine.install() installs it, before any PDU is made.
+
+get_data() returns a string rather than a memoryview, the values of the tags
+are decoded with the methods of strings.
+"""
+
+import struct
+
+from bacpypes.debugging import ModuleLogger
+from bacpypes.errors import DecodingError
+from bacpypes.comm import PDUData, PDU
+from bacpypes.primitivedata import Tag, TagList
+
+# some debugging
+_debug = 0
+_log = ModuleLogger(globals())
+
+# masks for put_short() and put_long()
+_short_mask = 0xFFFF
+_long_mask = 0xFFFFFFFF
+
+# the functions of PDUData that are replaced, and what they were
+_replaced = ('__init__', '__copy__', 'pduData', 'get', 'get_data', 'get_short',
+    'get_long', 'put', 'put_data', 'put_short', 'put_long')
+_original = None
+_original_decode = None
+
+#
+#   PDUData functions
+#
+
+def _init(self, data=None, *args, **kwargs):
+    # this call will fail if there are args or kwargs, but not if there
+    # is another class in the __mro__ of this thing being constructed
+    super(PDUData, self).__init__(*args, **kwargs)
+
+    # the octets and the offset of the next one to read, or None and the
+    # bytearray that is being written
+    self._pduOffset = 0
+    self._pduWrite = None
+
+    # function acts like a copy constructor, the string is not changed
+    # so it is shared
+    if data is None:
+        self._pduBuffer = b''
+    elif isinstance(data, str):
+        self._pduBuffer = data
+    elif isinstance(data, buffer):
+        self._pduBuffer = str(data)
+    elif isinstance(data, PDUData) or isinstance(data, PDU):
+        self._pduBuffer = str(data.pduData)
+    else:
+        raise TypeError("string expected")
+
+def _copy(self):
+    """The bytearray that is being written is not shared by the copy, the
+    attributes in slots, like the ones of engine.compact, are copied with
+    the others."""
+    cls = self.__class__
+    new = cls.__new__(cls)
+    new.__dict__.update(self.__dict__)
+    for klass in cls.__mro__:
+        for name in klass.__dict__.get('__slots__', ()):
+            if hasattr(self, name):
+                setattr(new, name, getattr(self, name))
+
+    if self._pduWrite is not None:
+        new._pduWrite = bytearray(self._pduWrite)
+
+    return new
+
+def _reader(self):
+    """Return the string to read from, what has been written is turned into
+    a string once."""
+    data = self._pduBuffer = str(self._pduWrite)
+    self._pduWrite = None
+    self._pduOffset = 0
+
+    return data
+
+def _writer(self):
+    """Return the bytearray to write to, it starts with what has not been
+    read."""
+    write = self._pduWrite
+    if write is None:
+        write = self._pduWrite = bytearray(buffer(self._pduBuffer, self._pduOffset))
+        self._pduBuffer = None
+        self._pduOffset = 0
+
+    return write
+
+def _get_pdu_data(self):
+    """The octets that have not been read, the string starts over with them
+    in the middle of decoding."""
+    data = self._pduBuffer
+    if data is None:
+        return _reader(self)
+    if self._pduOffset:
+        data = self._pduBuffer = data[self._pduOffset:]
+        self._pduOffset = 0
+
+    return data
+
+def _set_pdu_data(self, data):
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    elif isinstance(data, (bytearray, buffer)):
+        data = str(data)
+
+    self._pduBuffer = data
+    self._pduWrite = None
+    self._pduOffset = 0
+
+def _get(self):
+    data = self._pduBuffer
+    if data is None:
+        data = _reader(self)
+
+    offset = self._pduOffset
+    try:
+        octet = data[offset]
+    except IndexError:
+        raise DecodingError("no more packet data")
+
+    self._pduOffset = offset + 1
+    return ord(octet)
+
+def _get_data(self, dlen):
+    data = self._pduBuffer
+    if data is None:
+        data = _reader(self)
+
+    offset = self._pduOffset
+    end = offset + dlen
+    if len(data) < end:
+        raise DecodingError("no more packet data")
+
+    self._pduOffset = end
+    return data[offset:end]
+
+def _get_short(self):
+    return struct.unpack('>H', _get_data(self, 2))[0]
+
+def _get_long(self):
+    return struct.unpack('>L', _get_data(self, 4))[0]
+
+def _put(self, n):
+    _writer(self).append(n)
+
+def _put_data(self, data):
+    _writer(self).extend(data)
+
+def _put_short(self, n):
+    _writer(self).extend(struct.pack('>H', n & _short_mask))
+
+def _put_long(self, n):
+    _writer(self).extend(struct.pack('>L', n & _long_mask))
+
+#
+#   TagList functions
+#
+
+def _tag_list_decode(self, pdu):
+    """decode the tags from a PDU."""
+    data = pdu._pduBuffer
+    if data is None:
+        data = _reader(pdu)
+
+    # the tags move the offset, the string stays the same, and they are
+    # added to the list all at once
+    size = len(data)
+    tags = []
+    append = tags.append
+    while pdu._pduOffset < size:
+        append(Tag(pdu))
+
+    self.extend(tags)
+
+_cursor = {
+    '__init__': _init,
+    '__copy__': _copy,
+    'pduData': property(_get_pdu_data, _set_pdu_data),
+    'get': _get,
+    'get_data': _get_data,
+    'get_short': _get_short,
+    'get_long': _get_long,
+    'put': _put,
+    'put_data': _put_data,
+    'put_short': _put_short,
+    'put_long': _put_long,
+    }
+
+#
+#   install
+#
+
+def install():
+    """Give PDUData a cursor, before any PDU is made."""
+    global _original, _original_decode
+    if _debug: _log.debug("install")
+
+    if _original is not None:
+        return
+
+    _original = dict((name, PDUData.__dict__.get(name)) for name in _replaced)
+    for name in _replaced:
+        setattr(PDUData, name, _cursor[name])
+
+    # the tags of a packet are decoded until the cursor is at the end
+    _original_decode = TagList.__dict__['decode']
+    TagList.decode = _tag_list_decode
+
+#
+#   uninstall
+#
+
+def uninstall():
+    """Put back the functions of the bacpypes core, the PDU's made with the
+    cursor cannot be used after this, it is for measuring."""
+    global _original, _original_decode
+    if _debug: _log.debug("uninstall")
+
+    if _original is None:
+        return
+
+    for name in _replaced:
+        if _original[name] is None:
+            delattr(PDUData, name)
+        else:
+            setattr(PDUData, name, _original[name])
+    _original = None
+
+    TagList.decode = _original_decode
+    _original_decode = None
+
+#
+#   installed
+#
+
+def installed():
+    """Return True when PDUData has the cursor."""
+    return _original is not None
@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+
+"""
+Tag List
+
+The TagList of the bacpypes core is a list that Pop() takes the first tag
+off with del self.tagList[0] and push() puts one back with [tag] +
+self.tagList, so every Sequence, Choice and array decoded walks the list by
+moving all the tags that are left, and an object list of a thousand
+elements moves half a million of them.
+
+Sequence.decode() makes it worse, before decoding an element that is a
+structure it copies the tags that are left with taglist.tagList[:] in case
+it has to put them back with taglist.tagList = backup, so a
+ReadPropertyMultiple ACK is copied once for each of its results.
+
+install() gives TagList a cursor instead: the tags stay where they are in
+the list and Peek(), Pop() and push() move the index of the first one, the
+list is never changed other than adding tags to the end.  tagList becomes a
+property, reading it gives a TagView of the tags that have not been popped,
+which reads like the list it used to be so the code that uses it directly
+(the hand decoders of decode.settings, Any.cast_out()) sees them like
+before.  A TagView of the whole list is another view of the same tags, not
+a copy, and setting tagList to one puts the cursor back where it was, so the
+backup of Sequence.decode() costs nothing and the library function is used
+as it is.  engine.install() installs it with the cursor of engine.pdudata,
+the tag lists that were made before that get the cursor when they are used.
+"""
+
+from itertools import islice
+
+from bacpypes.debugging import ModuleLogger
+from bacpypes.comm import PDUData
+from bacpypes.primitivedata import TagList
+
+# some debugging
+_debug = 0
+_log = ModuleLogger(globals())
+
+# the functions of TagList that are replaced, and what they were
+_replaced = ('__init__', '__getattr__', 'tagList', 'append', 'extend',
+    '__getitem__', '__len__', 'Peek', 'push', 'Pop')
+_original = None
+
+#
+#   TagView
+#
+
+class TagView(object):
+
+    """The tags of a list from a start up to a stop, what the tagList of a
+    TagList with the cursor is.  The tags before the stop never change, so
+    a view is also a backup of them."""
+
+    __slots__ = ('_tags', '_start', '_stop')
+
+    def __init__(self, tags, start, stop):
+        self._tags = tags
+        self._start = start
+        self._stop = stop
+
+    def __len__(self):
+        return self._stop - self._start
+
+    def __nonzero__(self):
+        return self._stop > self._start
+
+    def __iter__(self):
+        return islice(self._tags, self._start, self._stop)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            # a copy of the whole list is another view of it
+            if (item.start is None) and (item.stop is None) and (item.step is None):
+                return TagView(self._tags, self._start, self._stop)
+
+            return self._tags[self._start:self._stop][item]
+
+        if item < 0:
+            item += len(self)
+        if not (0 <= item < len(self)):
+            raise IndexError("tag index out of range")
+
+        return self._tags[self._start + item]
+
+    def append(self, tag):
+        """Add a tag to the end, the view has to be the end of its list."""
+        if self._stop != len(self._tags):
+            raise ValueError("view is not the end of the tags")
+
+        self._tags.append(tag)
+        self._stop += 1
+
+    def extend(self, tags):
+        for tag in tags:
+            self.append(tag)
+
+    def __repr__(self):
+        return "<%s %r>" % (self.__class__.__name__, list(self))
+
+#
+#   TagList functions
+#
+
+def _init(self, arg=None):
+    # the tags and the index of the first one that has not been popped
+    self._tags = []
+    self._tagStart = 0
+
+    # a list is shared like before, but the tags popped are not taken out
+    # of it
+    if isinstance(arg, list):
+        self._tags = arg
+    elif isinstance(arg, (TagList, TagView)):
+        self._tags = list(arg)
+    elif isinstance(arg, PDUData):
+        self.decode(arg)
+
+def _getattr(self, attr):
+    """A TagList made before the cursor was installed, like the templates
+    of decode.template, gets one the first time it is used."""
+    if attr not in ('_tags', '_tagStart'):
+        raise AttributeError(attr)
+
+    self._tags = self.__dict__.pop('tagList', [])
+    self._tagStart = 0
+
+    return getattr(self, attr)
+
+def _get_tag_list(self):
+    """The tags that have not been popped."""
+    return TagView(self._tags, self._tagStart, len(self._tags))
+
+def _set_tag_list(self, tags):
+    """Start over with a list, or go back to a view, which is where the
+    cursor was unless tags have been added since."""
+    if not isinstance(tags, TagView):
+        self._tags = tags
+        self._tagStart = 0
+    elif tags._stop == len(tags._tags):
+        self._tags = tags._tags
+        self._tagStart = tags._start
+    else:
+        self._tags = list(tags)
+        self._tagStart = 0
+
+def _append(self, tag):
+    self._tags.append(tag)
+
+def _extend(self, taglist):
+    self._tags.extend(taglist)
+
+def _getitem(self, item):
+    return _get_tag_list(self)[item]
+
+def _len(self):
+    return len(self._tags) - self._tagStart
+
+def _peek(self):
+    """Return the tag at the front of the list."""
+    start = self._tagStart
+    if start < len(self._tags):
+        return self._tags[start]
+
+    return None
+
+def _push(self, tag):
+    """Return a tag back to the front of the list."""
+    start = self._tagStart
+    if start and (self._tags[start - 1] is tag):
+        # the tag that was popped
+        self._tagStart = start - 1
+    else:
+        self._tags = [tag] + self._tags[start:]
+        self._tagStart = 0
+
+def _pop(self):
+    """Remove the tag from the front of the list and return it."""
+    start = self._tagStart
+    if start < len(self._tags):
+        self._tagStart = start + 1
+        return self._tags[start]
+
+    return None
+
+_cursor = {
+    '__init__': _init,
+    '__getattr__': _getattr,
+    'tagList': property(_get_tag_list, _set_tag_list),
+    'append': _append,
+    'extend': _extend,
+    '__getitem__': _getitem,
+    '__len__': _len,
+    'Peek': _peek,
+    'push': _push,
+    'Pop': _pop,
+    }
+
+#
+#   install
+#
+
+def install():
+    """Give TagList a cursor, before any TagList is made."""
+    global _original
+    if _debug: _log.debug("install")
+
+    if _original is not None:
+        return
+
+    _original = dict((name, TagList.__dict__.get(name)) for name in _replaced)
+    for name in _replaced:
+        setattr(TagList, name, _cursor[name])
+
+#
+#   uninstall
+#
+
+def uninstall():
+    """Put back the functions of the bacpypes core, the TagList's made with
+    the cursor cannot be used after this, it is for measuring."""
+    global _original
+    if _debug: _log.debug("uninstall")
+
+    if _original is None:
+        return
+
+    for name in _replaced:
+        if _original[name] is None:
+            delattr(TagList, name)
+        else:
+            setattr(TagList, name, _original[name])
+    _original = None
+
+#
+#   installed
+#
+
+def installed():
+    """Return True when TagList has the cursor."""
+    return _original is not None
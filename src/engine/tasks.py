@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+
+"""
+Tasks
+
+The bacpypes TaskManager keeps the tasks in a heap and suspends a task by
+searching the whole heap for it and building the heap again, so every
+stop_timer() and restart_timer() of a segmentation state machine costs time
+in proportion to the number of timers.  The IndexedTaskManager keeps a
+reference from the task to its heap entry, suspending a task marks the entry
+as dead and the dead entries are dropped as they come to the top of the heap
+or when there are more dead entries than live ones.  Installing a task is
+O(log n), suspending it is O(1).
+
+The task manager is a singleton, make one before anything else asks for a
+TaskManager and everything uses it:
+
+    from engine.tasks import IndexedTaskManager
+    IndexedTaskManager()
+"""
+
+from time import time as _time
+from heapq import heapify, heappush, heappop
+from itertools import count
+
+from bacpypes.debugging import ModuleLogger
+from bacpypes.task import TaskManager
+
+# some debugging
+_debug = 0
+_log = ModuleLogger(globals())
+
+# dead entries left in the heap before it is worth compacting
+COMPACT_MINIMUM = 1024
+
+#
+#   IndexedTaskManager
+#
+
+# @bacpypes_debugging - implicit via metaclass
+class IndexedTaskManager(TaskManager):
+
+    def __init__(self):
+        if _debug: IndexedTaskManager._debug("__init__")
+
+        # entries are [when, sequence, task], the task is None when it has
+        # been suspended
+        self.sequence = count()
+        self.dead = 0
+
+        # continue initializing, this installs the tasks made before there
+        # was a task manager
+        TaskManager.__init__(self)
+
+    def install_task(self, task):
+        if _debug: IndexedTaskManager._debug("install_task %r @ %r", task, task.taskTime)
+
+        # if the taskTime is None is hasn't been computed correctly
+        if task.taskTime is None:
+            raise RuntimeError("task time is None")
+
+        # if this is already installed, take it out
+        if task.isScheduled:
+            self._remove(task)
+
+        entry = [task.taskTime, next(self.sequence), task]
+        heappush(self.tasks, entry)
+
+        task._taskEntry = entry
+        task.isScheduled = True
+
+        # the loop only needs to wake up when this is the next task
+        if self.trigger and (self.tasks[0] is entry):
+            self.trigger.set()
+
+    def suspend_task(self, task):
+        if _debug: IndexedTaskManager._debug("suspend_task %r", task)
+
+        if task.isScheduled:
+            self._remove(task)
+        else:
+            if _debug: IndexedTaskManager._debug("    - task not found")
+
+    def _remove(self, task):
+        entry = getattr(task, '_taskEntry', None)
+        if entry is not None:
+            entry[2] = None
+            task._taskEntry = None
+            self.dead += 1
+
+        task.isScheduled = False
+
+        # mostly dead
+        if (self.dead > COMPACT_MINIMUM) and (self.dead * 2 > len(self.tasks)):
+            self.compact()
+
+    def compact(self):
+        """Drop the dead entries."""
+        if _debug: IndexedTaskManager._debug("compact")
+
+        self.tasks = [entry for entry in self.tasks if entry[2] is not None]
+        heapify(self.tasks)
+        self.dead = 0
+
+    def _pop_dead(self):
+        tasks = self.tasks
+        while tasks and (tasks[0][2] is None):
+            heappop(tasks)
+            self.dead -= 1
+
+    def get_next_task(self):
+        """get the next task if there's one that should be processed,
+        and return how long it will be until the next one should be
+        processed."""
+        if _debug: IndexedTaskManager._debug("get_next_task")
+
+        # get the time
+        now = _time()
+
+        self._pop_dead()
+        tasks = self.tasks
+        if not tasks:
+            return (None, None)
+
+        when, sequence, task = tasks[0]
+        if when > now:
+            return (None, when - now)
+
+        # pull it off the heap and mark that it's no longer scheduled
+        heappop(tasks)
+        task._taskEntry = None
+        task.isScheduled = False
+
+        # peek at the next task, return how long to wait
+        self._pop_dead()
+        if tasks:
+            delta = max(tasks[0][0] - now, 0.0)
+        else:
+            delta = None
+
+        return (task, delta)
+
+    def active_count(self):
+        """Return the number of scheduled tasks."""
+        return len(self.tasks) - self.dead
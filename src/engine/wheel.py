@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+
+"""
+Wheel
+
+Nearly all of the timers of the stack are coarse: the APDU timeouts of the
+segmentation state machines, the foreign device registration, the COV
+subscription lifetimes and the BBMD foreign device table ageing.  They do
+not need a place in a precise heap, they can go in the slot of a timing
+wheel for the tick they expire in, which makes installing and suspending
+them O(1).
+
+The TimingWheel is hierarchical, the first level has a slot for each tick,
+the next a slot for each turn of the first level and so on.  As the wheel
+turns the slots of the higher levels are moved down.  When a slot of the
+first level comes up its tasks are due and they are moved to the heap, so
+they run in order with the rest and are never early, at most a tick late.
+
+The WheelTaskManager is an IndexedTaskManager that puts the tasks of the
+coarse classes in the wheel, everything else, the RecurringTask's of the
+application and the tasks that are due within a tick, stay in the heap:
+
+    from engine.wheel import WheelTaskManager
+    WheelTaskManager(resolution=0.05)
+"""
+
+from time import time as _time
+from math import ceil, floor
+
+from bacpypes.debugging import ModuleLogger, DebugContents
+
+from engine.tasks import IndexedTaskManager
+
+# some debugging
+_debug = 0
+_log = ModuleLogger(globals())
+
+# default tick resolution in seconds, slots in each level and levels
+RESOLUTION = 0.1
+SLOT_BITS = 8
+LEVELS = 4
+
+#
+#   coarse_classes
+#
+
+def coarse_classes():
+    """Return the task classes of the protocol timers."""
+    from bacpypes.appservice import SSM
+    from bacpypes.bvllservice import BIPForeign, BIPBBMD
+    from bacpypes.service.cov import Subscription
+
+    return (SSM, BIPForeign, BIPBBMD, Subscription)
+
+#
+#   TimingWheel
+#
+
+class TimingWheel(DebugContents):
+
+    _debug_contents = ('resolution', 'tick', 'count')
+
+    def __init__(self, resolution=RESOLUTION, slot_bits=SLOT_BITS, levels=LEVELS, now=None):
+        if resolution <= 0.0:
+            raise ValueError("resolution must be greater than zero")
+
+        self.resolution = resolution
+        self.slotBits = slot_bits
+        self.mask = (1 << slot_bits) - 1
+        self.levels = [[{} for i in range(1 << slot_bits)] for j in range(levels)]
+
+        # the tasks in a tick farther than this are not taken
+        self.span = 1 << (slot_bits * levels)
+
+        # the last tick that has been processed
+        if now is None:
+            now = _time()
+        self.tick = int(floor(now / resolution))
+
+        # number of tasks in the wheel
+        self.count = 0
+
+    def insert(self, task):
+        """Put the task in the slot of its tick, return False when it is
+        due or too far away for the wheel."""
+        expires = int(ceil(task.taskTime / self.resolution))
+        delta = expires - self.tick
+        if (delta <= 0) or (delta >= self.span):
+            return False
+
+        self._insert(task, expires, delta)
+        return True
+
+    def _insert(self, task, expires, delta):
+        # find the level that covers it
+        level = 0
+        while delta >> (self.slotBits * (level + 1)):
+            level += 1
+
+        slot = self.levels[level][(expires >> (self.slotBits * level)) & self.mask]
+        slot[task] = expires
+        task._wheelSlot = slot
+        self.count += 1
+
+    def remove(self, task):
+        """Take the task out of its slot, return False when it is not in
+        the wheel."""
+        slot = getattr(task, '_wheelSlot', None)
+        if slot is None:
+            return False
+
+        del slot[task]
+        task._wheelSlot = None
+        self.count -= 1
+        return True
+
+    def advance(self, now):
+        """Turn the wheel up to now and return the tasks that are due."""
+        target = int(floor(now / self.resolution))
+
+        due = []
+        while self.tick < target:
+            self.tick += 1
+            tick = self.tick
+
+            # nothing can come due or down
+            if not self.count:
+                self.tick = target
+                break
+
+            # move the slots of the higher levels down at each turn
+            level = 1
+            while (level < len(self.levels)) and not (tick & ((1 << (self.slotBits * level)) - 1)):
+                slot = self.levels[level][(tick >> (self.slotBits * level)) & self.mask]
+                if slot:
+                    self.levels[level][(tick >> (self.slotBits * level)) & self.mask] = {}
+                    for task, expires in slot.items():
+                        self.count -= 1
+                        if expires <= tick:
+                            task._wheelSlot = None
+                            due.append(task)
+                        else:
+                            self._insert(task, expires, expires - tick)
+                level += 1
+
+            # the tasks of this tick are due
+            slot = self.levels[0][tick & self.mask]
+            if slot:
+                self.levels[0][tick & self.mask] = {}
+                for task in slot:
+                    task._wheelSlot = None
+                    due.append(task)
+                self.count -= len(slot)
+
+        return due
+
+    def next_tick(self):
+        """Return the time of the next tick."""
+        return (self.tick + 1) * self.resolution
+
+#
+#   WheelTaskManager
+#
+
+# @bacpypes_debugging - implicit via metaclass
+class WheelTaskManager(IndexedTaskManager):
+
+    def __init__(self, resolution=RESOLUTION, classes=None, slot_bits=SLOT_BITS, levels=LEVELS):
+        if _debug: WheelTaskManager._debug("__init__ resolution=%r classes=%r", resolution, classes)
+
+        self.wheel = TimingWheel(resolution, slot_bits, levels)
+        if classes is None:
+            classes = coarse_classes()
+        self.classes = tuple(classes)
+
+        # continue initializing
+        IndexedTaskManager.__init__(self)
+
+    def install_task(self, task):
+        if _debug: WheelTaskManager._debug("install_task %r @ %r", task, task.taskTime)
+
+        # if the taskTime is None is hasn't been computed correctly
+        if task.taskTime is None:
+            raise RuntimeError("task time is None")
+
+        # the loop only wakes up for the ticks while the wheel has tasks
+        idle = not self.wheel.count
+
+        # if this is already installed, take it out
+        if task.isScheduled:
+            self.suspend_task(task)
+
+        # protocol timers that are at least a tick away go in the wheel
+        if isinstance(task, self.classes) and self.wheel.insert(task):
+            task.isScheduled = True
+
+            # the loop may be waiting for longer than the next tick
+            if idle and self.trigger:
+                self.trigger.set()
+            return
+
+        IndexedTaskManager.install_task(self, task)
+
+    def suspend_task(self, task):
+        if _debug: WheelTaskManager._debug("suspend_task %r", task)
+
+        if self.wheel.remove(task):
+            task.isScheduled = False
+        else:
+            IndexedTaskManager.suspend_task(self, task)
+
+    def get_next_task(self):
+        """get the next task if there's one that should be processed,
+        and return how long it will be until the next one should be
+        processed."""
+        if _debug: WheelTaskManager._debug("get_next_task")
+
+        now = _time()
+
+        # the tasks of the ticks that have passed join the heap
+        for task in self.wheel.advance(now):
+            task.isScheduled = False
+            IndexedTaskManager.install_task(self, task)
+
+        task, delta = IndexedTaskManager.get_next_task(self)
+
+        # wake up for the next tick while there are tasks in the wheel
+        if self.wheel.count:
+            wheel_delta = max(self.wheel.next_tick() - now, 0.0)
+            if (delta is None) or (wheel_delta < delta):
+                delta = wheel_delta
+
+        return (task, delta)
+
+    def active_count(self):
+        """Return the number of scheduled tasks."""
+        return IndexedTaskManager.active_count(self) + self.wheel.count
@@ -0,0 +1,8 @@
+#!/usr/bin/env python
+
+"""
+Fleet
+
+Shared helpers for running the Delta tools against many controllers at once
+instead of one device per process.
+"""
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+
+"""
+Devices
+
+Parse device instance lists like "1200 1300-1310,75000" into a sorted list
+of instance numbers and compress them back into Who-Is ranges.
+"""
+
+from bacpypes.debugging import bacpypes_debugging, ModuleLogger
+
+# some debugging
+_debug = 0
+_log = ModuleLogger(globals())
+
+# largest device instance number
+MAX_INSTANCE = 4194303
+
+#
+#   parse_device_list
+#
+
+@bacpypes_debugging
+def parse_device_list(specs):
+    """Turn a list of strings with instances and lo-hi ranges, separated by
+    spaces or commas, into a sorted list of unique device instances."""
+    if _debug: parse_device_list._debug("parse_device_list %r", specs)
+
+    if isinstance(specs, str):
+        specs = [specs]
+
+    instances = set()
+    for spec in specs:
+        for part in spec.replace(',', ' ').split():
+            try:
+                if '-' in part:
+                    lo, hi = part.split('-', 1)
+                    lo, hi = int(lo), int(hi)
+                else:
+                    lo = hi = int(part)
+            except ValueError:
+                raise ValueError("invalid device instance or range: %r" % (part,))
+
+            if lo > hi:
+                raise ValueError("invalid device range: %r" % (part,))
+
+            if (lo < 0) or (hi > MAX_INSTANCE):
+                raise ValueError("device instance out of range: %r" % (part,))
+
+            instances.update(range(lo, hi + 1))
+
+    return sorted(instances)
+
+#
+#   device_ranges
+#
+
+def device_ranges(instances):
+    """Compress a sorted list of device instances into (lo, hi) pairs, one
+    for each contiguous run, suitable for Who-Is range limits."""
+    ranges = []
+    for instance in instances:
+        if ranges and (instance == ranges[-1][1] + 1):
+            ranges[-1][1] = instance
+        else:
+            ranges.append([instance, instance])
+
+    return [tuple(r) for r in ranges]
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+"""
+Diff
+
+Compare the BACnet settings read from a device with the desired values of
+the fields a write template can change.  A desired value is normalized the
+way it would come back from the device, it is encoded by the template and
+decoded by the layout, so 0x9e3b and 40507 are the same net number and
+72.012.096.012 is the same proxy as 72.12.96.12.  A write request is only
+built for a device when something is different, it writes back the tags read
+from the device with only the fields that differ replaced, so the fields and
+tags the desired state does not mention keep the values of the device.
+"""
+
+from bacpypes.debugging import ModuleLogger
+
+from decode import template as _template
+
+# some debugging
+_debug = 0
+_log = ModuleLogger(globals())
+
+#
+#   normalize
+#
+
+def normalize(template, name, value):
+    """Return a desired value the way the device would report it."""
+    encoder = template.encoders.get(name)
+    if not encoder:
+        raise ValueError("%s template cannot write %r" % (template.layout.kind, name))
+
+    # unsigned values can be written in hex, 0x9e3b
+    if (encoder is _template.unsigned) and isinstance(value, basestring):
+        value = int(value, 0)
+
+    for path, (field_name, decoder) in template.layout.fields.items():
+        if field_name == name:
+            return decoder(encoder(value))
+
+    raise ValueError("%s layout has no %r" % (template.layout.kind, name))
+
+#
+#   diff_settings
+#
+
+def diff_settings(settings, desired, template):
+    """Return a dictionary of the fields that differ, the values are tuples
+    of the current and the desired value."""
+    if _debug: _log.debug("diff_settings %r %r", settings, desired)
+
+    changes = {}
+    for name, value in desired.items():
+        wanted = normalize(template, name, value)
+        current = getattr(settings, name)
+        if current != wanted:
+            changes[name] = (current, wanted)
+
+    return changes
+
+#
+#   write_request
+#
+
+def write_request(settings, changes, template, address, array_index=None):
+    """Return the request that writes the changes into the tags read from
+    the device, every other tag keeps the value read.  The tags written are
+    checked to decode to the settings read with only the changes.  No
+    changes, no request."""
+    if _debug: _log.debug("write_request %r %r %r %r", settings, changes, address, array_index)
+
+    if not changes:
+        return None
+
+    values = dict((name, wanted) for name, (current, wanted) in changes.items())
+
+    return template.modify(address, settings.tags, array_index, **values)
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+
+"""
+Discovery
+
+The DiscoveryCache is a DeviceInfoCache that keeps what the I-Am's said in
+a file between runs: the address, maximum APDU length, segmentation and
+vendor of each device instance.  Tools look up a device before sending a
+Who-Is, an entry younger than the time to live is good enough to address
+the device, and an entry is dropped when the device stops answering at that
+address so the next Who-Is finds it again.
+"""
+
+import os
+import json
+from collections import namedtuple
+from time import time as _time
+
+from bacpypes.debugging import bacpypes_debugging, ModuleLogger, DebugContents
+from bacpypes.task import FunctionTask
+
+from bacpypes.pdu import Address
+from bacpypes.apdu import AbortPDU
+from bacpypes.app import DeviceInfoCache
+
+from engine.compact import compact_address
+
+# some debugging
+_debug = 0
+_log = ModuleLogger(globals())
+
+# where the entries are kept unless told otherwise
+DEFAULT_PATH = os.path.join(os.path.expanduser('~'), '.delta-discovery.json')
+
+# file format version
+VERSION = 1
+
+#
+#   no_response
+#
+
+def no_response(err):
+    """Return True if the request was aborted because the device did not
+    answer, which is when a cached address is suspect."""
+    return isinstance(err, AbortPDU) and (err.apduAbortRejectReason == 65)
+
+#
+#   DiscoveryRecord
+#
+
+DiscoveryRecord = namedtuple('DiscoveryRecord', (
+    'deviceInstance', 'address', 'maxApduLengthAccepted',
+    'segmentationSupported', 'vendorID', 'timestamp',
+    ))
+
+#
+#   DiscoveryCache
+#
+
+@bacpypes_debugging
+class DiscoveryCache(DeviceInfoCache, DebugContents):
+
+    _debug_contents = ('path', 'ttl', 'records', 'dirty')
+
+    def __init__(self, path=DEFAULT_PATH, ttl=86400.0, flush_delay=1.0):
+        if _debug: DiscoveryCache._debug("__init__ %r ttl=%r", path, ttl)
+        DeviceInfoCache.__init__(self)
+
+        self.path = path
+        self.ttl = ttl
+        self.flush_delay = flush_delay
+
+        # records by device instance and by address
+        self.records = {}
+        self.addresses = {}
+
+        # changes not written yet
+        self.dirty = False
+        self._flush_task = None
+
+        if path and os.path.exists(path):
+            self.load()
+
+    def load(self):
+        """Read the entries from the file, a file that cannot be read is
+        the same as no file at all."""
+        if _debug: DiscoveryCache._debug("load")
+
+        try:
+            with open(self.path, 'rb') as f:
+                content = json.load(f)
+            if content.get('version') != VERSION:
+                raise ValueError("version %r" % (content.get('version'),))
+
+            for device_instance, row in content['devices'].items():
+                address, max_apdu, segmentation, vendor_id, timestamp = row
+                self._put(DiscoveryRecord(int(device_instance), Address(str(address)),
+                    max_apdu, str(segmentation), vendor_id, timestamp))
+        except Exception as err:
+            DiscoveryCache._warning("%s not loaded: %r", self.path, err)
+            self.records = {}
+            self.addresses = {}
+
+    def flush(self):
+        """Write the entries if anything changed, the file is replaced in
+        one step so a reader never sees half of it."""
+        if _debug: DiscoveryCache._debug("flush")
+
+        if self._flush_task:
+            if self._flush_task.isScheduled:
+                self._flush_task.suspend_task()
+            self._flush_task = None
+
+        if not (self.path and self.dirty):
+            return
+
+        content = {
+            'version': VERSION,
+            'devices': dict(
+                (str(record.deviceInstance), [
+                    str(record.address), record.maxApduLengthAccepted,
+                    record.segmentationSupported, record.vendorID,
+                    round(record.timestamp, 1),
+                    ])
+                for record in self.records.values()
+                ),
+            }
+
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            json.dump(content, f, separators=(',', ':'))
+        os.rename(temp_path, self.path)
+
+        self.dirty = False
+
+    def lookup(self, device_instance):
+        """Return the record of a device if it is fresh, otherwise None."""
+        record = self.records.get(device_instance)
+        if record and (_time() - record.timestamp < self.ttl):
+            return record
+        return None
+
+    def invalidate(self, device_instance):
+        """Forget a device, it did not answer at the address in the cache."""
+        if _debug: DiscoveryCache._debug("invalidate %r", device_instance)
+
+        record = self.records.pop(device_instance, None)
+        if record:
+            if self.addresses.get(record.address) is record:
+                del self.addresses[record.address]
+            self._changed()
+
+    def add_device_info(self, apdu):
+        """Remember what an I-Am said, in the device information of the
+        library and in a record for the file."""
+        if _debug: DiscoveryCache._debug("add_device_info %r", apdu)
+
+        DeviceInfoCache.add_device_info(self, apdu)
+
+        self._put(DiscoveryRecord(
+            apdu.iAmDeviceIdentifier[1], apdu.pduSource,
+            apdu.maxAPDULengthAccepted, apdu.segmentationSupported,
+            apdu.vendorID, _time(),
+            ))
+        self._changed()
+
+    def get_device_info(self, key):
+        """The generic record the application builds for a new address has
+        the maximum APDU length and segmentation of the device if it is
+        known, so requests are segmented right the first time."""
+        info = DeviceInfoCache.get_device_info(self, key)
+
+        if info and (info.deviceIdentifier is None) and (getattr(info, '_ref_count', 0) == 1):
+            record = self.addresses.get(key)
+            if record:
+                if _debug: DiscoveryCache._debug("    - from record: %r", record)
+                info.maxApduLengthAccepted = record.maxApduLengthAccepted
+                info.segmentationSupported = record.segmentationSupported
+                info.vendorID = record.vendorID
+
+        return info
+
+    def _put(self, record):
+        # the address is kept as long as the record
+        record = record._replace(address=compact_address(record.address))
+
+        old_record = self.records.get(record.deviceInstance)
+        if old_record and (self.addresses.get(old_record.address) is old_record):
+            del self.addresses[old_record.address]
+
+        self.records[record.deviceInstance] = record
+        self.addresses[record.address] = record
+
+    def _changed(self):
+        # write the file a little later so a burst of I-Am's is one write
+        self.dirty = True
+        if not self._flush_task:
+            self._flush_task = FunctionTask(self.flush)
+            self._flush_task.install_task(delta=self.flush_delay)
@@ -0,0 +1,336 @@
+#!/usr/bin/env python
+
+"""
+Farm
+
+A farm of simulated Delta controllers on a bacpypes.vlan IPNetwork, for
+measuring the tools without touching real controllers or the network.
+Each SimulatedDevice has the BACnet settings of the BCP (162/1/1034) and NET
+(278/1/1101) objects with the same nested context tags as the write
+templates, answers ReadPropertyMultiple for its identification properties,
+acknowledges SaveToFlash and restarts when it is reinitialized.  Responses
+can be delayed and a share of the requests can be answered with an error.
+
+The application classes of the tools run on the farm unchanged, the farm
+makes a subclass that builds the BACnet/IP stack on a VLAN node instead of a
+UDP socket:
+
+    farm = DeltaFarm(100)
+    app = farm.application(BatchApplication, jobs, output, localDevice=device)
+"""
+
+import random
+
+from bacpypes.debugging import bacpypes_debugging, ModuleLogger, DebugContents
+from bacpypes.comm import Client, Server, bind
+from bacpypes.task import FunctionTask
+
+from bacpypes.pdu import Address, LocalBroadcast, PDU, unpack_ip_addr
+from bacpypes.vlan import IPNetwork, IPNode
+from bacpypes.bvllservice import BIPSimple, AnnexJCodec
+from bacpypes.appservice import ApplicationServiceAccessPoint
+from bacpypes.netservice import NetworkServiceAccessPoint, NetworkServiceElement
+
+from bacpypes.apdu import ConfirmedRequestPDU, ReadPropertyACK, SimpleAckPDU, Error
+from bacpypes.constructeddata import Any
+
+from bacpypes.app import Application, ApplicationIOController, BIPSimpleApplication
+from bacpypes.service.device import LocalDeviceObject, WhoIsIAmServices
+from bacpypes.service.object import ReadWritePropertyServices, ReadWritePropertyMultipleServices
+
+from decode import bcp, net
+
+from engine.appservice import IndexedStateMachineAccessPoint
+from fleet.jobs import SAVE_TO_FLASH
+
+# some debugging
+_debug = 0
+_log = ModuleLogger(globals())
+
+# Delta Controls
+VENDOR_ID = 8
+
+#
+#   VLANMultiplexer
+#
+
+@bacpypes_debugging
+class VLANMultiplexer(Client, Server):
+
+    """Takes the place of the UDPMultiplexer, the addresses of the PDUs
+    going down are turned into the tuples of the IPNetwork and back into
+    addresses on the way up."""
+
+    def __init__(self, address, network, cid=None, sid=None):
+        if _debug: VLANMultiplexer._debug("__init__ %r %r", address, network)
+        Client.__init__(self, cid)
+        Server.__init__(self, sid)
+
+        self.address = address
+        self.unicast_tuple = address.addrTuple
+        self.broadcast_tuple = address.addrBroadcastTuple
+
+        # one node for the direct and the broadcast traffic
+        self.node = IPNode(address, network)
+        bind(self, self.node)
+
+    def indication(self, pdu):
+        if _debug: VLANMultiplexer._debug("indication %r", pdu)
+
+        if pdu.pduDestination.addrType == Address.localBroadcastAddr:
+            dest = self.broadcast_tuple
+        elif pdu.pduDestination.addrType == Address.localStationAddr:
+            dest = unpack_ip_addr(pdu.pduDestination.addrAddr)
+        else:
+            raise RuntimeError("invalid destination address type")
+
+        self.request(PDU(pdu, source=self.unicast_tuple, destination=dest))
+
+    def confirmation(self, pdu):
+        if _debug: VLANMultiplexer._debug("confirmation %r", pdu)
+
+        src = Address(pdu.pduSource)
+        if pdu.pduDestination == self.broadcast_tuple:
+            dest = LocalBroadcast()
+        else:
+            dest = Address(pdu.pduDestination)
+
+        self.response(PDU(pdu, source=src, destination=dest))
+
+#
+#   _bind_vlan
+#
+
+def _bind_vlan(app, address, network):
+    """Build the BACnet/IP stack of an application on a VLAN node."""
+    app.asap = ApplicationServiceAccessPoint()
+    app.smap = IndexedStateMachineAccessPoint(app.localDevice)
+    app.smap.deviceInfoCache = app.deviceInfoCache
+
+    app.nsap = NetworkServiceAccessPoint()
+    app.nse = NetworkServiceElement()
+    bind(app.nse, app.nsap)
+    bind(app, app.asap, app.smap, app.nsap)
+
+    app.bip = BIPSimple()
+    app.annexj = AnnexJCodec()
+    app.mux = VLANMultiplexer(address, network)
+    bind(app.bip, app.annexj, app.mux)
+
+    app.nsap.bind(app.bip)
+
+#
+#   SimulatedDevice
+#
+
+@bacpypes_debugging
+class SimulatedDevice(Application, WhoIsIAmServices, ReadWritePropertyServices, ReadWritePropertyMultipleServices, DebugContents):
+
+    _debug_contents = ('localAddress', 'latency', 'errorRate', 'restartTime', 'counters')
+
+    def __init__(self, device_instance, address, network,
+            latency=0.0, error_rate=0.0, restart_time=1.0, rng=None):
+        if _debug: SimulatedDevice._debug("__init__ %r %r %r", device_instance, address, network)
+
+        local_device = LocalDeviceObject(
+            objectName='DSC-%d' % (device_instance,),
+            objectIdentifier=('device', device_instance),
+            maxApduLengthAccepted=1476,
+            segmentationSupported='noSegmentation',
+            vendorIdentifier=VENDOR_ID,
+            vendorName='Delta Controls',
+            modelName='DSC-1212E',
+            firmwareRevision='3.40',
+            applicationSoftwareVersion='V3.40 Build 571848',
+            )
+        Application.__init__(self, local_device, address)
+
+        self.latency = latency
+        self.errorRate = error_rate
+        self.restartTime = restart_time
+        self.rng = rng or random.Random()
+
+        # BACnet settings by object type, property and array index
+        self.settings = {}
+        for module, template, array_index in (
+                (bcp, bcp.template_340, bcp.ARRAY_INDEX),
+                (net, net.template_340, net.ARRAY_INDEX_DSC),
+                ):
+            value = Any()
+            value.decode(template.tag_list())
+            self.settings[(module.OBJECT_TYPE, module.PROPERTY_ID, array_index)] = value
+
+        # what happened
+        self.counters = dict(reads=0, writes=0, flashes=0, restarts=0, errors=0)
+
+        # not answering while restarting
+        self.restarting = False
+
+        _bind_vlan(self, self.localAddress, network)
+
+    def indication(self, apdu):
+        if _debug: SimulatedDevice._debug("indication %r", apdu)
+
+        # lights are off
+        if self.restarting:
+            return
+
+        # some requests fail
+        if isinstance(apdu, ConfirmedRequestPDU) and self.errorRate and (self.rng.random() < self.errorRate):
+            self.counters['errors'] += 1
+            self.response(Error(errorClass='device', errorCode='operationalProblem', context=apdu))
+            return
+
+        Application.indication(self, apdu)
+
+    def response(self, apdu):
+        # answer a little later
+        if self.latency:
+            FunctionTask(Application.response, self, apdu).install_task(delta=self.latency)
+        else:
+            Application.response(self, apdu)
+
+    def do_ReadPropertyRequest(self, apdu):
+        if _debug: SimulatedDevice._debug("do_ReadPropertyRequest %r", apdu)
+
+        value = self.settings.get((apdu.objectIdentifier[0], apdu.propertyIdentifier, apdu.propertyArrayIndex))
+        if value is None:
+            ReadWritePropertyServices.do_ReadPropertyRequest(self, apdu)
+            return
+
+        self.counters['reads'] += 1
+
+        resp = ReadPropertyACK(context=apdu)
+        resp.objectIdentifier = apdu.objectIdentifier
+        resp.propertyIdentifier = apdu.propertyIdentifier
+        resp.propertyArrayIndex = apdu.propertyArrayIndex
+        resp.propertyValue = value
+        self.response(resp)
+
+    def do_WritePropertyRequest(self, apdu):
+        if _debug: SimulatedDevice._debug("do_WritePropertyRequest %r", apdu)
+
+        key = (apdu.objectIdentifier[0], apdu.propertyIdentifier, apdu.propertyArrayIndex)
+        if key in self.settings:
+            self.counters['writes'] += 1
+            self.settings[key] = apdu.propertyValue
+
+        elif (apdu.objectIdentifier == self.localDevice.objectIdentifier) and (apdu.propertyIdentifier == SAVE_TO_FLASH):
+            self.counters['flashes'] += 1
+
+        else:
+            ReadWritePropertyServices.do_WritePropertyRequest(self, apdu)
+            return
+
+        self.response(SimpleAckPDU(context=apdu))
+
+    def do_ReinitializeDeviceRequest(self, apdu):
+        if _debug: SimulatedDevice._debug("do_ReinitializeDeviceRequest %r", apdu)
+
+        self.counters['restarts'] += 1
+        self.response(SimpleAckPDU(context=apdu))
+
+        # back after a while, then say so
+        self.restarting = True
+        FunctionTask(self.restarted).install_task(delta=self.latency + self.restartTime)
+
+    def restarted(self):
+        if _debug: SimulatedDevice._debug("restarted")
+
+        self.restarting = False
+        self.i_am()
+
+#
+#   FarmApplication
+#
+
+@bacpypes_debugging
+class FarmApplication(BIPSimpleApplication):
+
+    """A BIPSimpleApplication on the VLAN of the farm, the network is a
+    class attribute of the subclass the farm makes."""
+
+    network = None
+
+    def __init__(self, localDevice, localAddress, deviceInfoCache=None, aseID=None):
+        if _debug: FarmApplication._debug("__init__ %r %r deviceInfoCache=%r aseID=%r", localDevice, localAddress, deviceInfoCache, aseID)
+        ApplicationIOController.__init__(self, localDevice, localAddress, deviceInfoCache, aseID=aseID)
+
+        if not isinstance(localAddress, Address):
+            localAddress = Address(localAddress)
+        self.localAddress = localAddress
+
+        _bind_vlan(self, localAddress, self.network)
+
+    def close_socket(self):
+        if _debug: FarmApplication._debug("close_socket")
+
+        # leave the network
+        self.network.remove_node(self.mux.node)
+
+#
+#   DeltaFarm
+#
+
+@bacpypes_debugging
+class DeltaFarm(DebugContents):
+
+    _debug_contents = ('devices', 'latency', 'errorRate', 'restartTime')
+
+    def __init__(self, count, first_instance=1200, latency=0.0, error_rate=0.0,
+            drop_percent=0.0, restart_time=1.0, seed=None):
+        if _debug: DeltaFarm._debug("__init__ %r", count)
+
+        if count > 250 * 250:
+            raise ValueError("too many devices")
+
+        self.latency = latency
+        self.errorRate = error_rate
+        self.restartTime = restart_time
+        self.rng = random.Random(seed)
+
+        self.network = IPNetwork()
+
+        # applications on the farm take the addresses from 10.0.0.1 up
+        self.next_client = 1
+
+        # devices from 10.0.1.1 up
+        self.devices = []
+        for i in range(count):
+            address = Address('10.0.%d.%d/16' % (i // 250 + 1, i % 250 + 1))
+            self.devices.append(SimulatedDevice(first_instance + i, address, self.network,
+                latency=latency, error_rate=error_rate, restart_time=restart_time,
+                rng=self.rng,
+                ))
+
+        # packets lost
+        self.network.drop_percent = drop_percent
+
+    def application(self, klass, *args, **kwargs):
+        """Make an application of the given class on the farm network, the
+        class must call its base class initializer with super() and take
+        the local address as a keyword argument."""
+        if _debug: DeltaFarm._debug("application %r ...", klass)
+
+        farm_class = type('Farm' + klass.__name__, (klass, FarmApplication), {
+            'network': self.network,
+            })
+
+        # the local address replaces the one from the configuration
+        kwargs['localAddress'] = Address('10.0.0.%d/16' % (self.next_client,))
+        self.next_client += 1
+
+        return farm_class(*args, **kwargs)
+
+    def targets(self):
+        """Device instance and address of every device."""
+        return [(dev.localDevice.objectIdentifier[1], Address(dev.localAddress.addrTuple[0]))
+            for dev in self.devices]
+
+    def counters(self):
+        """Sum of the device counters."""
+        totals = {}
+        for dev in self.devices:
+            for name, value in dev.counters.items():
+                totals[name] = totals.get(name, 0) + value
+        return totals
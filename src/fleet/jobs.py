@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+
+"""
+Jobs
+
+A job is one operation for one device, the same requests the console tools
+send.  Job files are either CSV with a header row or JSON, a list of objects
+or one object per line.  Every job has an 'operation' and an 'address', the
+rest of the columns are parameters of the operation:
+
+    operation,address,device,state,proxy_ip
+    read-net,192.168.5.50,,,
+    write-net,192.168.5.50,,,72.12.96.12
+    save,192.168.5.50,1200,,
+    reinit,192.168.5.50,,warmstart,
+"""
+
+import csv
+import json
+from collections import namedtuple
+
+from bacpypes.debugging import ModuleLogger, xtob
+
+from bacpypes.pdu import Address
+from bacpypes.primitivedata import TagList, ApplicationTag
+from bacpypes.constructeddata import Any
+from bacpypes.apdu import ReadPropertyRequest, WritePropertyRequest, \
+    ReinitializeDeviceRequest, SimpleAckPDU
+
+from decode import bcp, net
+
+# some debugging
+_debug = 0
+_log = ModuleLogger(globals())
+
+# globals
+_operations = {}
+
+# Delta proprietary property of the device object
+SAVE_TO_FLASH = 1151
+
+#
+#   Job
+#
+
+Job = namedtuple('Job', ('index', 'operation', 'address', 'device', 'params'))
+
+#
+#   Operation
+#
+
+Operation = namedtuple('Operation', ('name', 'request', 'response', 'params'))
+
+def register_operation(name, request, response, params=()):
+    """Make an operation available to job files, request(address, **params)
+    builds the request and response(apdu) turns the answer into something
+    that can be written as JSON."""
+    _operations[name] = Operation(name, request, response, tuple(params))
+
+def get_operation(name):
+    """Return the operation with the given name."""
+    operation = _operations.get(name)
+    if not operation:
+        raise ValueError("unknown operation: %r" % (name,))
+    return operation
+
+#
+#   Request builders
+#
+
+def _address(address):
+    """Addresses come from job files as strings or from the application."""
+    if isinstance(address, Address):
+        return address
+    return Address(address)
+
+def read_settings_request(address, module, array_index):
+    """Read the BACnet settings property described by a decoding module."""
+    request = ReadPropertyRequest(
+        objectIdentifier=(module.OBJECT_TYPE, module.OBJECT_INSTANCE),
+        propertyIdentifier=module.PROPERTY_ID,
+        )
+    request.pduDestination = _address(address)
+    request.propertyArrayIndex = array_index
+
+    return request
+
+def save_to_flash_request(address, device_instance):
+    """Ask a Delta controller to save its settings to flash."""
+    request = WritePropertyRequest(
+        objectIdentifier=('device', int(device_instance)),
+        propertyIdentifier=SAVE_TO_FLASH,
+        )
+    request.pduDestination = _address(address)
+
+    # send an Enumerated value of 1 means SaveToFlash
+    request.propertyValue = Any()
+    request.propertyValue.decode(TagList([
+        ApplicationTag(9, xtob('01'))
+        ]))
+
+    return request
+
+def reinitialize_request(address, state, password=None):
+    """Reinitialize a device, the state is coldstart, warmstart, etc."""
+    request = ReinitializeDeviceRequest(
+        reinitializedStateOfDevice=state,
+        )
+    if password:
+        request.password = password
+    request.pduDestination = _address(address)
+
+    return request
+
+#
+#   Operations
+#
+
+def _unsigned(value):
+    """Unsigned parameters can be written in hex, 0x9e3b."""
+    if isinstance(value, basestring):
+        return int(value, 0)
+    return int(value)
+
+def _settings(settings):
+    """The decoded settings without the raw tags."""
+    result = settings._asdict()
+    del result['tags']
+    return result
+
+def _ack(apdu):
+    if not isinstance(apdu, SimpleAckPDU):
+        raise TypeError("not an ack")
+    return "ack"
+
+def _write_request(template):
+    def request(address, array_index=None, **values):
+        for name in ('net_number', 'ip_type', 'ip_port', 'foreign_ttl'):
+            if name in values:
+                values[name] = _unsigned(values[name])
+        if array_index is not None:
+            array_index = int(array_index)
+        return template.request(address, array_index, **values)
+    return request
+
+register_operation('read-bcp',
+    lambda address: read_settings_request(address, bcp, bcp.ARRAY_INDEX),
+    lambda apdu: _settings(bcp.dcode(apdu)),
+    )
+register_operation('read-net',
+    lambda address, array_index=net.ARRAY_INDEX_DSC: read_settings_request(address, net, int(array_index)),
+    lambda apdu: _settings(net.dcode(apdu)),
+    ('array_index',),
+    )
+register_operation('write-bcp',
+    _write_request(bcp.template_340), _ack,
+    ('array_index',) + tuple(bcp.template_340.encoders),
+    )
+register_operation('write-net',
+    _write_request(net.template_340), _ack,
+    ('array_index',) + tuple(net.template_340.encoders),
+    )
+register_operation('save', save_to_flash_request, _ack, ('device_instance',))
+register_operation('reinit', reinitialize_request, _ack, ('state', 'password'))
+
+#
+#   load_jobs
+#
+
+# columns with other names for the operation parameters
+_aliases = {
+    'device': 'device_instance',
+    'index': 'array_index',
+    }
+
+def load_jobs(path):
+    """Read a job file, the format comes from the extension."""
+    if _debug: _log.debug("load_jobs %r", path)
+
+    with open(path, 'rb') as f:
+        if path.lower().endswith('.csv'):
+            rows = list(csv.DictReader(f))
+        else:
+            text = f.read().strip()
+            if text.startswith('['):
+                rows = json.loads(text)
+            else:
+                rows = [json.loads(line) for line in text.splitlines() if line.strip()]
+
+    return [make_job(index, row) for index, row in enumerate(rows)]
+
+def make_job(index, row):
+    """Check a row and turn it into a job, empty columns are left out."""
+    params = {}
+    for key, value in row.items():
+        if (value is None) or (value == ''):
+            continue
+        key = str(key).strip()
+        params[_aliases.get(key, key)] = value
+
+    try:
+        operation = get_operation(params.pop('operation', None))
+        address = params.pop('address')
+    except KeyError:
+        raise ValueError("job %d: no address" % (index,))
+    except ValueError as err:
+        raise ValueError("job %d: %s" % (index, err))
+
+    # every job can name the device, it is reported with the result
+    device = params.pop('device_instance', None)
+    if device is not None:
+        device = int(device)
+        if 'device_instance' in operation.params:
+            params['device_instance'] = device
+
+    for key in params:
+        if key not in operation.params:
+            raise ValueError("job %d: %s does not take %r" % (index, operation.name, key))
+
+    return Job(index, operation, address, device, params)
@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+
+"""
+Profile
+
+The DeviceProfileController reads the identification properties of a device
+object in one ReadPropertyMultipleRequest.  When the device does not support
+it the properties are read with ReadPropertyRequests that are all sent at
+once, and the device is remembered so the next fetch goes straight to them.
+
+    iocb = IOCB(address, device_instance)
+    iocb.add_callback(profile_ack)
+    profile_controller.request_io(iocb)
+
+The response is a DeviceProfile.
+"""
+
+from collections import namedtuple
+
+from bacpypes.debugging import bacpypes_debugging, ModuleLogger, DebugContents
+from bacpypes.iocb import IOCB, IOController, IOGroup
+
+from bacpypes.object import get_datatype
+from bacpypes.apdu import ReadPropertyRequest, ReadPropertyMultipleRequest, \
+    ReadPropertyMultipleACK, PropertyReference, ReadAccessSpecification, \
+    RejectPDU, AbortPDU, Error
+from bacpypes.primitivedata import Unsigned
+from bacpypes.constructeddata import Array
+
+# some debugging
+_debug = 0
+_log = ModuleLogger(globals())
+
+# properties of the device object that identify it
+PROFILE_PROPERTIES = (
+    'objectName', 'vendorName', 'modelName',
+    'firmwareRevision', 'applicationSoftwareVersion',
+    )
+
+# abort reasons that mean the answer will not fit, try one at a time
+_too_big = (1, 4)       # bufferOverflow, segmentationNotSupported
+
+#
+#   DeviceProfile
+#
+
+DeviceProfile = namedtuple('DeviceProfile',
+    ('deviceInstance', 'address', 'rpm') + PROFILE_PROPERTIES + ('errors',)
+    )
+
+#
+#   cast_value
+#
+
+def cast_value(obj_type, prop_id, array_index, value):
+    """Turn the Any of a property value into its datatype."""
+    datatype = get_datatype(obj_type, prop_id)
+    if not datatype:
+        raise TypeError("unknown datatype")
+
+    # special case for array parts, others are managed by cast_out
+    if issubclass(datatype, Array) and (array_index is not None):
+        if array_index == 0:
+            return value.cast_out(Unsigned)
+        else:
+            return value.cast_out(datatype.subtype)
+    else:
+        return value.cast_out(datatype)
+
+#
+#   rpm_unsupported
+#
+
+def rpm_unsupported(err):
+    """Return True if the error means the device cannot answer the
+    ReadPropertyMultipleRequest."""
+    if isinstance(err, RejectPDU):
+        return True
+    if isinstance(err, AbortPDU):
+        return err.apduAbortRejectReason in _too_big
+    if isinstance(err, Error):
+        return err.errorClass == 'services'
+    return False
+
+#
+#   DeviceProfileController
+#
+
+@bacpypes_debugging
+class DeviceProfileController(IOController, DebugContents):
+
+    _debug_contents = ('controller', 'properties', 'noRPM')
+
+    def __init__(self, controller, properties=PROFILE_PROPERTIES):
+        """The controller is the application or anything else that accepts
+        request_io(), like an IOCBScheduler."""
+        if _debug: DeviceProfileController._debug("__init__ %r %r", controller, properties)
+        IOController.__init__(self)
+
+        for prop_id in properties:
+            if prop_id not in PROFILE_PROPERTIES:
+                raise ValueError("not a profile property: %r" % (prop_id,))
+
+        self.controller = controller
+        self.properties = tuple(properties)
+
+        # devices known to reject ReadPropertyMultiple
+        self.noRPM = set()
+
+    def process_io(self, iocb):
+        if _debug: DeviceProfileController._debug("process_io %r", iocb)
+
+        address, device_instance = iocb.args
+
+        # this is now an active request
+        self.active_io(iocb)
+
+        if address in self.noRPM:
+            self._read_each(iocb)
+        else:
+            self._read_multiple(iocb)
+
+    def _read_multiple(self, iocb):
+        if _debug: DeviceProfileController._debug("_read_multiple %r", iocb)
+
+        address, device_instance = iocb.args
+
+        # one request for all of them
+        request = ReadPropertyMultipleRequest(
+            listOfReadAccessSpecs=[
+                ReadAccessSpecification(
+                    objectIdentifier=('device', device_instance),
+                    listOfPropertyReferences=[
+                        PropertyReference(propertyIdentifier=prop_id)
+                        for prop_id in self.properties
+                        ],
+                    ),
+                ],
+            )
+        request.pduDestination = address
+        if _debug: DeviceProfileController._debug("    - request: %r", request)
+
+        rpm_iocb = IOCB(request)
+        rpm_iocb.add_callback(self._read_multiple_ack, iocb)
+
+        self.controller.request_io(rpm_iocb)
+
+    def _read_multiple_ack(self, rpm_iocb, iocb):
+        if _debug: DeviceProfileController._debug("_read_multiple_ack %r %r", rpm_iocb, iocb)
+
+        address, device_instance = iocb.args
+
+        if rpm_iocb.ioError:
+            if rpm_unsupported(rpm_iocb.ioError):
+                if _debug: DeviceProfileController._debug("    - no RPM: %r", rpm_iocb.ioError)
+                self.noRPM.add(address)
+                self._read_each(iocb)
+            else:
+                self.abort_io(iocb, rpm_iocb.ioError)
+            return
+
+        apdu = rpm_iocb.ioResponse
+        if not isinstance(apdu, ReadPropertyMultipleACK):
+            self.abort_io(iocb, TypeError("not a ReadPropertyMultipleACK"))
+            return
+
+        values = {}
+        errors = {}
+        try:
+            for result in apdu.listOfReadAccessResults:
+                obj_type = result.objectIdentifier[0]
+
+                for element in result.listOfResults:
+                    prop_id = element.propertyIdentifier
+                    read_result = element.readResult
+
+                    if read_result.propertyAccessError is not None:
+                        errors[prop_id] = str(read_result.propertyAccessError)
+                    else:
+                        values[prop_id] = cast_value(obj_type, prop_id,
+                            element.propertyArrayIndex, read_result.propertyValue)
+        except Exception as err:
+            self.abort_io(iocb, err)
+            return
+
+        self.complete_io(iocb, self._profile(iocb, True, values, errors))
+
+    def _read_each(self, iocb):
+        if _debug: DeviceProfileController._debug("_read_each %r", iocb)
+
+        address, device_instance = iocb.args
+
+        # pipeline the reads, the controller limits how many are in flight
+        group = IOGroup()
+        for prop_id in self.properties:
+            request = ReadPropertyRequest(
+                objectIdentifier=('device', device_instance),
+                propertyIdentifier=prop_id,
+                )
+            request.pduDestination = address
+
+            read_iocb = IOCB(request)
+            group.add(read_iocb)
+            self.controller.request_io(read_iocb)
+
+        group.add_callback(self._read_each_ack, iocb)
+
+    def _read_each_ack(self, group, iocb):
+        if _debug: DeviceProfileController._debug("_read_each_ack %r %r", group, iocb)
+
+        values = {}
+        errors = {}
+        for prop_id, read_iocb in zip(self.properties, group.ioMembers):
+            if read_iocb.ioError:
+                errors[prop_id] = str(read_iocb.ioError)
+                continue
+
+            apdu = read_iocb.ioResponse
+            try:
+                values[prop_id] = cast_value(apdu.objectIdentifier[0],
+                    apdu.propertyIdentifier, apdu.propertyArrayIndex, apdu.propertyValue)
+            except Exception as err:
+                errors[prop_id] = str(err)
+
+        # every one of them failed
+        if errors and not values:
+            self.abort_io(iocb, group.ioMembers[0].ioError or RuntimeError(errors))
+            return
+
+        self.complete_io(iocb, self._profile(iocb, False, values, errors))
+
+    def _profile(self, iocb, rpm, values, errors):
+        address, device_instance = iocb.args
+
+        return DeviceProfile(device_instance, address, rpm,
+            *[values.get(prop_id) for prop_id in PROFILE_PROPERTIES],
+            errors=errors
+            )
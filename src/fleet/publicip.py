@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+
+"""
+Public IP
+
+The PublicIPResolver is an IOController that answers with the public IP
+address of this site.  Lookups run in a worker thread so the event loop is
+never blocked by HTTP, the answer is handed back through deferred() and
+cached for a while.  Several providers can be asked and an address is only
+accepted when a quorum of them agree.
+"""
+
+import threading
+from json import loads
+from time import time as _time
+from urllib2 import urlopen
+
+from bacpypes.debugging import bacpypes_debugging, ModuleLogger, DebugContents
+from bacpypes.core import deferred
+from bacpypes.iocb import IOController
+
+# some debugging
+_debug = 0
+_log = ModuleLogger(globals())
+
+# default providers, the first one is what the proxy checker always used
+DEFAULT_PROVIDERS = [
+    'http://jsonip.com',
+    'https://api.ipify.org?format=json',
+    'http://ipv4.icanhazip.com',
+    ]
+
+#
+#   validate_ip
+#
+
+def validate_ip(s):
+    """Return True if the string is a dotted IPv4 address."""
+    a = s.split('.')
+    if len(a) != 4:
+        return False
+    for x in a:
+        if not x.isdigit():
+            return False
+        i = int(x)
+        if i < 0 or i > 255:
+            return False
+
+    return True
+
+#
+#   PublicIPResolver
+#
+
+@bacpypes_debugging
+class PublicIPResolver(IOController, DebugContents):
+
+    _debug_contents = ('providers', 'quorum', 'ttl', 'timeout', 'cached', 'expires')
+
+    def __init__(self, providers=None, quorum=1, ttl=300.0, timeout=5.0):
+        if _debug: PublicIPResolver._debug("__init__ providers=%r quorum=%r ttl=%r timeout=%r", providers, quorum, ttl, timeout)
+        IOController.__init__(self)
+
+        self.providers = list(providers or DEFAULT_PROVIDERS)
+        if not (1 <= quorum <= len(self.providers)):
+            raise ValueError("quorum must be between one and the number of providers")
+
+        self.quorum = quorum
+        self.ttl = ttl
+        self.timeout = timeout
+
+        # last answer and when it goes stale
+        self.cached = None
+        self.expires = 0.0
+
+        # requests waiting for the lookup in progress
+        self.waiting = []
+        self.worker = None
+
+    def process_io(self, iocb):
+        if _debug: PublicIPResolver._debug("process_io %r", iocb)
+
+        # fresh answer
+        if self.cached and (_time() < self.expires):
+            self.complete_io(iocb, self.cached)
+            return
+
+        # wait for the lookup, only one at a time
+        self.active_io(iocb)
+        self.waiting.append(iocb)
+        if self.worker:
+            return
+
+        self.worker = threading.Thread(target=self._lookup, name="public ip")
+        self.worker.daemon = True
+        self.worker.start()
+
+    def fetch(self, url):
+        """Ask one provider, the body is either JSON with an 'ip' member or
+        just the address."""
+        if _debug: PublicIPResolver._debug("fetch %r", url)
+
+        body = urlopen(url, timeout=self.timeout).read().strip()
+        if body.startswith('{'):
+            body = loads(body)['ip']
+
+        return str(body)
+
+    def _lookup(self):
+        """Ask the providers in turn until enough of them agree, runs in the
+        worker thread."""
+        if _debug: PublicIPResolver._debug("_lookup")
+
+        votes = {}
+        errors = []
+        for url in self.providers:
+            try:
+                ip = self.fetch(url)
+                if not validate_ip(ip):
+                    raise ValueError("invalid address from %s: %r" % (url, ip))
+            except Exception as err:
+                if _debug: PublicIPResolver._debug("    - %s: %r", url, err)
+                errors.append(err)
+                continue
+
+            votes[ip] = votes.get(ip, 0) + 1
+            if votes[ip] >= self.quorum:
+                deferred(self._lookup_complete, ip, None)
+                return
+
+        if errors and not votes:
+            err = errors[-1]
+        else:
+            err = RuntimeError("no quorum: %r" % (votes,))
+        deferred(self._lookup_complete, None, err)
+
+    def _lookup_complete(self, ip, err):
+        if _debug: PublicIPResolver._debug("_lookup_complete %r %r", ip, err)
+
+        self.worker = None
+        if ip:
+            self.cached = ip
+            self.expires = _time() + self.ttl
+
+        # give everybody waiting the answer
+        waiting, self.waiting = self.waiting, []
+        for iocb in waiting:
+            if ip:
+                self.complete_io(iocb, ip)
+            else:
+                self.abort_io(iocb, err)
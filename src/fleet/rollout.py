@@ -0,0 +1,329 @@
+#!/usr/bin/env python
+
+"""
+Rollout
+
+A Rollout saves the settings of a set of devices to flash and restarts
+them, a wave at a time.  The requests of a wave are sent through an
+IOCBScheduler so a limited number are in flight, and a restarted device must
+pass a health gate before the deadline: it sends an I-Am, or answers a
+ReadProperty of its system status.  The next wave starts when every device
+of the wave is done, unless too many of them failed, then the rest of the
+devices are skipped.
+
+Progress is reported as each device moves along by calling the progress
+function with a dictionary that can be written as JSON.
+"""
+
+from time import time as _time
+
+from bacpypes.debugging import bacpypes_debugging, ModuleLogger, DebugContents
+from bacpypes.iocb import IOCB
+from bacpypes.task import FunctionTask
+
+from bacpypes.apdu import ReadPropertyRequest, SimpleAckPDU
+
+from engine.dispatch import defer, APPLICATION
+from fleet.scheduler import IOCBScheduler
+from fleet.jobs import save_to_flash_request, reinitialize_request
+
+# some debugging
+_debug = 0
+_log = ModuleLogger(globals())
+
+# operations in the order they are done
+OPERATIONS = ('save', 'reinit')
+
+# ways to tell a restarted device is back
+HEALTH_CHECKS = ('iam', 'read')
+
+#
+#   RolloutDevice
+#
+
+@bacpypes_debugging
+class RolloutDevice(DebugContents):
+
+    _debug_contents = ('deviceInstance', 'address', 'wave', 'status', 'error')
+
+    def __init__(self, device_instance, address, wave):
+        if _debug: RolloutDevice._debug("__init__ %r %r %r", device_instance, address, wave)
+
+        self.deviceInstance = device_instance
+        self.address = address
+        self.wave = wave
+
+        # operations still to do
+        self.operations = []
+
+        # pending, running, restarting while waiting for the health gate,
+        # then ok, failed or skipped
+        self.status = 'pending'
+        self.error = None
+
+        # when it started and when it was restarted
+        self.started = None
+        self.restarted = None
+
+        # health gate tasks
+        self.deadline_task = None
+        self.poll_task = None
+
+#
+#   Rollout
+#
+
+@bacpypes_debugging
+class Rollout(DebugContents):
+
+    _debug_contents = ('operations', 'waveSize', 'health', 'deadline', 'settle', 'interval', 'maxFailures', 'wave')
+
+    def __init__(self, controller, targets, operations=OPERATIONS,
+            wave_size=10, concurrency=None, state='warmstart', password=None,
+            health='iam', deadline=120.0, settle=5.0, interval=5.0,
+            max_failures=0, progress=None, done=None):
+        """The controller is the application, the targets are a list of
+        (device instance, address) tuples."""
+        if _debug: Rollout._debug("__init__ %r (%d targets) %r wave_size=%r concurrency=%r", controller, len(targets), operations, wave_size, concurrency)
+
+        for operation in operations:
+            if operation not in OPERATIONS:
+                raise ValueError("unknown operation: %r" % (operation,))
+        if health not in HEALTH_CHECKS:
+            raise ValueError("unknown health check: %r" % (health,))
+        if wave_size < 1:
+            raise ValueError("wave size must be at least one")
+
+        self.operations = [operation for operation in OPERATIONS if operation in operations]
+        self.waveSize = wave_size
+        self.state = state
+        self.password = password
+        self.health = health
+        self.deadline = deadline
+        self.settle = settle
+        self.interval = interval
+        self.maxFailures = max_failures
+
+        self.progress = progress
+        self.done = done
+
+        # requests of a wave go through the scheduler, one at a time to
+        # each device
+        self.scheduler = IOCBScheduler(controller, concurrency or wave_size, 1)
+
+        # split the devices into waves
+        self.devices = {}
+        self.waves = []
+        for i, (device_instance, address) in enumerate(targets):
+            if i % wave_size == 0:
+                self.waves.append([])
+            dev = RolloutDevice(device_instance, address, len(self.waves))
+            self.devices[device_instance] = dev
+            self.waves[-1].append(dev)
+
+        # current wave number and the devices of it not done yet
+        self.wave = 0
+        self.unfinished = set()
+        self.failures = 0
+
+    def start(self):
+        if _debug: Rollout._debug("start")
+
+        self.next_wave()
+
+    def next_wave(self):
+        if _debug: Rollout._debug("next_wave")
+
+        # all done
+        if self.wave >= len(self.waves):
+            counts = {}
+            for dev in self.devices.values():
+                counts[dev.status] = counts.get(dev.status, 0) + 1
+            self.report('finished', None, **counts)
+            if self.done:
+                self.done()
+            return
+
+        wave = self.waves[self.wave]
+        self.wave += 1
+        self.failures = 0
+        self.unfinished = set(dev.deviceInstance for dev in wave)
+
+        self.report('wave', None, wave=self.wave, waves=len(self.waves), devices=len(wave))
+
+        for dev in wave:
+            dev.status = 'running'
+            dev.started = _time()
+            dev.operations = list(self.operations)
+            self.next_operation(dev)
+
+    def next_operation(self, dev):
+        if _debug: Rollout._debug("next_operation %r", dev)
+
+        if not dev.operations:
+            self.finish(dev, 'ok')
+            return
+
+        operation = dev.operations.pop(0)
+        if operation == 'save':
+            request = save_to_flash_request(dev.address, dev.deviceInstance)
+        else:
+            request = reinitialize_request(dev.address, self.state, self.password)
+        if _debug: Rollout._debug("    - request: %r", request)
+
+        # make an IOCB
+        iocb = IOCB(request)
+
+        # set a callback for the response
+        iocb.add_callback(self.operation_ack, dev, operation)
+
+        # the scheduler sends it when there is room
+        self.scheduler.request_io(iocb)
+
+    def operation_ack(self, iocb, dev, operation):
+        if _debug: Rollout._debug("operation_ack %r %r %r", iocb, dev, operation)
+
+        # do something for error/reject/abort
+        if iocb.ioError:
+            self.finish(dev, 'failed', "%s: %s" % (operation, iocb.ioError))
+            return
+
+        # should be an ack
+        if not isinstance(iocb.ioResponse, SimpleAckPDU):
+            self.finish(dev, 'failed', "%s: not an ack" % (operation,))
+            return
+
+        self.report(operation, dev)
+
+        if operation == 'reinit':
+            self.wait_for_health(dev)
+        else:
+            self.next_operation(dev)
+
+    def wait_for_health(self, dev):
+        if _debug: Rollout._debug("wait_for_health %r", dev)
+
+        dev.status = 'restarting'
+        dev.restarted = _time()
+
+        # give up when the deadline passes
+        dev.deadline_task = FunctionTask(self.health_timeout, dev)
+        dev.deadline_task.install_task(delta=self.deadline)
+
+        # poll after the device had a chance to start restarting
+        if self.health == 'read':
+            dev.poll_task = FunctionTask(self.health_poll, dev)
+            dev.poll_task.install_task(delta=self.settle)
+
+    def health_poll(self, dev):
+        if _debug: Rollout._debug("health_poll %r", dev)
+
+        dev.poll_task = None
+        if dev.status != 'restarting':
+            return
+
+        # build a request
+        request = ReadPropertyRequest(
+            objectIdentifier=('device', dev.deviceInstance),
+            propertyIdentifier='systemStatus',
+            )
+        request.pduDestination = dev.address
+
+        # make an IOCB
+        iocb = IOCB(request)
+
+        # set a callback for the response
+        iocb.add_callback(self.health_ack, dev)
+
+        # the scheduler sends it when there is room
+        self.scheduler.request_io(iocb)
+
+    def health_ack(self, iocb, dev):
+        if _debug: Rollout._debug("health_ack %r %r", iocb, dev)
+
+        if dev.status != 'restarting':
+            return
+
+        if iocb.ioError:
+            # not back yet, try again a little later
+            dev.poll_task = FunctionTask(self.health_poll, dev)
+            dev.poll_task.install_task(delta=self.interval)
+            return
+
+        self.healthy(dev, 'read')
+
+    def i_am(self, apdu):
+        """Pass the I-Am's received by the application, a restarted device
+        usually says it is back."""
+        if _debug: Rollout._debug("i_am %r", apdu)
+
+        dev = self.devices.get(apdu.iAmDeviceIdentifier[1])
+        if dev and (dev.status == 'restarting'):
+            dev.address = apdu.pduSource
+            self.healthy(dev, 'iam')
+
+    def healthy(self, dev, how):
+        if _debug: Rollout._debug("healthy %r %r", dev, how)
+
+        self.report('healthy', dev, check=how, restart=round(_time() - dev.restarted, 3))
+        self.next_operation(dev)
+
+    def health_timeout(self, dev):
+        if _debug: Rollout._debug("health_timeout %r", dev)
+
+        dev.deadline_task = None
+        if dev.status == 'restarting':
+            self.finish(dev, 'failed', "not back after %ss" % (self.deadline,))
+
+    def finish(self, dev, status, error=None):
+        if _debug: Rollout._debug("finish %r %r %r", dev, status, error)
+
+        if dev.deviceInstance not in self.unfinished:
+            return
+        self.unfinished.discard(dev.deviceInstance)
+
+        dev.status = status
+        dev.error = error
+
+        # clean up the health gate
+        for task in (dev.deadline_task, dev.poll_task):
+            if task and task.isScheduled:
+                task.suspend_task()
+        dev.deadline_task = dev.poll_task = None
+
+        self.report(status, dev, elapsed=round(_time() - dev.started, 3))
+
+        if status == 'failed':
+            self.failures += 1
+
+        # wait for the rest of the wave
+        if self.unfinished:
+            return
+
+        # too many failures, leave the rest alone
+        if self.failures > self.maxFailures:
+            self.report('halted', None, wave=self.wave, failures=self.failures)
+            for wave in self.waves[self.wave:]:
+                for dev in wave:
+                    dev.status = 'skipped'
+                    self.report('skipped', dev)
+            self.wave = len(self.waves)
+
+        defer(APPLICATION, self.next_wave)
+
+    def report(self, event, dev, **kwargs):
+        if _debug: Rollout._debug("report %r %r %r", event, dev, kwargs)
+
+        if not self.progress:
+            return
+
+        line = {'event': event}
+        if dev:
+            line['device'] = dev.deviceInstance
+            line['address'] = str(dev.address)
+            line['wave'] = dev.wave
+            if dev.error:
+                line['error'] = dev.error
+        line.update(kwargs)
+
+        self.progress(line)
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+
+"""
+Scheduler
+
+The IOCBScheduler sits in front of an IOController (usually the application)
+and limits how many requests are in flight, both in total and for each
+device.  Requests beyond the limits wait in a FIFO queue for each device and
+devices with work are serviced round-robin.
+
+With no limit for each device, max_per_device=None, it only limits the total,
+which is what goes in front of a WindowedIOController, the window of the
+device is the limit for each device there.
+"""
+
+from collections import deque
+
+from bacpypes.debugging import bacpypes_debugging, ModuleLogger, DebugContents
+
+from engine.dispatch import defer, APPLICATION
+
+# some debugging
+_debug = 0
+_log = ModuleLogger(globals())
+
+#
+#   IOCBScheduler
+#
+
+@bacpypes_debugging
+class IOCBScheduler(DebugContents):
+
+    _debug_contents = ('maxOutstanding', 'maxPerDevice', 'outstanding')
+
+    def __init__(self, controller, max_outstanding=16, max_per_device=1):
+        if _debug: IOCBScheduler._debug("__init__ %r max_outstanding=%r max_per_device=%r", controller, max_outstanding, max_per_device)
+
+        if (max_outstanding < 1) or ((max_per_device is not None) and (max_per_device < 1)):
+            raise ValueError("limits must be at least one")
+
+        # the controller that does the real work
+        self.controller = controller
+
+        # limits
+        self.maxOutstanding = max_outstanding
+        self.maxPerDevice = max_per_device
+
+        # number of requests given to the controller and not yet complete
+        self.outstanding = 0
+        self.active = {}
+
+        # requests waiting for each device, and the devices with work that
+        # are not blocked by their own limit
+        self.pending = {}
+        self.ready = deque()
+        self._ready = set()
+
+    def request_io(self, iocb, key=None):
+        """Queue a request, the key identifies the device and defaults to
+        the destination address of the request."""
+        if _debug: IOCBScheduler._debug("request_io %r key=%r", iocb, key)
+
+        if key is None:
+            key = iocb.args[0].pduDestination
+
+        # add it to the end of the queue for this device
+        queue = self.pending.get(key)
+        if queue is None:
+            queue = self.pending[key] = deque()
+        queue.append(iocb)
+
+        # maybe this device can go now
+        self._make_ready(key)
+
+        # launch what is allowed
+        self._pump()
+
+    def pending_count(self):
+        """Return the number of requests waiting to be sent."""
+        return sum(len(queue) for queue in self.pending.values())
+
+    def _make_ready(self, key):
+        if key in self._ready:
+            return
+        if not self.pending.get(key):
+            return
+        if (self.maxPerDevice is not None) and (self.active.get(key, 0) >= self.maxPerDevice):
+            return
+
+        self.ready.append(key)
+        self._ready.add(key)
+
+    def _pump(self):
+        if _debug: IOCBScheduler._debug("_pump")
+
+        while self.ready and (self.outstanding < self.maxOutstanding):
+            key = self.ready.popleft()
+            self._ready.discard(key)
+
+            queue = self.pending[key]
+            iocb = queue.popleft()
+            if not queue:
+                del self.pending[key]
+
+            # give it to the controller
+            self._launch(key, iocb)
+
+            # back of the line if it has more to do
+            self._make_ready(key)
+
+    def _launch(self, key, iocb):
+        if _debug: IOCBScheduler._debug("_launch %r %r", key, iocb)
+
+        self.outstanding += 1
+        self.active[key] = self.active.get(key, 0) + 1
+
+        # free the slot when it is done
+        iocb.add_callback(self._complete, key)
+
+        # send it along
+        self.controller.request_io(iocb)
+
+    def _complete(self, iocb, key):
+        if _debug: IOCBScheduler._debug("_complete %r %r", iocb, key)
+
+        self.outstanding -= 1
+        count = self.active[key] - 1
+        if count:
+            self.active[key] = count
+        else:
+            del self.active[key]
+
+        # this device may have room again
+        self._make_ready(key)
+
+        # launch the next batch outside of the callback chain
+        defer(APPLICATION, self._pump)
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+
+"""
+Shard
+
+One process with one stack spends its time encoding and decoding APDU's long
+before the network is busy.  The Supervisor splits the jobs into shards, one
+for each worker process, every worker has its own stack on its own UDP port
+(the port of the INI address plus the worker number) and sends each result
+line back to the parent through a pipe as soon as it has it, the parent
+writes them all to the one output.
+
+The jobs of a device all go to the same worker, so the limit of requests in
+flight to each device still holds, and the jobs carry the device addresses
+so the workers never send a Who-Is.  The workers are processes, the stack
+must not be made in the parent before they are started.
+"""
+
+import os
+import json
+import select
+
+from multiprocessing import Process, Pipe
+
+from bacpypes.debugging import bacpypes_debugging, ModuleLogger, DebugContents
+
+# some debugging
+_debug = 0
+_log = ModuleLogger(globals())
+
+# the BACnet/IP port when the address does not have one
+BACNET_PORT = 47808
+
+#
+#   shard_jobs
+#
+
+def shard_jobs(jobs, count):
+    """Split the jobs into count shards, the jobs of an address stay
+    together and the biggest groups are handed out first to balance the
+    shards."""
+    groups = {}
+    for job in jobs:
+        groups.setdefault(str(job.address), []).append(job)
+
+    shards = [[] for i in range(count)]
+    for address, group in sorted(groups.items(), key=lambda item: (-len(item[1]), item[0])):
+        min(shards, key=len).extend(group)
+
+    # keep the order of the job file in each shard
+    for shard in shards:
+        shard.sort(key=lambda job: job.index)
+
+    return shards
+
+#
+#   shard_address
+#
+
+def shard_address(address, index):
+    """Return the local address of a worker, the same host and mask on the
+    port after the one of the address, 192.168.1.10/24 and 1 gives
+    192.168.1.10/24:47809."""
+    if ':' in address:
+        host, port = address.rsplit(':', 1)
+        port = int(port)
+    else:
+        host, port = address, BACNET_PORT
+
+    return "%s:%d" % (host, port + index)
+
+#
+#   PipeOutput
+#
+
+class PipeOutput:
+
+    """A file for the output of a worker, each line is sent to the parent."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.buffer = ''
+
+    def write(self, text):
+        self.buffer += text
+        while '\n' in self.buffer:
+            line, self.buffer = self.buffer.split('\n', 1)
+            self.conn.send(('line', line))
+
+    def flush(self):
+        pass
+
+#
+#   Supervisor
+#
+
+@bacpypes_debugging
+class Supervisor(DebugContents):
+
+    _debug_contents = ('workers', 'lines', 'failed')
+
+    def __init__(self, target, shards, output):
+        """The target is called in each worker process with the worker
+        number, its shard of the jobs and a PipeOutput."""
+        if _debug: Supervisor._debug("__init__ %r (%d shards) %r", target, len(shards), output)
+
+        self.target = target
+        self.shards = shards
+        self.output = output
+
+        # lines written and the workers that did not finish
+        self.workers = []
+        self.lines = 0
+        self.failed = []
+
+    def run(self):
+        """Start the workers and write their lines until they are all done,
+        return the number of the workers that failed."""
+        if _debug: Supervisor._debug("run")
+
+        conns = {}
+        for index, shard in enumerate(self.shards):
+            if not shard:
+                continue
+
+            parent_conn, child_conn = Pipe(duplex=False)
+            process = Process(target=self._worker, args=(index, shard, child_conn))
+            process.daemon = True
+            process.start()
+
+            # the parent only reads
+            child_conn.close()
+
+            self.workers.append(process)
+            conns[parent_conn.fileno()] = (index, parent_conn, set(job.index for job in shard))
+
+        while conns:
+            readable, writable, errors = select.select(list(conns), [], [])
+            for fd in readable:
+                index, conn, pending = conns[fd]
+                try:
+                    kind, value = conn.recv()
+                except EOFError:
+                    kind, value = 'exit', None
+
+                if kind == 'line':
+                    self.write(value)
+                    try:
+                        pending.discard(json.loads(value).get('job'))
+                    except ValueError:
+                        pass
+                    continue
+
+                # done or gone, the jobs without a result failed
+                if kind == 'error':
+                    Supervisor._error("worker %d: %s", index, value)
+                if pending:
+                    self.failed.append(index)
+                    for job_index in sorted(pending):
+                        self.write(json.dumps({
+                            'job': job_index,
+                            'ok': False,
+                            'error': "worker %d did not finish" % (index,),
+                            }, sort_keys=True))
+
+                conn.close()
+                del conns[fd]
+
+        for process in self.workers:
+            process.join()
+
+        return len(self.failed)
+
+    def write(self, line):
+        self.output.write(line + '\n')
+        self.output.flush()
+        self.lines += 1
+
+    def _worker(self, index, shard, conn):
+        if _debug: Supervisor._debug("_worker %r (%d jobs) pid=%r", index, len(shard), os.getpid())
+
+        try:
+            self.target(index, shard, PipeOutput(conn))
+            conn.send(('done', None))
+        except Exception as err:
+            Supervisor._exception("worker %d: %s", index, err)
+            conn.send(('error', str(err)))
+        finally:
+            conn.close()
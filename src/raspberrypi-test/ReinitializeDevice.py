@@ -13,7 +13,6 @@ from bacpypes.debugging import bacpypes_debugging, ModuleLogger
 from bacpypes.consolelogging import ConfigArgumentParser
 from bacpypes.consolecmd import ConsoleCmd
 
-from bacpypes.core import run, enable_sleeping
 from bacpypes.iocb import IOCB
 
 from bacpypes.pdu import Address
@@ -23,6 +22,9 @@ from bacpypes.service.device import LocalDeviceObject
 
 from bacpypes.apdu import ReinitializeDeviceRequest, SimpleAckPDU
 
+import engine
+from engine.loop import run
+
 # some debugging
 _debug = 0
 _log = ModuleLogger(globals())
@@ -93,6 +95,9 @@ def main():
     if _debug: _log.debug("initialization")
     if _debug: _log.debug("    - args: %r", args)
 
+    # the engine changes to the library, before any PDU is made
+    engine.install()
+
     # make a device object
     this_device = LocalDeviceObject(
         objectName=args.ini.objectname,
@@ -123,9 +128,6 @@ def main():
     this_console = ReinitDeviceConsoleCmd()
     if _debug: _log.debug("    - this_console: %r", this_console)
 
-    # enable sleeping will help with threads
-    enable_sleeping()
-
     _log.debug("running")
 
     run()